@@ -69,6 +69,15 @@ class CosmosDbClient:
 
         return item
 
+    def find_one(self, collection_name: str, filter: dict):
+        """
+        The document as it is stored, with its _id
+        """
+        if self.database is None:
+            raise ValueError("Database is not initialized")
+        collection = self.database[collection_name]
+        return collection.find_one(filter)
+
     def create_item(self, collection_name, document):
         if self.database is None:
             raise ValueError("Database is not initialized")
@@ -89,3 +98,10 @@ class CosmosDbClient:
         collection = self.database[collection_name]
         response = collection.delete_one({"_id": ObjectId(item_id)})
         return response.deleted_count
+
+    def delete_items(self, collection_name: str, filter: dict):
+        if self.database is None:
+            raise ValueError("Database is not initialized")
+        collection = self.database[collection_name]
+        response = collection.delete_many(filter)
+        return response.deleted_count
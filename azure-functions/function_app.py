@@ -13,11 +13,14 @@ from pubsub_client import AzureWebPubSubServiceClient
 from werkzeug.utils import secure_filename
 
 from cosmosdb_client import CosmosDbClient
+from input_file_rows import get_products, read_input_rows
+from task_fingerprint import TaskFingerprints, compute_fingerprint, get_json_content_products
 from messaging import FileType, ScraperTaskActionType, ScraperTaskItem, ScraperTaskItemStatus, ScraperTaskUpdates, TaskStatus
 from json_encoder import CustomJSONEncoder
 
 app = func.FunctionApp()
 cosmosDbClient = CosmosDbClient()
+taskFingerprints = TaskFingerprints(cosmosDbClient)
 # Create a logger for this module
 logger = logging.getLogger(__name__)
 # Basic configuration for logging
@@ -116,6 +119,12 @@ def _create_task_json_content(req: func.HttpRequest) -> func.HttpResponse:
             status_code=400
         )
 
+    json_content_products = get_json_content_products(json_content)
+    fingerprint = compute_fingerprint(pharmacy_id, distributors, json_content_products) if json_content_products is not None else None
+    duplicate_response = _get_duplicate_task_response(fingerprint)
+    if duplicate_response is not None:
+        return duplicate_response
+
     task_item = ScraperTaskItem(
         account_id=ObjectId(),
         file_name="",
@@ -126,19 +135,15 @@ def _create_task_json_content(req: func.HttpRequest) -> func.HttpResponse:
         task_type=ScraperTaskActionType.START_OVER,
         date_created=datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
         date_updated=datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
-        report=None
+        report=None,
+        row_count=len(json_content_products) if json_content_products is not None else None
     )
     task_item.status = ScraperTaskItemStatus(
         status=TaskStatus.IN_PROGRESS,
         message="Задачата стартира...",
         progress=0
     )
-    inserted_id = cosmosDbClient.create_item("tasks", task_item.to_json())
-    task_item.id = inserted_id
-
-    send_message_to_servicebus_queue(task_item.to_json())
-
-    return func.HttpResponse(body=json.dumps({"id": str(task_item.id)}), status_code=201)
+    return _create_and_send_task(task_item, fingerprint)
 
 
 def _create_task_file_content(req: func.HttpRequest) -> func.HttpResponse:
@@ -199,6 +204,12 @@ def _create_task_file_content(req: func.HttpRequest) -> func.HttpResponse:
             status_code=400
         )
 
+    input_rows = read_input_rows(file_data)
+    fingerprint = compute_fingerprint(pharmacy_id, distributors, get_products(input_rows)) if input_rows is not None else None
+    duplicate_response = _get_duplicate_task_response(fingerprint)
+    if duplicate_response is not None:
+        return duplicate_response
+
     # Upload file to Azure Blob Storage
     try:
         blob_storage_url = upload_file_bytes_to_blob_storage(filename, file_data)
@@ -219,17 +230,51 @@ def _create_task_file_content(req: func.HttpRequest) -> func.HttpResponse:
         task_type=ScraperTaskActionType.START_OVER,
         date_created=datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
         date_updated=datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
-        report=None
+        report=None,
+        # The scraper runs small orders first
+        row_count=len(input_rows) if input_rows is not None else None
     )
     task_item.status = ScraperTaskItemStatus(
         status=TaskStatus.IN_PROGRESS,
         message="Задачата стартира...",
         progress=0
     )
+    return _create_and_send_task(task_item, fingerprint)
 
+
+def _get_duplicate_task_response(fingerprint: Optional[str]) -> Optional[func.HttpResponse]:
+    """
+    The response with the ID of the queued or running task with the same content, if there is one
+    """
+    if fingerprint is None:
+        return None
+    try:
+        task_id = taskFingerprints.find_in_flight_task(fingerprint)
+    except Exception as e:
+        logging.error(f"Couldn't look up the task fingerprint, creating a new task: {e}")
+        return None
+    if task_id is None:
+        return None
+    logging.info(f"The same content is already handled by task {task_id}, returning it instead of a new task")
+    return func.HttpResponse(body=json.dumps({"id": task_id, "duplicate": True}), status_code=200)
+
+
+def _create_and_send_task(task_item: ScraperTaskItem, fingerprint: Optional[str]) -> func.HttpResponse:
     inserted_id = cosmosDbClient.create_item("tasks", task_item.to_json())
     task_item.id = inserted_id
 
+    if fingerprint is not None:
+        try:
+            # Another request with the same content may have created its task meanwhile
+            task_id = taskFingerprints.claim(fingerprint, str(task_item.id))
+        except Exception as e:
+            logging.error(f"Couldn't claim the task fingerprint, the task won't be coalesced: {e}")
+            task_id = None
+        if task_id is not None:
+            cosmosDbClient.delete_item("tasks", str(task_item.id))
+            logging.info(f"The same content is already handled by task {task_id}, returning it instead of a new task")
+            return func.HttpResponse(body=json.dumps({"id": task_id, "duplicate": True}), status_code=200)
+
     send_message_to_servicebus_queue(task_item.to_json())
 
     return func.HttpResponse(body=json.dumps({"id": str(task_item.id)}), status_code=201)
@@ -441,6 +486,12 @@ def servicebus_trigger__task_updates(msg: func.ServiceBusMessage):
     task.report = msg_object.report
     task.image_urls = msg_object.image_urls
     cosmosDbClient.update_item("tasks", task.id, task.to_update_dict())
+    if msg_dict["status"]["status"] != TaskStatus.IN_PROGRESS.value:
+        # Submissions of the same content start a new task from now on
+        try:
+            taskFingerprints.release(task_id)
+        except Exception as e:
+            logging.error(f"Couldn't release the fingerprint of task {task_id}: {e}")
 
     AzureWebPubSubServiceClient().send_task_update_to_all(msg_dict)
 
@@ -0,0 +1,77 @@
+import codecs
+import csv
+import io
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+import openpyxl
+import xlrd
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Same as the scraper's input readers: B is the product name and D is the quantity
+NUMBER_OF_COLUMNS = 4
+PRODUCT_NAME_COLUMN = 1
+QUANTITY_COLUMN = 3
+
+XLSX_MAGIC = b"PK\x03\x04"
+XLS_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+CSV_FALLBACK_ENCODING = "cp1251"
+
+
+def _non_empty_rows(rows: Iterable) -> List[Tuple]:
+    result = []
+    for row in rows:
+        values = tuple(None if value is None or str(value).strip() == "" else value for value in row[:NUMBER_OF_COLUMNS])
+        if any(value is not None for value in values):
+            result.append(values + (None,) * (NUMBER_OF_COLUMNS - len(values)))
+    return result
+
+
+def read_input_rows(file_data: bytes) -> Optional[List[Tuple]]:
+    """
+    The non-empty rows of an uploaded xlsx, xls or csv file, as tuples of NUMBER_OF_COLUMNS values.
+    None if the file can't be read - the scraper validates the file and reports the problem
+    """
+    try:
+        if file_data.startswith(XLSX_MAGIC):
+            workbook = openpyxl.load_workbook(io.BytesIO(file_data), read_only=True)
+            try:
+                sheet = workbook.active
+                if sheet is None:
+                    return None
+                return _non_empty_rows(sheet.iter_rows(max_col=NUMBER_OF_COLUMNS, values_only=True))
+            finally:
+                workbook.close()
+        if file_data.startswith(XLS_MAGIC):
+            workbook = xlrd.open_workbook(file_contents=file_data, on_demand=True)
+            try:
+                sheet = workbook.sheet_by_index(0)
+                return _non_empty_rows(
+                    sheet.row_values(row_number, 0, min(NUMBER_OF_COLUMNS, sheet.ncols)) for row_number in range(sheet.nrows))
+            finally:
+                workbook.release_resources()
+
+        if file_data.startswith(codecs.BOM_UTF8):
+            text = file_data.decode("utf-8-sig")
+        else:
+            try:
+                text = file_data.decode("utf-8")
+            except UnicodeDecodeError:
+                text = file_data.decode(CSV_FALLBACK_ENCODING)
+        try:
+            delimiter = csv.Sniffer().sniff(text[:64 * 1024], delimiters=";,\t|").delimiter
+        except csv.Error:
+            delimiter = ","
+        return _non_empty_rows(csv.reader(io.StringIO(text, newline=""), delimiter=delimiter))
+    except Exception as e:
+        logger.warning(f"Couldn't read the rows of the input file: {e}")
+        return None
+
+
+def get_products(rows: List[Tuple]) -> List[Tuple]:
+    """
+    (product name, quantity) of every row
+    """
+    return [(row[PRODUCT_NAME_COLUMN], row[QUANTITY_COLUMN]) for row in rows]
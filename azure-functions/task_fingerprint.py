@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from cosmosdb_client import CosmosDbClient
+from messaging import TaskStatus
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "task_fingerprints"
+# A task that hasn't finished within this time most probably died, its duplicates start a new task
+FINGERPRINT_TTL = timedelta(hours=6)
+# Part of the hashed content, so changing the normalization doesn't match fingerprints of the old one
+FINGERPRINT_VERSION = 2
+# Claiming races with a request for the same content at most once more
+CLAIM_ATTEMPTS = 2
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def _normalize_product_name(product_name) -> str:
+    return _WHITESPACE_PATTERN.sub(" ", str(product_name)).strip().casefold()
+
+
+def _normalize_quantity(quantity) -> str:
+    try:
+        return str(int(float(str(quantity).strip().replace(",", "."))))
+    except (TypeError, ValueError):
+        return str(quantity).strip()
+
+
+def compute_fingerprint(pharmacy_id: str, distributors: List[str], products: Iterable[Tuple]) -> str:
+    """
+    Hash of the pharmacy, the distributors and the (product name, quantity) rows.
+    The order of the rows and the spelling differences in case and spacing don't change it, a repeated row does
+    """
+    rows = sorted(
+        (_normalize_product_name(product_name), _normalize_quantity(quantity))
+        for product_name, quantity in products
+        if product_name is not None and _normalize_product_name(product_name) != ""
+    )
+    content = json.dumps({
+        "version": FINGERPRINT_VERSION,
+        "pharmacy_id": str(pharmacy_id).strip(),
+        "distributors": sorted({str(distributor) for distributor in distributors}),
+        "rows": rows
+    }, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_json_content_products(json_content) -> Optional[List[Tuple]]:
+    if not isinstance(json_content, dict) or not isinstance(json_content.get("rows"), list):
+        return None
+    if not all(isinstance(row, dict) for row in json_content["rows"]):
+        return None
+    return [(row.get("product_name"), row.get("quantity")) for row in json_content["rows"]]
+
+
+class TaskFingerprints:
+    """
+    The fingerprints of the tasks that are queued or running, so a duplicate submission returns the existing task.
+    The document ID is the fingerprint, the unique index of _id decides between requests that race
+    """
+
+    def __init__(self, cosmos_db_client: CosmosDbClient):
+        self.cosmos_db_client = cosmos_db_client
+
+    def find_in_flight_task(self, fingerprint: str) -> Optional[str]:
+        """
+        The ID of the queued or running task with the fingerprint, if any
+        """
+        document = self.cosmos_db_client.find_one(COLLECTION_NAME, {"_id": fingerprint})
+        if document is None:
+            return None
+        if document["expires_at"].replace(tzinfo=timezone.utc) <= datetime.now(timezone.utc):
+            return None
+        task = self.cosmos_db_client.read_item_by_id("tasks", document["task_id"])
+        if task is None or task.get("status", {}).get("status") != TaskStatus.IN_PROGRESS.value:
+            return None
+        return document["task_id"]
+
+    def claim(self, fingerprint: str, task_id: str) -> Optional[str]:
+        """
+        Records the task as the one with the fingerprint. Returns the ID of another task that holds it, or None
+        """
+        document = {
+            "_id": fingerprint,
+            "task_id": str(task_id),
+            "expires_at": datetime.now(timezone.utc) + FINGERPRINT_TTL
+        }
+        for _ in range(CLAIM_ATTEMPTS):
+            try:
+                self.cosmos_db_client.create_item(COLLECTION_NAME, document)
+                return None
+            except DuplicateKeyError:
+                in_flight_task_id = self.find_in_flight_task(fingerprint)
+                if in_flight_task_id is not None:
+                    return in_flight_task_id
+                # The task of the fingerprint is done, take the fingerprint over
+                self.cosmos_db_client.delete_items(COLLECTION_NAME, {"_id": fingerprint, "task_id": {"$ne": str(task_id)}})
+        logger.warning(f"Couldn't claim the fingerprint {fingerprint} for task {task_id}, it won't be coalesced")
+        return None
+
+    def release(self, task_id: str):
+        """
+        Called when the task finished, later submissions of the same content start a new task
+        """
+        self.cosmos_db_client.delete_items(COLLECTION_NAME, {"task_id": str(task_id)})
@@ -0,0 +1,47 @@
+from psa_logger.logger import setup_logging  # noqa
+setup_logging()  # noqa
+
+import argparse
+import json
+import logging
+import signal
+import threading
+
+from catalog.catalog_sync import CatalogSync
+from pharmacy_distributors.common.driver_pool import WebDriverPool
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m catalog", description="Local mirror of the distributor catalogs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="Refresh the stalest search terms of every distributor")
+    sync_parser.add_argument("--distributor", action="append", choices=["sting", "phoenix"],
+                             help="Sync only this distributor, can be repeated")
+    sync_parser.add_argument("--max-terms", type=int, help="Search terms per distributor and run")
+    sync_parser.add_argument("--loop", action="store_true", help="Keep syncing every SCRAPER_CATALOG_SYNC_INTERVAL_SECONDS")
+    report_parser = subparsers.add_parser("report", help="Print how stale the catalog of every distributor is")
+    report_parser.add_argument("--distributor", action="append", choices=["sting", "phoenix"])
+    args = parser.parse_args()
+
+    catalog_sync = CatalogSync(args.distributor, getattr(args, "max_terms", None))
+    if args.command == "report":
+        print(json.dumps(catalog_sync.get_staleness_reports(), indent=2, ensure_ascii=False))
+        return
+
+    shutdown_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown_event.set())
+    try:
+        if args.loop:
+            catalog_sync.run_forever(shutdown_event)
+        else:
+            catalog_sync.run_once()
+            catalog_sync.log_staleness_report()
+    finally:
+        WebDriverPool().shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import logging
+import math
+from typing import List
+
+from catalog.catalog_store import CatalogArticle
+from pharmacy_distributors.phoenix.phoenix_optimized import PhoenixPharmaOptimized
+from pharmacy_distributors.sting.sting_http import CODE_HEADER_PART, EXPIRY_DATE_HEADER_PART, PRICE_HEADER, StingPharmaHttp
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# The article.php rows don't document their fields, the first one of these which is present is the article code
+PHOENIX_CODE_FIELDS = ("ArticleID", "ArticleId", "ArtID", "Code", "ID", "id")
+
+# The distributors of the task messages and the scraper names the catalog is kept under
+CATALOG_DISTRIBUTOR_NAMES = {"sting": "Sting", "phoenix": "Phoenix"}
+
+
+class CatalogSource:
+    """
+    Lists the articles of one distributor, a search term at a time
+    """
+    distributor = ""
+
+    def open(self):
+        pass
+
+    def search(self, term: str) -> List[CatalogArticle]:
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def close(self):
+        pass
+
+
+class PhoenixCatalogSource(CatalogSource):
+    """
+    The article.php endpoint needs the session cookie of a browser which is logged in
+    """
+    distributor = CATALOG_DISTRIBUTOR_NAMES["phoenix"]
+
+    def __init__(self, pharmacy_id: str):
+        self.pharmacy_id = pharmacy_id
+        self.scraper: PhoenixPharmaOptimized | None = None
+
+    def open(self):
+        self.scraper = PhoenixPharmaOptimized(self.pharmacy_id)
+        self.scraper.open_session(self.pharmacy_id)
+
+    def search(self, term: str) -> List[CatalogArticle]:
+        if self.scraper is None:
+            raise Exception("PhoenixCatalogSource: The source is not opened")
+        rows = self.scraper.search_articles(term)
+        if rows is None:
+            raise Exception(f"PhoenixCatalogSource: The search for '{term}' failed")
+
+        articles = []
+        for row in rows:
+            expiry_date = row.get("ExpiryDate")
+            # Same rule as the live search, articles without an expiry date can't be ordered
+            if expiry_date is None or expiry_date.strip() == "" or row.get("CyrName") is None:
+                continue
+            code = next((str(row[field]) for field in PHOENIX_CODE_FIELDS if row.get(field)), row["CyrName"])
+            articles.append(CatalogArticle(self.distributor, code, row["CyrName"], float(row["pdPrice"]), expiry_date))
+        return articles
+
+    def close(self):
+        if self.scraper is not None:
+            self.scraper.finish()
+            self.scraper = None
+
+
+class StingCatalogSource(CatalogSource):
+    """
+    Reads the search grid over HTTP, no browser is needed
+    """
+    distributor = CATALOG_DISTRIBUTOR_NAMES["sting"]
+
+    def __init__(self, pharmacy_id: str):
+        self.scraper = StingPharmaHttp(pharmacy_id, shouldInitBrowser=False)
+
+    def open(self):
+        self.scraper.login()
+        self.scraper.prepare_for_order()
+
+    def search(self, term: str) -> List[CatalogArticle]:
+        page = self.scraper.http_client.search(term)
+        search_result = page.search_result
+        if page.has_no_results_message or PRICE_HEADER not in search_result.headers:
+            return []
+
+        articles = []
+        for row in search_result.rows:
+            name = search_result.get_name(row)
+            price = search_result.get_price(row)
+            if name == "" or price == math.inf:
+                continue
+            code = search_result.find_column(row, CODE_HEADER_PART) or name
+            articles.append(CatalogArticle(self.distributor, code, name, price,
+                                           search_result.find_column(row, EXPIRY_DATE_HEADER_PART)))
+        return articles
+
+
+def get_catalog_sources(distributors: List[str], pharmacy_id: str) -> List[CatalogSource]:
+    sources: List[CatalogSource] = []
+    for distributor in distributors:
+        if distributor == "sting":
+            sources.append(StingCatalogSource(pharmacy_id))
+        elif distributor == "phoenix":
+            sources.append(PhoenixCatalogSource(pharmacy_id))
+        else:
+            logger.error(f"CatalogSources: Unknown distributor {distributor}")
+    return sources
@@ -0,0 +1,184 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+from configuration.common import ScraperConfig
+from files.product_name_normalizer import canonical_key
+from pharmacy_distributors.common.candidate_ranking import Candidate, ParsedName, select_candidate
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Words shorter than this don't narrow the full-text search down
+MIN_SEARCH_TOKEN_LENGTH = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    distributor TEXT NOT NULL,
+    code TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price REAL NOT NULL,
+    expiry_date TEXT,
+    last_seen_at REAL NOT NULL,
+    PRIMARY KEY (distributor, code)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+    search_text, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+CREATE TABLE IF NOT EXISTS sweep_terms (
+    distributor TEXT NOT NULL,
+    term TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    article_count INTEGER NOT NULL,
+    PRIMARY KEY (distributor, term)
+);
+"""
+
+
+class CatalogArticle:
+    def __init__(self, distributor: str, code: str, name: str, price: float, expiry_date: str | None,
+                 last_seen_at: float = 0.0):
+        self.distributor = distributor
+        # The distributor's article code, or the name when the distributor doesn't show codes
+        self.code = code
+        self.name = name
+        self.price = price
+        self.expiry_date = expiry_date
+        # Unix time of the last sync which returned the article
+        self.last_seen_at = last_seen_at
+
+    def __str__(self) -> str:
+        return str(self.__dict__)
+
+
+class CatalogStore:
+    """
+    The local mirror of the distributors' article lists, a SQLite database with a full-text index on the names.
+    The sync job writes it and the task handlers only read it, WAL mode lets them do that at the same time
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(CatalogStore, cls).__new__(cls)
+                    cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        db_path = ScraperConfig.Catalog.DB_PATH
+        if os.path.dirname(db_path) != "":
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # Lookups come from the price lookup threads, the lock serializes them on the one connection
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection_lock = threading.Lock()
+        with self.connection_lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+        logger.info(f"CatalogStore: Opened the catalog at {db_path}")
+
+    def upsert_articles(self, articles: List[CatalogArticle], seen_at: float):
+        with self.connection_lock, self.connection:
+            for article in articles:
+                row = self.connection.execute(
+                    "INSERT INTO articles (distributor, code, name, price, expiry_date, last_seen_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (distributor, code) DO UPDATE SET "
+                    "name = excluded.name, price = excluded.price, expiry_date = excluded.expiry_date, "
+                    "last_seen_at = excluded.last_seen_at "
+                    "RETURNING rowid",
+                    (article.distributor, article.code, article.name, article.price, article.expiry_date, seen_at)
+                ).fetchone()
+                self.connection.execute("INSERT OR REPLACE INTO articles_fts (rowid, search_text) VALUES (?, ?)",
+                                        (row[0], canonical_key(article.name)))
+
+    def mark_term_synced(self, distributor: str, term: str, article_count: int, synced_at: float):
+        with self.connection_lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sweep_terms (distributor, term, synced_at, article_count) VALUES (?, ?, ?, ?)",
+                (distributor, term, synced_at, article_count))
+
+    def get_terms_to_sync(self, distributor: str, terms: List[str], max_age_seconds: float, limit: int) -> List[str]:
+        """
+        The terms which were never synced come first, then the ones synced longest ago
+        """
+        synced_at = self._get_term_sync_times(distributor)
+        stale_before = time.time() - max_age_seconds
+        stale_terms = [term for term in terms if synced_at.get(term, 0.0) < stale_before]
+        stale_terms.sort(key=lambda term: synced_at.get(term, 0.0))
+        return stale_terms[:limit]
+
+    def _get_term_sync_times(self, distributor: str) -> Dict[str, float]:
+        with self.connection_lock:
+            rows = self.connection.execute(
+                "SELECT term, synced_at FROM sweep_terms WHERE distributor = ?", (distributor,)).fetchall()
+        return {row["term"]: row["synced_at"] for row in rows}
+
+    def remove_unseen_articles(self, distributor: str, seen_before: float) -> int:
+        """
+        Articles no sweep has returned for a long time are most probably not sold any more
+        """
+        with self.connection_lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM articles_fts WHERE rowid IN "
+                "(SELECT rowid FROM articles WHERE distributor = ? AND last_seen_at < ?)", (distributor, seen_before))
+            return self.connection.execute(
+                "DELETE FROM articles WHERE distributor = ? AND last_seen_at < ?", (distributor, seen_before)).rowcount
+
+    def search(self, distributor: str, query: str, limit: int, seen_after: float = 0.0) -> List[CatalogArticle]:
+        """
+        Articles whose names contain words starting with every word of the query, the best matches first
+        """
+        # Dosages and pack sizes are left to the ranking, the index only narrows down by the words
+        tokens = [token for token in ParsedName(query).tokens if len(token) >= MIN_SEARCH_TOKEN_LENGTH]
+        if len(tokens) == 0:
+            return []
+        match_query = " ".join(f'"{token}"*' for token in tokens)
+        with self.connection_lock:
+            rows = self.connection.execute(
+                "SELECT articles.* FROM articles_fts JOIN articles ON articles.rowid = articles_fts.rowid "
+                "WHERE articles_fts MATCH ? AND articles.distributor = ? AND articles.last_seen_at >= ? "
+                "ORDER BY articles_fts.rank LIMIT ?",
+                (match_query, distributor, seen_after, limit)).fetchall()
+        return [CatalogArticle(row["distributor"], row["code"], row["name"], row["price"], row["expiry_date"],
+                               row["last_seen_at"]) for row in rows]
+
+    def find_article(self, distributor: str, productSearchNames: list) -> CatalogArticle | None:
+        """
+        The article the live search would most probably find. Only articles seen within
+        SCRAPER_CATALOG_MAX_PRICE_AGE_HOURS are used, since their prices are shown as preliminary ones
+        """
+        seen_after = time.time() - ScraperConfig.Catalog.MAX_PRICE_AGE_HOURS * 3600
+        for productName in productSearchNames:
+            articles = self.search(distributor, productName, ScraperConfig.Catalog.CANDIDATES, seen_after)
+            # The full-text match is looser than the distributor's search, so even a single article must score enough
+            candidate = select_candidate(productName, [Candidate(article.name, article.price, article) for article in articles],
+                                         require_score=True)
+            if candidate is not None:
+                return candidate.source
+        return None
+
+    def get_staleness_report(self, distributor: str, terms: List[str], max_age_seconds: float) -> dict:
+        now = time.time()
+        synced_at = self._get_term_sync_times(distributor)
+        term_ages = [now - synced_at[term] for term in terms if term in synced_at]
+        with self.connection_lock:
+            row = self.connection.execute(
+                "SELECT COUNT(*) AS article_count, MIN(last_seen_at) AS oldest, MAX(last_seen_at) AS newest "
+                "FROM articles WHERE distributor = ?", (distributor,)).fetchone()
+        return {
+            "distributor": distributor,
+            "article_count": row["article_count"],
+            "oldest_article_age_hours": None if row["oldest"] is None else round((now - row["oldest"]) / 3600, 1),
+            "newest_article_age_hours": None if row["newest"] is None else round((now - row["newest"]) / 3600, 1),
+            "sweep_terms": len(terms),
+            "never_synced_terms": len(terms) - len(term_ages),
+            "stale_terms": len(terms) - sum(1 for age in term_ages if age <= max_age_seconds),
+            "oldest_term_age_hours": None if len(term_ages) == 0 else round(max(term_ages) / 3600, 1),
+        }
@@ -0,0 +1,102 @@
+import itertools
+import logging
+import threading
+import time
+from typing import List
+
+from catalog.catalog_sources import CATALOG_DISTRIBUTOR_NAMES, CatalogSource, get_catalog_sources
+from catalog.catalog_store import CatalogStore
+from configuration.common import ScraperConfig
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# A distributor whose searches keep failing is left for the next run
+MAX_CONSECUTIVE_FAILURES = 5
+
+
+def get_sweep_terms() -> List[str]:
+    """
+    Every combination of SWEEP_TERM_LENGTH letters of the alphabet. The distributors search with "contains",
+    so together the terms return every article
+    """
+    alphabet = ScraperConfig.Catalog.SWEEP_ALPHABET
+    return ["".join(letters) for letters in itertools.product(alphabet, repeat=ScraperConfig.Catalog.SWEEP_TERM_LENGTH)]
+
+
+def get_sync_distributors() -> List[str]:
+    return [distributor.strip() for distributor in ScraperConfig.Catalog.SYNC_DISTRIBUTORS.split(",") if distributor.strip() != ""]
+
+
+class CatalogSync:
+    """
+    Refreshes the terms synced longest ago, at most `max_terms` per distributor and run,
+    so a full sweep is spread over several runs
+    """
+
+    def __init__(self, distributors: List[str] | None = None, max_terms: int | None = None):
+        self.distributors = distributors if distributors is not None else get_sync_distributors()
+        self.max_terms = max_terms if max_terms is not None else ScraperConfig.Catalog.TERMS_PER_RUN
+        self.store = CatalogStore()
+
+    def run_once(self):
+        if ScraperConfig.Catalog.SYNC_PHARMACY_ID == "":
+            raise Exception("CatalogSync: SCRAPER_CATALOG_SYNC_PHARMACY_ID is not set")
+        for source in get_catalog_sources(self.distributors, ScraperConfig.Catalog.SYNC_PHARMACY_ID):
+            try:
+                self._sync_source(source)
+            except Exception as e:
+                logger.exception(f"CatalogSync: Couldn't sync {source.distributor}: {e}")
+
+    def run_forever(self, shutdown_event: threading.Event):
+        while not shutdown_event.is_set():
+            self.run_once()
+            self.log_staleness_report()
+            shutdown_event.wait(ScraperConfig.Catalog.SYNC_INTERVAL_SECONDS)
+
+    def _sync_source(self, source: CatalogSource):
+        max_age_seconds = ScraperConfig.Catalog.TERM_MAX_AGE_HOURS * 3600
+        terms = self.store.get_terms_to_sync(source.distributor, get_sweep_terms(), max_age_seconds, self.max_terms)
+        if len(terms) == 0:
+            logger.info(f"CatalogSync: The catalog of {source.distributor} is up to date")
+            return
+
+        logger.info(f"CatalogSync: Syncing {len(terms)} terms of {source.distributor}")
+        started_at = time.monotonic()
+        article_count = 0
+        consecutive_failures = 0
+        try:
+            source.open()
+            for term in terms:
+                try:
+                    articles = source.search(term)
+                except Exception as e:
+                    logger.error(f"CatalogSync: {source.distributor} search for '{term}' failed: {e}")
+                    consecutive_failures += 1
+                    if consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+                        logger.error(f"CatalogSync: Stopping the sync of {source.distributor} after {consecutive_failures} failures")
+                        break
+                    continue
+                consecutive_failures = 0
+                synced_at = time.time()
+                self.store.upsert_articles(articles, synced_at)
+                self.store.mark_term_synced(source.distributor, term, len(articles), synced_at)
+                article_count += len(articles)
+        finally:
+            source.close()
+
+        removed_count = self.store.remove_unseen_articles(
+            source.distributor, time.time() - ScraperConfig.Catalog.RETENTION_DAYS * 24 * 3600)
+        logger.info(f"CatalogSync: Synced {article_count} articles of {source.distributor} in "
+                    f"{time.monotonic() - started_at:.1f} seconds, removed {removed_count} articles which weren't seen any more")
+
+    def get_staleness_reports(self) -> List[dict]:
+        max_age_seconds = ScraperConfig.Catalog.TERM_MAX_AGE_HOURS * 3600
+        return [
+            self.store.get_staleness_report(CATALOG_DISTRIBUTOR_NAMES[distributor], get_sweep_terms(), max_age_seconds)
+            for distributor in self.distributors if distributor in CATALOG_DISTRIBUTOR_NAMES
+        ]
+
+    def log_staleness_report(self):
+        for report in self.get_staleness_reports():
+            logger.info(f"CatalogSync: Staleness of the catalog: {report}")
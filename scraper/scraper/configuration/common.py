@@ -70,6 +70,17 @@ class AzureConfig:
         QUEUE_NAME = get_variable(
             "AZURE_SERVICE_BUS_TASK_UPDATES_QUEUE_NAME", "queue_name", "azure-config.json", "task-updates"
         )
+        # Progress updates of a task within this window are merged into the latest one
+        COALESCE_WINDOW_SECONDS = float(get_variable(
+            "AZURE_SERVICE_BUS_TASK_UPDATES_COALESCE_WINDOW_SECONDS", "coalesce_window_seconds", "azure-config.json", "2"
+        ))
+        MAX_QUEUED_UPDATES = int(get_variable(
+            "AZURE_SERVICE_BUS_TASK_UPDATES_MAX_QUEUED", "max_queued_updates", "azure-config.json", "1000"
+        ))
+        # How long publishing an error or a success waits for the message to be sent
+        FINAL_UPDATE_TIMEOUT_SECONDS = float(get_variable(
+            "AZURE_SERVICE_BUS_TASK_UPDATES_FINAL_TIMEOUT_SECONDS", "final_update_timeout_seconds", "azure-config.json", "30"
+        ))
 
     class BlobStorage:
         CONNECTION_STRING = get_variable(
@@ -95,6 +106,302 @@ class AzureConfig:
             "azure-config.json",
             "log-files",
         )
+        # The reports are uploaded in blocks of this size
+        UPLOAD_BLOCK_SIZE_MB = int(get_variable(
+            "AZURE_BLOB_STORAGE_UPLOAD_BLOCK_SIZE_MB",
+            "upload_block_size_mb",
+            "azure-config.json",
+            "4",
+        ))
+
+    class CosmosDb:
+        CONNECTION_STRING = get_variable(
+            "AZURE_COSMOS_DB_CONNECTION_STRING",
+            "connection_string",
+            "azure-config.json",
+        )
+        DATABASE_NAME = get_variable(
+            "COSMOS_DB_DATABASE_NAME", "database_name", "azure-config.json", "psa"
+        )
+
+
+class ScraperConfig:
+    PARALLEL_PRICE_LOOKUP = get_variable_bool(
+        "SCRAPER_PARALLEL_PRICE_LOOKUP", "parallel_price_lookup", "scraper-config.json", True
+    )
+    PRICE_LOOKUP_TIMEOUT_SECONDS = float(get_variable(
+        "SCRAPER_PRICE_LOOKUP_TIMEOUT_SECONDS", "price_lookup_timeout_seconds", "scraper-config.json", "60"
+    ))
+    # Number of upcoming rows whose prices are looked up while the current row is added to the cart. 0 disables it
+    LOOKAHEAD_WINDOW = int(get_variable(
+        "SCRAPER_LOOKAHEAD_WINDOW", "lookahead_window", "scraper-config.json", "4"
+    ))
+    HTTP_TIMEOUT_SECONDS = float(get_variable(
+        "SCRAPER_HTTP_TIMEOUT_SECONDS", "http_timeout_seconds", "scraper-config.json", "20"
+    ))
+    # Connections kept open per distributor for the HTTP searches, should cover the concurrent lookups
+    HTTP_POOL_SIZE = int(get_variable(
+        "SCRAPER_HTTP_POOL_SIZE", "http_pool_size", "scraper-config.json", "8"
+    ))
+    # Search Sting with HTTP postbacks instead of the browser, which is then used only for the cart
+    STING_HTTP_SEARCH = get_variable_bool(
+        "SCRAPER_STING_HTTP_SEARCH", "sting_http_search", "scraper-config.json", False
+    )
+    # Price the whole input file on the HTTP-capable scrapers in one burst, before any cart work starts
+    BATCH_PRICE_LOOKUP = get_variable_bool(
+        "SCRAPER_BATCH_PRICE_LOOKUP", "batch_price_lookup", "scraper-config.json", False
+    )
+    BATCH_PRICE_LOOKUP_CONCURRENCY = int(get_variable(
+        "SCRAPER_BATCH_PRICE_LOOKUP_CONCURRENCY", "batch_price_lookup_concurrency", "scraper-config.json", "8"
+    ))
+
+    class Worker:
+        # Tasks run at the same time by one container, each one leases a browser per distributor from the driver pool
+        TASK_SLOTS = int(get_variable(
+            "SCRAPER_WORKER_TASK_SLOTS", "worker_task_slots", "scraper-config.json", "1"
+        ))
+        MAX_LOCK_RENEWAL_SECONDS = int(get_variable(
+            "SCRAPER_WORKER_MAX_LOCK_RENEWAL_SECONDS", "worker_max_lock_renewal_seconds", "scraper-config.json", "3000"
+        ))
+
+    class Scheduler:
+        # Tasks with at most this many rows go through the small lane
+        SMALL_TASK_MAX_ROWS = int(get_variable(
+            "SCRAPER_SCHEDULER_SMALL_TASK_MAX_ROWS", "scheduler_small_task_max_rows", "scraper-config.json", "20"
+        ))
+        # Task slots bulk tasks can't take, so a small task never waits for a bulk one to finish
+        SMALL_LANE_RESERVED_SLOTS = int(get_variable(
+            "SCRAPER_SCHEDULER_SMALL_LANE_RESERVED_SLOTS", "scheduler_small_lane_reserved_slots", "scraper-config.json", "1"
+        ))
+        # Messages received ahead of the free slots, so the scheduler has tasks to choose from.
+        # They are locked to this container, so an idle container can't take them meanwhile
+        QUEUE_SIZE = int(get_variable(
+            "SCRAPER_SCHEDULER_QUEUE_SIZE", "scheduler_queue_size", "scraper-config.json", "0"
+        ))
+        # A waiting bulk task counts as this many rows shorter for every minute it waited
+        AGING_ROWS_PER_MINUTE = float(get_variable(
+            "SCRAPER_SCHEDULER_AGING_ROWS_PER_MINUTE", "scheduler_aging_rows_per_minute", "scraper-config.json", "50"
+        ))
+        # Input files uploaded before the row count was stored
+        UNKNOWN_ROW_COUNT = int(get_variable(
+            "SCRAPER_SCHEDULER_UNKNOWN_ROW_COUNT", "scheduler_unknown_row_count", "scraper-config.json", "500"
+        ))
+
+    class DriverPool:
+        # Upper bound of browsers alive at a time, each one takes a few hundred MB of the container's memory
+        SIZE = int(get_variable(
+            "SCRAPER_DRIVER_POOL_SIZE", "driver_pool_size", "scraper-config.json", "2"
+        ))
+        # Browsers launched when the worker starts
+        PREWARM = int(get_variable(
+            "SCRAPER_DRIVER_POOL_PREWARM", "driver_pool_prewarm", "scraper-config.json", "2"
+        ))
+        # A browser is quit and replaced after this many tasks
+        MAX_USES = int(get_variable(
+            "SCRAPER_DRIVER_POOL_MAX_USES", "driver_pool_max_uses", "scraper-config.json", "20"
+        ))
+        LEASE_TIMEOUT_SECONDS = float(get_variable(
+            "SCRAPER_DRIVER_POOL_LEASE_TIMEOUT_SECONDS", "driver_pool_lease_timeout_seconds", "scraper-config.json", "600"
+        ))
+
+    class Waits:
+        # Shorten the waits for a page to settle to the recently observed latency of each distributor.
+        # The waits for a search result keep their full timeout, since a timeout there would be taken as an answer
+        ADAPTIVE = get_variable_bool(
+            "SCRAPER_WAITS_ADAPTIVE", "waits_adaptive", "scraper-config.json", True
+        )
+        LATENCY_SAMPLES = int(get_variable(
+            "SCRAPER_WAITS_LATENCY_SAMPLES", "waits_latency_samples", "scraper-config.json", "50"
+        ))
+        MIN_SAMPLES = int(get_variable(
+            "SCRAPER_WAITS_MIN_SAMPLES", "waits_min_samples", "scraper-config.json", "5"
+        ))
+        TIMEOUT_MULTIPLIER = float(get_variable(
+            "SCRAPER_WAITS_TIMEOUT_MULTIPLIER", "waits_timeout_multiplier", "scraper-config.json", "2"
+        ))
+        MIN_TIMEOUT_SECONDS = float(get_variable(
+            "SCRAPER_WAITS_MIN_TIMEOUT_SECONDS", "waits_min_timeout_seconds", "scraper-config.json", "0.5"
+        ))
+        # The page counts as settled once no request is in flight and the DOM didn't change for this long
+        QUIET_PERIOD_MS = int(get_variable(
+            "SCRAPER_WAITS_QUIET_PERIOD_MS", "waits_quiet_period_ms", "scraper-config.json", "100"
+        ))
+        POLL_SECONDS = float(get_variable(
+            "SCRAPER_WAITS_POLL_SECONDS", "waits_poll_seconds", "scraper-config.json", "0.05"
+        ))
+
+    class LeanProfile:
+        # Block the third-party hosts and the resource types each distributor can do without
+        ENABLED = get_variable_bool(
+            "SCRAPER_LEAN_PROFILE_ENABLED", "lean_profile_enabled", "scraper-config.json", True
+        )
+        # Every pooled browser keeps its HTTP cache in its own subdirectory, so it survives the browser restarts.
+        # Empty keeps Chrome's throwaway cache
+        DISK_CACHE_DIR = get_variable(
+            "SCRAPER_LEAN_PROFILE_DISK_CACHE_DIR", "lean_profile_disk_cache_dir", "scraper-config.json", "/tmp/psa-chrome-cache"
+        )
+        DISK_CACHE_SIZE_MB = int(get_variable(
+            "SCRAPER_LEAN_PROFILE_DISK_CACHE_SIZE_MB", "lean_profile_disk_cache_size_mb", "scraper-config.json", "200"
+        ))
+
+    class Screenshots:
+        # always | lean | sampled | on_exception, see pharmacy_distributors/common/screenshots.py
+        MODE = get_variable(
+            "SCRAPER_SCREENSHOTS_MODE", "screenshots_mode", "scraper-config.json", "on_exception"
+        )
+        # jpeg or webp, used by the lean and sampled modes
+        FORMAT = get_variable(
+            "SCRAPER_SCREENSHOTS_FORMAT", "screenshots_format", "scraper-config.json", "jpeg"
+        )
+        QUALITY = int(get_variable(
+            "SCRAPER_SCREENSHOTS_QUALITY", "screenshots_quality", "scraper-config.json", "50"
+        ))
+        SCALE = float(get_variable(
+            "SCRAPER_SCREENSHOTS_SCALE", "screenshots_scale", "scraper-config.json", "0.5"
+        ))
+        SAMPLE_EVERY = int(get_variable(
+            "SCRAPER_SCREENSHOTS_SAMPLE_EVERY", "screenshots_sample_every", "scraper-config.json", "5"
+        ))
+        MAX_COUNT = int(get_variable(
+            "SCRAPER_SCREENSHOTS_MAX_COUNT", "screenshots_max_count", "scraper-config.json", "5"
+        ))
+        # Memory ceiling of the kept screenshots per scraper
+        MAX_BYTES = int(get_variable(
+            "SCRAPER_SCREENSHOTS_MAX_BYTES", "screenshots_max_bytes", "scraper-config.json", "2000000"
+        ))
+
+    class CandidateRanking:
+        # Pick the best of several search results instead of treating them as not found
+        ENABLED = get_variable_bool(
+            "SCRAPER_CANDIDATE_RANKING_ENABLED", "candidate_ranking_enabled", "scraper-config.json", True
+        )
+        # Score between 0 and 1 the best result needs, see pharmacy_distributors/common/candidate_ranking.py
+        MIN_SCORE = float(get_variable(
+            "SCRAPER_CANDIDATE_RANKING_MIN_SCORE", "candidate_ranking_min_score", "scraper-config.json", "0.8"
+        ))
+        # The best result must be ahead of the second one by this much, otherwise the search is ambiguous
+        MIN_MARGIN = float(get_variable(
+            "SCRAPER_CANDIDATE_RANKING_MIN_MARGIN", "candidate_ranking_min_margin", "scraper-config.json", "0.05"
+        ))
+
+    class Catalog:
+        # Take the candidates and preliminary prices from the local catalog mirror, see catalog/
+        ENABLED = get_variable_bool(
+            "SCRAPER_CATALOG_ENABLED", "catalog_enabled", "scraper-config.json", False
+        )
+        DB_PATH = get_variable(
+            "SCRAPER_CATALOG_DB_PATH", "catalog_db_path", "scraper-config.json", "/tmp/psa-catalog.sqlite3"
+        )
+        # Catalog articles not seen by a sync for longer than this aren't used by the tasks
+        MAX_PRICE_AGE_HOURS = float(get_variable(
+            "SCRAPER_CATALOG_MAX_PRICE_AGE_HOURS", "catalog_max_price_age_hours", "scraper-config.json", "24"
+        ))
+        # Full-text matches ranked per search variation
+        CANDIDATES = int(get_variable(
+            "SCRAPER_CATALOG_CANDIDATES", "catalog_candidates", "scraper-config.json", "10"
+        ))
+        # The sync job logs in with the distributor accounts of this pharmacy
+        SYNC_PHARMACY_ID = get_variable(
+            "SCRAPER_CATALOG_SYNC_PHARMACY_ID", "catalog_sync_pharmacy_id", "scraper-config.json", ""
+        )
+        SYNC_DISTRIBUTORS = get_variable(
+            "SCRAPER_CATALOG_SYNC_DISTRIBUTORS", "catalog_sync_distributors", "scraper-config.json", "sting,phoenix"
+        )
+        SYNC_INTERVAL_SECONDS = int(get_variable(
+            "SCRAPER_CATALOG_SYNC_INTERVAL_SECONDS", "catalog_sync_interval_seconds", "scraper-config.json", "3600"
+        ))
+        # The sweep searches for every combination of this many letters of the alphabet
+        SWEEP_ALPHABET = get_variable(
+            "SCRAPER_CATALOG_SWEEP_ALPHABET", "catalog_sweep_alphabet", "scraper-config.json", "абвгдежзийклмнопрстуфхцчшщъьюя"
+        )
+        SWEEP_TERM_LENGTH = int(get_variable(
+            "SCRAPER_CATALOG_SWEEP_TERM_LENGTH", "catalog_sweep_term_length", "scraper-config.json", "2"
+        ))
+        # A term is searched again once its last sync is older than this
+        TERM_MAX_AGE_HOURS = float(get_variable(
+            "SCRAPER_CATALOG_TERM_MAX_AGE_HOURS", "catalog_term_max_age_hours", "scraper-config.json", "24"
+        ))
+        TERMS_PER_RUN = int(get_variable(
+            "SCRAPER_CATALOG_TERMS_PER_RUN", "catalog_terms_per_run", "scraper-config.json", "200"
+        ))
+        # Articles no sync has returned for this long are removed
+        RETENTION_DAYS = float(get_variable(
+            "SCRAPER_CATALOG_RETENTION_DAYS", "catalog_retention_days", "scraper-config.json", "7"
+        ))
+
+    class SessionStore:
+        # Reuse the logged in distributor sessions of previous tasks for the same pharmacy
+        ENABLED = get_variable_bool(
+            "SCRAPER_SESSION_STORE_ENABLED", "session_store_enabled", "scraper-config.json", True
+        )
+        TTL_SECONDS = int(get_variable(
+            "SCRAPER_SESSION_STORE_TTL_SECONDS", "session_store_ttl_seconds", "scraper-config.json", "1800"
+        ))
+
+    class PriceCache:
+        ENABLED = get_variable_bool(
+            "SCRAPER_PRICE_CACHE_ENABLED", "price_cache_enabled", "scraper-config.json", True
+        )
+        # Also share the cached prices with the other workers through the database
+        SHARED = get_variable_bool(
+            "SCRAPER_PRICE_CACHE_SHARED", "price_cache_shared", "scraper-config.json", True
+        )
+        MAX_ENTRIES = int(get_variable(
+            "SCRAPER_PRICE_CACHE_MAX_ENTRIES", "price_cache_max_entries", "scraper-config.json", "5000"
+        ))
+        TTL_SECONDS = int(get_variable(
+            "SCRAPER_PRICE_CACHE_TTL_SECONDS", "price_cache_ttl_seconds", "scraper-config.json", "21600"
+        ))
+        # Products that weren't found are cached for a shorter time, since they may appear in stock soon
+        NEGATIVE_TTL_SECONDS = int(get_variable(
+            "SCRAPER_PRICE_CACHE_NEGATIVE_TTL_SECONDS", "price_cache_negative_ttl_seconds", "scraper-config.json", "1800"
+        ))
+
+    class Checkpoints:
+        # Store the decision for every processed row, so a resumed or redelivered task continues where it stopped
+        ENABLED = get_variable_bool(
+            "SCRAPER_CHECKPOINTS_ENABLED", "checkpoints_enabled", "scraper-config.json", True
+        )
+        # The decisions are written together once this many are pending or the oldest one waited FLUSH_SECONDS
+        BATCH_SIZE = int(get_variable(
+            "SCRAPER_CHECKPOINTS_BATCH_SIZE", "checkpoints_batch_size", "scraper-config.json", "10"
+        ))
+        FLUSH_SECONDS = float(get_variable(
+            "SCRAPER_CHECKPOINTS_FLUSH_SECONDS", "checkpoints_flush_seconds", "scraper-config.json", "15"
+        ))
+        TTL_DAYS = int(get_variable(
+            "SCRAPER_CHECKPOINTS_TTL_DAYS", "checkpoints_ttl_days", "scraper-config.json", "14"
+        ))
+
+    class Sharding:
+        # Large tasks have their rows priced in parallel by other workers, the task's own worker fills the carts
+        ENABLED = get_variable_bool(
+            "SCRAPER_SHARDING_ENABLED", "sharding_enabled", "scraper-config.json", False
+        )
+        MIN_ROWS = int(get_variable(
+            "SCRAPER_SHARDING_MIN_ROWS", "sharding_min_rows", "scraper-config.json", "600"
+        ))
+        ROWS_PER_SHARD = int(get_variable(
+            "SCRAPER_SHARDING_ROWS_PER_SHARD", "sharding_rows_per_shard", "scraper-config.json", "250"
+        ))
+        # Including the first shard, which the task's own worker prices
+        MAX_SHARDS = int(get_variable(
+            "SCRAPER_SHARDING_MAX_SHARDS", "sharding_max_shards", "scraper-config.json", "8"
+        ))
+        # A shard that didn't start or price a row for this long is priced by the task's own worker
+        STALL_SECONDS = float(get_variable(
+            "SCRAPER_SHARDING_STALL_SECONDS", "sharding_stall_seconds", "scraper-config.json", "300"
+        ))
+        POLL_SECONDS = float(get_variable(
+            "SCRAPER_SHARDING_POLL_SECONDS", "sharding_poll_seconds", "scraper-config.json", "5"
+        ))
+        # A shard reports its progress after pricing this many rows
+        PROGRESS_ROWS = int(get_variable(
+            "SCRAPER_SHARDING_PROGRESS_ROWS", "sharding_progress_rows", "scraper-config.json", "10"
+        ))
+        TTL_DAYS = int(get_variable(
+            "SCRAPER_SHARDING_TTL_DAYS", "sharding_ttl_days", "scraper-config.json", "2"
+        ))
 
 
 class User:
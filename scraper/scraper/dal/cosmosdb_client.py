@@ -1,58 +1,119 @@
-from azure.cosmos import CosmosClient, exceptions
-from azure.cosmos.database import DatabaseProxy
+import logging
 import threading
+from typing import List, Optional
+from bson import ObjectId
+from pymongo import MongoClient, ReplaceOne
+
+from configuration.common import AzureConfig
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
 
 
-# TODO: Implement the below template
 class CosmosDbClient:
+    """
+    Client for the same Mongo API database that the azure functions use (see azure-functions/cosmosdb_client.py)
+    """
     _instance = None
     _lock = threading.Lock()
-    client = None
-    database: DatabaseProxy
+    database = None
 
-    # Singleton pattern implementation
     def __new__(cls, *args, **kwargs):
-        with cls._lock:
-            if not cls._instance:
-                cls._instance = super(CosmosDbClient, cls).__new__(cls)
-                # Initialize the client here
-                endpoint = "YOUR_COSMOS_DB_ENDPOINT"
-                key = "YOUR_COSMOS_DB_KEY"
-                cls._instance.client = CosmosClient(endpoint, key)
-                cls._instance.database = cls._instance.client.get_database_client("YOUR_DATABASE_NAME")
-            return cls._instance
-
-    def read_items(self, collection_name, query):
-        container = self.database.get_container_client(collection_name)
-        items = list(container.query_items(query=query, enable_cross_partition_query=True))
-        return items
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    logger.info("Creating CosmosDbClient instance")
+                    cls._instance = super(CosmosDbClient, cls).__new__(cls)
+                    cls._instance._initialize_client()
+        return cls._instance
+
+    def _initialize_client(self):
+        logger.info("Initializing CosmosDbClient")
+        # Fail fast if the database is unreachable, the callers treat it as optional
+        self.client = MongoClient(AzureConfig.CosmosDb.CONNECTION_STRING, serverSelectionTimeoutMS=5000)
+        self.database = self.client.get_database(AzureConfig.CosmosDb.DATABASE_NAME)
+        logger.info("CosmosDbClient Initialized!")
+
+    def _get_collection(self, collection_name: str):
+        if self.database is None:
+            raise ValueError("Database is not initialized")
+        return self.database[collection_name]
+
+    def read_items(self,
+                   collection_name: str,
+                   filter: Optional[dict] = None,
+                   projection: Optional[dict] = None,
+                   sort: Optional[dict] = None,
+                   skip: Optional[int] = 0,
+                   limit: Optional[int] = 0):
+        if not skip:
+            skip = 0
+        if not limit:
+            limit = 0
+
+        collection = self._get_collection(collection_name)
+        return list(collection.find(filter=filter, projection=projection, sort=sort, skip=skip, limit=limit))
+
+    def read_item_by_id(self, collection_name: str, id: str):
+        collection = self._get_collection(collection_name)
+        return collection.find_one(ObjectId(id))
+
+    def find_one(self, collection_name: str, filter: dict):
+        collection = self._get_collection(collection_name)
+        return collection.find_one(filter)
 
     def create_item(self, collection_name, document):
-        container = self.database.get_container_client(collection_name)
-        response = container.create_item(body=document)
-        return response
+        collection = self._get_collection(collection_name)
+        response = collection.insert_one(document)
+        return response.inserted_id
 
     def update_item(self, collection_name, item_id, document):
-        container = self.database.get_container_client(collection_name)
-        try:
-            read_item = container.read_item(item=item_id, partition_key=document['partition_key'])
-            for key in document:
-                read_item[key] = document[key]
-            response = container.replace_item(item=read_item, body=read_item)
-            return response
-        except exceptions.CosmosResourceNotFoundError:
-            return "Item not found"
-
-    def delete_item(self, collection_name, item_id, partition_key):
-        container = self.database.get_container_client(collection_name)
-        response = container.delete_item(item=item_id, partition_key=partition_key)
-        return response
-
-# Usage Example
-# if __name__ == "__main__":
-#     client = CosmosDbClient()
-#     new_document = {"id": "001", "content": "Hello Cosmos DB", "partition_key": "001"}
-#     print(client.create_item("YourCollectionName", new_document))
-#     print(client.read_items("YourCollectionName", "SELECT * FROM c"))
-#     print(client.update_item("YourCollectionName", "001", {"content": "Hello updated Cosmos DB"}))
-#     print(client.delete_item("YourCollectionName", "001", "001"))
+        collection = self._get_collection(collection_name)
+        response = collection.update_one({"_id": ObjectId(item_id)}, {"$set": document})
+        return response.modified_count
+
+    def upsert_item(self, collection_name: str, filter: dict, document: dict):
+        collection = self._get_collection(collection_name)
+        response = collection.update_one(filter, {"$set": document}, upsert=True)
+        return response.modified_count
+
+    def update_items(self, collection_name: str, filter: dict, document: dict):
+        """
+        Sets the fields of the documents matching the filter. Returns the number of matched documents
+        """
+        collection = self._get_collection(collection_name)
+        response = collection.update_many(filter, {"$set": document})
+        return response.matched_count
+
+    def replace_items(self, collection_name: str, documents: List[dict]):
+        """
+        Inserts or replaces the documents by their _id in a single request
+        """
+        if len(documents) == 0:
+            return 0
+        collection = self._get_collection(collection_name)
+        response = collection.bulk_write(
+            [ReplaceOne({"_id": document["_id"]}, document, upsert=True) for document in documents], ordered=False)
+        return response.upserted_count + response.modified_count
+
+    def delete_items(self, collection_name: str, filter: dict):
+        collection = self._get_collection(collection_name)
+        response = collection.delete_many(filter)
+        return response.deleted_count
+
+    def delete_item(self, collection_name, item_id):
+        collection = self._get_collection(collection_name)
+        response = collection.delete_one({"_id": ObjectId(item_id)})
+        return response.deleted_count
+
+    def ensure_expiry_index(self, collection_name: str):
+        """
+        Documents are removed by the database once the seconds in their `ttl` field have passed since their last write.
+        Cosmos DB only expires documents through an index on `_ts`, -1 keeps the documents without a `ttl` field
+        """
+        collection = self._get_collection(collection_name)
+        collection.create_index("_ts", expireAfterSeconds=-1)
+
+    def ensure_index(self, collection_name: str, field_name: str):
+        collection = self._get_collection(collection_name)
+        collection.create_index(field_name)
@@ -0,0 +1,158 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Tuple
+
+from configuration.common import AzureConfig, ScraperConfig
+from dal.cosmosdb_client import CosmosDbClient
+from files.product_name_normalizer import canonical_key
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "price_cache"
+# After the shared tier fails, don't try it again for this long
+SHARED_TIER_RETRY_AFTER_SECONDS = 60
+
+
+class CachedPrice:
+    def __init__(self, product_name: str, price: float):
+        self.product_name = product_name
+        self.price = price
+
+    def is_found(self) -> bool:
+        return self.price != math.inf
+
+    def __str__(self):
+        return f"CachedPrice(product_name={self.product_name}, price={self.price})"
+
+
+class PriceCache:
+    """
+    Caches the result of get_product_name_and_price per distributor, pharmacy and normalized search name,
+    since the prices depend on the pharmacy's account. Failed lookups aren't cached, only answers that the
+    distributor doesn't have the product.
+    The first tier is an in-process LRU shared by all tasks of the worker, the second one is a collection
+    in the database shared by all workers. Entries expire through the TTL index created by ensure_indexes.
+
+    Cached prices are only used to pick a distributor - the chosen one is searched again before adding to the cart.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(PriceCache, cls).__new__(cls)
+                    cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self.entries: OrderedDict[Tuple[str, str, str], Tuple[float, CachedPrice]] = OrderedDict()
+        self.entries_lock = threading.Lock()
+        self.shared_tier_enabled = ScraperConfig.PriceCache.SHARED and AzureConfig.CosmosDb.CONNECTION_STRING != ""
+        self.shared_tier_retry_at = 0.0
+
+    @staticmethod
+    def ensure_indexes():
+        """
+        Called once when the worker starts
+        """
+        if not ScraperConfig.PriceCache.ENABLED or not ScraperConfig.PriceCache.SHARED or AzureConfig.CosmosDb.CONNECTION_STRING == "":
+            return
+        CosmosDbClient().ensure_expiry_index(COLLECTION_NAME)
+
+    @staticmethod
+    def make_search_key(productSearchNames: list) -> str:
+        # Spellings of the same product that differ in case, spacing, punctuation or keyboard layout share an entry
+        return canonical_key(str(productSearchNames[0])) if len(productSearchNames) > 0 else ""
+
+    def get(self, distributor: str, pharmacy_id: str, productSearchNames: list) -> CachedPrice | None:
+        if not ScraperConfig.PriceCache.ENABLED:
+            return None
+
+        key = (distributor, str(pharmacy_id), self.make_search_key(productSearchNames))
+        with self.entries_lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, cached_price = entry
+                if expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    logger.info(f"PriceCache: Local hit for {key}: {cached_price}")
+                    return cached_price
+                del self.entries[key]
+
+        document = self._read_shared(key)
+        if document is None:
+            return None
+
+        cached_price = CachedPrice(document["product_name"], math.inf if document["price"] is None else float(document["price"]))
+        remaining_seconds = (document["expires_at"].replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+        self._put_local(key, cached_price, remaining_seconds)
+        logger.info(f"PriceCache: Shared hit for {key}: {cached_price}")
+        return cached_price
+
+    def put(self, distributor: str, pharmacy_id: str, productSearchNames: list, product_name: str, price: float):
+        if not ScraperConfig.PriceCache.ENABLED:
+            return
+
+        key = (distributor, str(pharmacy_id), self.make_search_key(productSearchNames))
+        cached_price = CachedPrice(product_name, price)
+        ttl_seconds = ScraperConfig.PriceCache.TTL_SECONDS if cached_price.is_found() else ScraperConfig.PriceCache.NEGATIVE_TTL_SECONDS
+        self._put_local(key, cached_price, ttl_seconds)
+        self._write_shared(key, cached_price, ttl_seconds)
+
+    def _put_local(self, key: Tuple[str, str, str], cached_price: CachedPrice, ttl_seconds: float):
+        if ttl_seconds <= 0:
+            return
+        with self.entries_lock:
+            self.entries[key] = (time.monotonic() + ttl_seconds, cached_price)
+            self.entries.move_to_end(key)
+            while len(self.entries) > ScraperConfig.PriceCache.MAX_ENTRIES:
+                self.entries.popitem(last=False)
+
+    def _is_shared_tier_available(self) -> bool:
+        return self.shared_tier_enabled and time.monotonic() >= self.shared_tier_retry_at
+
+    def _on_shared_tier_error(self, e: Exception):
+        logger.warning(f"PriceCache: Shared tier is unavailable, using only the local one for now: {e}")
+        self.shared_tier_retry_at = time.monotonic() + SHARED_TIER_RETRY_AFTER_SECONDS
+
+    def _read_shared(self, key: Tuple[str, str, str]) -> dict | None:
+        try:
+            if not self._is_shared_tier_available():
+                return None
+            # The TTL monitor runs periodically, so expired documents may still be returned
+            return CosmosDbClient().find_one(COLLECTION_NAME, {
+                "_id": self._make_document_id(key),
+                "expires_at": {"$gt": datetime.now(timezone.utc)}
+            })
+        except Exception as e:
+            self._on_shared_tier_error(e)
+            return None
+
+    def _write_shared(self, key: Tuple[str, str, str], cached_price: CachedPrice, ttl_seconds: float):
+        try:
+            if not self._is_shared_tier_available():
+                return
+            distributor, pharmacy_id, search_key = key
+            CosmosDbClient().upsert_item(COLLECTION_NAME, {"_id": self._make_document_id(key)}, {
+                "distributor": distributor,
+                "pharmacy_id": pharmacy_id,
+                "search_key": search_key,
+                "product_name": cached_price.product_name,
+                "price": cached_price.price if cached_price.is_found() else None,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds),
+                "ttl": int(ttl_seconds)
+            })
+        except Exception as e:
+            self._on_shared_tier_error(e)
+
+    @staticmethod
+    def _make_document_id(key: Tuple[str, str, str]) -> str:
+        distributor, pharmacy_id, search_key = key
+        return f"{distributor}:{pharmacy_id}:{search_key}"
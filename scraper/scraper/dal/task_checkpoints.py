@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from configuration.common import AzureConfig, ScraperConfig
+from dal.cosmosdb_client import CosmosDbClient
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "task_checkpoints"
+# A bought row is in the cart already, so writing its checkpoint is tried harder
+BOUGHT_FLUSH_ATTEMPTS = 3
+
+
+class RowCheckpoint:
+    """
+    The decision made for one row of the input file
+    """
+
+    def __init__(self, row_number: int, original_product_name: str, quantity: int,
+                 offers: List[Tuple[str, str, float]], bought_from_distributor: str | None):
+        self.row_number = row_number
+        self.original_product_name = original_product_name
+        self.quantity = quantity
+        # (distributor, product name, price) of every distributor that had the product
+        self.offers = offers
+        # None if the product wasn't bought
+        self.bought_from_distributor = bought_from_distributor
+
+    def is_bought(self) -> bool:
+        return self.bought_from_distributor is not None
+
+    def to_document(self, task_id: str, ttl_seconds: int) -> dict:
+        return {
+            "_id": f"{task_id}:{self.row_number}",
+            "task_id": task_id,
+            "row_number": self.row_number,
+            "original_product_name": self.original_product_name,
+            "quantity": self.quantity,
+            "offers": [{"distributor": distributor, "name": name, "price": price} for distributor, name, price in self.offers],
+            "bought_from_distributor": self.bought_from_distributor,
+            "ttl": ttl_seconds
+        }
+
+    @staticmethod
+    def from_document(document: dict) -> "RowCheckpoint":
+        return RowCheckpoint(
+            document["row_number"],
+            document["original_product_name"],
+            document["quantity"],
+            [(offer["distributor"], offer["name"], float(offer["price"])) for offer in document["offers"]],
+            document.get("bought_from_distributor"))
+
+    def __str__(self) -> str:
+        return str(self.__dict__)
+
+
+class TaskCheckpointStore:
+    """
+    Keeps the row decisions of one task in a side collection. Unbought rows are buffered and written in batches,
+    a crash loses at most the last batch and those rows are processed again on resume. A bought row is already
+    in the cart, so it is written right away - processing it again would add the quantity a second time.
+    A database problem never fails the task, it only makes the next resume start earlier
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = str(task_id)
+        self.enabled = ScraperConfig.Checkpoints.ENABLED and AzureConfig.CosmosDb.CONNECTION_STRING != "" and self.task_id != ""
+        self.pending: List[RowCheckpoint] = []
+        self.pending_since = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def ensure_indexes():
+        """
+        Called once when the worker starts
+        """
+        if not ScraperConfig.Checkpoints.ENABLED or AzureConfig.CosmosDb.CONNECTION_STRING == "":
+            return
+        CosmosDbClient().ensure_expiry_index(COLLECTION_NAME)
+        CosmosDbClient().ensure_index(COLLECTION_NAME, "task_id")
+
+    def load(self) -> Dict[int, RowCheckpoint]:
+        """
+        The decisions stored by the previous runs of the task, by row number
+        """
+        if not self.enabled:
+            return {}
+        try:
+            documents = CosmosDbClient().read_items(COLLECTION_NAME, filter={"task_id": self.task_id})
+        except Exception as e:
+            logger.error(f"TaskCheckpointStore: Couldn't load the checkpoints of task {self.task_id}, starting from the first row: {e}")
+            return {}
+        checkpoints = {document["row_number"]: RowCheckpoint.from_document(document) for document in documents}
+        logger.info(f"TaskCheckpointStore: Loaded {len(checkpoints)} checkpoints of task {self.task_id}")
+        return checkpoints
+
+    def clear(self):
+        if not self.enabled:
+            return
+        try:
+            deleted_count = CosmosDbClient().delete_items(COLLECTION_NAME, {"task_id": self.task_id})
+            if deleted_count > 0:
+                logger.info(f"TaskCheckpointStore: Removed {deleted_count} checkpoints of task {self.task_id}")
+        except Exception as e:
+            logger.error(f"TaskCheckpointStore: Couldn't remove the checkpoints of task {self.task_id}: {e}")
+
+    def add(self, checkpoint: RowCheckpoint):
+        if not self.enabled:
+            return
+        with self.lock:
+            if len(self.pending) == 0:
+                self.pending_since = time.monotonic()
+            self.pending.append(checkpoint)
+            is_due = checkpoint.is_bought() \
+                or len(self.pending) >= ScraperConfig.Checkpoints.BATCH_SIZE \
+                or time.monotonic() - self.pending_since >= ScraperConfig.Checkpoints.FLUSH_SECONDS
+        if not is_due:
+            return
+        attempts = BOUGHT_FLUSH_ATTEMPTS if checkpoint.is_bought() else 1
+        for _ in range(attempts):
+            if self.flush():
+                return
+        if checkpoint.is_bought():
+            logger.error(f"TaskCheckpointStore: Row {checkpoint.row_number} of task {self.task_id} is in the cart without a checkpoint, "
+                         f"a resume would add it again")
+
+    def flush(self) -> bool:
+        """
+        Writes the pending decisions. They stay pending if the write fails, so the next flush retries them
+        """
+        if not self.enabled:
+            return True
+        with self.lock:
+            if len(self.pending) == 0:
+                return True
+            ttl_seconds = ScraperConfig.Checkpoints.TTL_DAYS * 24 * 60 * 60
+            try:
+                CosmosDbClient().replace_items(
+                    COLLECTION_NAME, [checkpoint.to_document(self.task_id, ttl_seconds) for checkpoint in self.pending])
+            except Exception as e:
+                logger.error(f"TaskCheckpointStore: Couldn't write {len(self.pending)} checkpoints of task {self.task_id}: {e}")
+                return False
+            logger.info(f"TaskCheckpointStore: Wrote {len(self.pending)} checkpoints of task {self.task_id}")
+            self.pending = []
+            return True
@@ -0,0 +1,224 @@
+import logging
+from enum import Enum
+from typing import Dict, List, Tuple
+
+from configuration.common import AzureConfig, ScraperConfig
+from dal.cosmosdb_client import CosmosDbClient
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "task_shards"
+
+
+class ShardStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    # The task's own worker priced the rows itself, a worker that takes the shard later skips it
+    CANCELLED = "cancelled"
+
+
+class PricedRow:
+    """
+    The prices a shard looked up for one row of the input file
+    """
+
+    def __init__(self, row_index: int, original_product_name: str, offers: List[Tuple[str, str, float]]):
+        # The position of the row among the rows the file worker returns, duplicates and empty rows aren't counted
+        self.row_index = row_index
+        self.original_product_name = original_product_name
+        # (distributor, product name, price) of every distributor that had the product
+        self.offers = offers
+
+    def to_document(self) -> dict:
+        return {
+            "row_index": self.row_index,
+            "original_product_name": self.original_product_name,
+            "offers": [{"distributor": distributor, "name": name, "price": price} for distributor, name, price in self.offers]
+        }
+
+    @staticmethod
+    def from_document(document: dict) -> "PricedRow":
+        return PricedRow(
+            document["row_index"],
+            document["original_product_name"],
+            [(offer["distributor"], offer["name"], float(offer["price"])) for offer in document["offers"]])
+
+
+class TaskShard:
+    def __init__(self, task_id: str, index: int, first_row: int, row_count: int, status: ShardStatus = ShardStatus.QUEUED,
+                 priced_row_count: int = 0, rows: List[PricedRow] | None = None):
+        self.task_id = str(task_id)
+        self.index = index
+        self.first_row = first_row
+        self.row_count = row_count
+        self.status = status
+        self.priced_row_count = priced_row_count
+        # Only stored once the shard is done
+        self.rows = rows if rows is not None else []
+
+    def get_id(self) -> str:
+        return f"{self.task_id}:{self.index}"
+
+    def contains(self, row_index: int) -> bool:
+        return self.first_row <= row_index < self.first_row + self.row_count
+
+    def is_finished(self) -> bool:
+        return self.status in (ShardStatus.DONE, ShardStatus.FAILED, ShardStatus.CANCELLED)
+
+    def to_message(self) -> dict:
+        return {"index": self.index, "first_row": self.first_row, "row_count": self.row_count}
+
+    @staticmethod
+    def from_message(task_id: str, shard: dict) -> "TaskShard":
+        return TaskShard(task_id, int(shard["index"]), int(shard["first_row"]), int(shard["row_count"]))
+
+    def to_document(self, ttl_seconds: int) -> dict:
+        return {
+            "_id": self.get_id(),
+            "task_id": self.task_id,
+            "index": self.index,
+            "first_row": self.first_row,
+            "row_count": self.row_count,
+            "status": self.status.value,
+            "priced_row_count": self.priced_row_count,
+            "rows": [row.to_document() for row in self.rows],
+            "ttl": ttl_seconds
+        }
+
+    @staticmethod
+    def from_document(document: dict) -> "TaskShard":
+        return TaskShard(
+            document["task_id"],
+            document["index"],
+            document["first_row"],
+            document["row_count"],
+            ShardStatus(document["status"]),
+            document.get("priced_row_count", 0),
+            [PricedRow.from_document(row) for row in document.get("rows", [])])
+
+    def __str__(self) -> str:
+        return f"TaskShard(task_id={self.task_id}, index={self.index}, first_row={self.first_row}, row_count={self.row_count}, " \
+            f"status={self.status.value})"
+
+
+class TaskShardStore:
+    """
+    The price shards of one task. The status of a shard only moves forward through conditional updates,
+    so a worker that takes a shard late and the task's own worker that gave up waiting for it can't both win.
+    A database problem never fails the task, its own worker then prices the rows itself
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = str(task_id)
+        self.enabled = ScraperConfig.Sharding.ENABLED and AzureConfig.CosmosDb.CONNECTION_STRING != "" and self.task_id != ""
+
+    @staticmethod
+    def ensure_indexes():
+        """
+        Called once when the worker starts
+        """
+        if not ScraperConfig.Sharding.ENABLED or AzureConfig.CosmosDb.CONNECTION_STRING == "":
+            return
+        CosmosDbClient().ensure_expiry_index(COLLECTION_NAME)
+        CosmosDbClient().ensure_index(COLLECTION_NAME, "task_id")
+
+    @staticmethod
+    def _get_ttl_seconds() -> int:
+        return ScraperConfig.Sharding.TTL_DAYS * 24 * 60 * 60
+
+    def load(self, with_rows: bool = True) -> Dict[int, TaskShard]:
+        """
+        The shards of the task by index, empty if they couldn't be read
+        :param with_rows: False to poll only the status and the progress of the shards
+        """
+        if not self.enabled:
+            return {}
+        try:
+            documents = CosmosDbClient().read_items(
+                COLLECTION_NAME, filter={"task_id": self.task_id}, projection=None if with_rows else {"rows": 0})
+        except Exception as e:
+            logger.error(f"TaskShardStore: Couldn't load the shards of task {self.task_id}: {e}")
+            return {}
+        return {document["index"]: TaskShard.from_document(document) for document in documents}
+
+    def load_rows(self, shard: TaskShard) -> List[PricedRow]:
+        """
+        The rows priced by a shard that is done, empty if they couldn't be read
+        """
+        if not self.enabled:
+            return []
+        try:
+            document = CosmosDbClient().find_one(COLLECTION_NAME, {"_id": shard.get_id()})
+        except Exception as e:
+            logger.error(f"TaskShardStore: Couldn't load the rows of {shard}: {e}")
+            return []
+        if document is None:
+            return []
+        return [PricedRow.from_document(row) for row in document.get("rows", [])]
+
+    def save(self, shards: List[TaskShard]) -> bool:
+        if not self.enabled:
+            return False
+        try:
+            CosmosDbClient().replace_items(COLLECTION_NAME, [shard.to_document(self._get_ttl_seconds()) for shard in shards])
+            return True
+        except Exception as e:
+            logger.error(f"TaskShardStore: Couldn't save the shards of task {self.task_id}: {e}")
+            return False
+
+    def _set_status(self, shard: TaskShard, from_statuses: List[ShardStatus], document: dict) -> bool:
+        """
+        Updates the shard only if it is in one of `from_statuses`
+        """
+        if not self.enabled:
+            return False
+        try:
+            matched_count = CosmosDbClient().update_items(
+                COLLECTION_NAME,
+                {"_id": shard.get_id(), "status": {"$in": [status.value for status in from_statuses]}},
+                document)
+            return matched_count > 0
+        except Exception as e:
+            logger.error(f"TaskShardStore: Couldn't update {shard}: {e}")
+            return False
+
+    def start(self, shard: TaskShard) -> bool:
+        """
+        False if the shard was cancelled or is done. A shard whose worker stopped is started again
+        """
+        return self._set_status(shard, [ShardStatus.QUEUED, ShardStatus.RUNNING],
+                                {"status": ShardStatus.RUNNING.value, "priced_row_count": 0})
+
+    def report_progress(self, shard: TaskShard, priced_row_count: int) -> bool:
+        """
+        False if the shard was cancelled meanwhile
+        """
+        return self._set_status(shard, [ShardStatus.RUNNING], {"priced_row_count": priced_row_count})
+
+    def finish(self, shard: TaskShard, rows: List[PricedRow]) -> bool:
+        return self._set_status(shard, [ShardStatus.RUNNING], {
+            "status": ShardStatus.DONE.value,
+            "priced_row_count": len(rows),
+            "rows": [row.to_document() for row in rows],
+            "ttl": self._get_ttl_seconds()
+        })
+
+    def fail(self, shard: TaskShard) -> bool:
+        return self._set_status(shard, [ShardStatus.RUNNING], {"status": ShardStatus.FAILED.value})
+
+    def cancel(self, shard: TaskShard) -> bool:
+        """
+        False if the shard finished meanwhile
+        """
+        return self._set_status(shard, [ShardStatus.QUEUED, ShardStatus.RUNNING], {"status": ShardStatus.CANCELLED.value})
+
+    def clear(self):
+        if not self.enabled:
+            return
+        try:
+            CosmosDbClient().delete_items(COLLECTION_NAME, {"task_id": self.task_id})
+        except Exception as e:
+            logger.error(f"TaskShardStore: Couldn't remove the shards of task {self.task_id}: {e}")
@@ -1,5 +1,9 @@
+import base64
+import io
 import logging
-from azure.storage.blob import BlobServiceClient
+from typing import IO, Iterator
+
+from azure.storage.blob import BlobBlock, BlobServiceClient
 
 from configuration.common import AzureConfig
 
@@ -7,6 +11,39 @@ from configuration.common import AzureConfig
 logger = logging.getLogger(__name__)
 
 
+# Large enough for the content sniffing of the input readers
+STREAM_BUFFER_SIZE = 1024 * 1024
+
+
+class BlobChunkStream(io.RawIOBase):
+    """
+    Read-only file object over the chunks of a blob download, the chunks are fetched while the stream is read
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        # Fills the whole buffer unless the blob ends, so a peek sees as much of the content as it asks for
+        filled = 0
+        while filled < len(buffer):
+            if len(self._chunk) == 0:
+                try:
+                    self._chunk = memoryview(next(self._chunks))
+                except StopIteration:
+                    break
+                continue
+            size = min(len(buffer) - filled, len(self._chunk))
+            buffer[filled:filled + size] = self._chunk[:size]
+            self._chunk = self._chunk[size:]
+            filled += size
+        return filled
+
+
 class AzureBlobClient:
     def __init__(self):
         self.connection_string = AzureConfig.BlobStorage.CONNECTION_STRING
@@ -25,6 +62,28 @@ class AzureBlobClient:
         blob_client = self._get_blob_client(self.output_container_name, blob_name)
         blob_client.upload_blob(data, overwrite=True)
 
+    def upload_stream_to_output_container(self, blob_name: str, stream: IO[bytes]) -> str:
+        """
+        Uploads the stream block by block, so at most one block is held in memory. Returns the URL of the blob
+        """
+        blob_client = self._get_blob_client(self.output_container_name, blob_name)
+        block_size = AzureConfig.BlobStorage.UPLOAD_BLOCK_SIZE_MB * 1024 * 1024
+        block_list = []
+        total_size = 0
+        while True:
+            data = stream.read(block_size)
+            if not data:
+                break
+            # The block IDs of a blob must be of the same length
+            block_id = base64.b64encode(f"{len(block_list):06d}".encode()).decode()
+            blob_client.stage_block(block_id, data)
+            block_list.append(BlobBlock(block_id=block_id))
+            total_size += len(data)
+        blob_client.commit_block_list(block_list)
+        logger.info(f"Uploaded blob {blob_name} to container {self.output_container_name} "
+                    f"with size {total_size} bytes in {len(block_list)} blocks")
+        return blob_client.url
+
     def upload_blob_to_log_container(self, blob_name, data):
         logger.info(f"Uploading blob {blob_name} to container {self.log_container_name} with size {len(data)} bytes")
         blob_client = self._get_blob_client(self.log_container_name, blob_name)
@@ -34,3 +93,8 @@ class AzureBlobClient:
         logger.info(f"Downloading blob {blob_name} from container {self.input_container_name}")
         blob_client = self._get_blob_client(self.input_container_name, blob_name)
         return blob_client.download_blob().readall()
+
+    def open_blob_stream_from_input_container(self, blob_name: str) -> io.BufferedReader:
+        logger.info(f"Streaming blob {blob_name} from container {self.input_container_name}")
+        blob_client = self._get_blob_client(self.input_container_name, blob_name)
+        return io.BufferedReader(BlobChunkStream(blob_client.download_blob().chunks()), buffer_size=STREAM_BUFFER_SIZE)
@@ -1,14 +1,13 @@
-import math
 import logging
 import os
-from urllib.parse import urlparse
-import openpyxl
-from openpyxl.styles import Font
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.worksheet import Worksheet
+from itertools import islice
+from typing import List, Tuple
+from urllib.parse import unquote, urlparse
 
-from files.file_worker import FileWorker, RowInfo, WorkerProgress
+from files.file_worker import FileWorker, InputRow, RowInfo, WorkerProgress
 from files.azure_blob_client import AzureBlobClient
+from files.input_readers import InputReader, open_input_reader
+from files.product_name_normalizer import normalize_batch
 
 # Create a logger for this module
 logger = logging.getLogger(__name__)
@@ -19,26 +18,29 @@ logger = logging.getLogger(__name__)
 # NUMBER_OF_ROWS_TO_SKIP_FROM_INPUT_SHEET = 10
 # new format
 NUMBER_OF_ROWS_TO_SKIP_FROM_INPUT_SHEET = 0
-COLUMN_TO_FILL = 0
+# The validation message lists at most this many row errors, the rest are only counted
+MAX_REPORTED_ROW_ERRORS = 50
 
 
 class ExcelWorker(FileWorker):
-    inputFile: openpyxl.Workbook | None = None
-    inputSheet: Worksheet | None = None
+    """
+    Handles the input files in blob storage - xlsx, xls and csv
+    """
+    inputReader: InputReader | None = None
     inputFilename = ""
-    outputFile: openpyxl.Workbook | None = None
-    outputSheet: Worksheet | None = None
-    outputFilename = ""
 
     def __init__(self):
         self.currentInputRow = 1 + NUMBER_OF_ROWS_TO_SKIP_FROM_INPUT_SHEET
 
-        self.currentOutputRow = 1
         self.originalProductName = '...'
         self.nrows = 0
+        # Built by the single pass over the input sheet
+        self.rowIndex: List[InputRow] | None = None
+        self.rowIndexPosition = 0
+        # Collected in the same pass that builds the row index
+        self.rowErrors: List[Tuple[int, str]] = []
 
         self.notBoughtProducts = []
-        self.boughtProducts = []
         # This set is needed in order to ignore duplicate products in our input file
         self.metProducts = set()
 
@@ -47,261 +49,157 @@ class ExcelWorker(FileWorker):
         parsed_url = urlparse(blob_url)
         path = parsed_url.path
         # Extract the filename
-        self.inputFilename = os.path.basename(path)
-
-        extensionPos = self.inputFilename.find(".xlsx")
-        self.outputFilename = self.inputFilename[:extensionPos] + "_Report" + self.inputFilename[extensionPos:]
-
-        fileBytes = AzureBlobClient().download_blob_from_input_container(self.inputFilename)
-        with open(self.inputFilename, "wb") as file:
-            file.write(fileBytes)
-            logger.info("ExcelWorker: File downloaded successfully into: " + self.inputFilename)
+        self.inputFilename = unquote(os.path.basename(path))
 
         try:
-            self.inputFile = openpyxl.load_workbook(self.inputFilename, read_only=True)
-            self.inputSheet = self.inputFile.active  # type: ignore
-            if self.inputSheet is None:
-                raise Exception("ExcelWorker: Can't open input file")
-            logger.info("ExcelWorker: Input sheet name: " + self.inputSheet.title)
-            logger.info("ExcelWorker: Input file opened successfully from: " + self.inputFilename)
+            # The blob is read while it is downloaded, nothing is written to disk
+            stream = AzureBlobClient().open_blob_stream_from_input_container(self.inputFilename)
+            self.inputReader = open_input_reader(stream)
+            logger.info(f"ExcelWorker: Input file {self.inputFilename} opened with {type(self.inputReader).__name__}")
         except Exception as e:
             logger.exception(f"ExcelWorker: Can't open input file: {str(e)}")
             raise Exception(f"ExcelWorker: Can't open input file: {str(e)}")
 
-        self.outputFile = openpyxl.Workbook()
-        self.outputSheet = self.outputFile["Sheet"]
-        self.outputSheet.title = "Report"
+    def _getRowIndex(self) -> List[InputRow]:
+        """
+        Reads the input sheet once, every later access goes through the index
+        """
+        if self.rowIndex is not None:
+            return self.rowIndex
+        if self.inputReader is None:
+            raise Exception("ExcelWorker: Input file is not opened")
 
-    def _test_writing_to_output_file(self):
-        logger.info("ExcelWorker: Test if we can write to output file")
+        self.rowErrors = []
+        # (row number, product name, quantity), the names are normalized together after the pass
+        rawRows: List[Tuple[int, str, int | None]] = []
+        lastRowNumber = 0
+        emptyRowNumbers: List[int] = []
+        for rowNumber, row in enumerate(
+                islice(self.inputReader.iter_rows(), NUMBER_OF_ROWS_TO_SKIP_FROM_INPUT_SHEET, None),
+                start=1 + NUMBER_OF_ROWS_TO_SKIP_FROM_INPUT_SHEET):
+            if all(value is None for value in row):
+                emptyRowNumbers.append(rowNumber)
+                continue
+            lastRowNumber = rowNumber
+            rowError = self._validateRow(rowNumber, row[1], row[3])
+            if rowError is not None:
+                self.rowErrors.append(rowError)
+            rawRows.append((rowNumber, "" if row[1] is None else str(row[1]), self._parseQuantity(row[3])))
+
+        self.nrows = lastRowNumber
+        self.closeInputFile()
+        normalizedNames = normalize_batch(productName for _, productName, _ in rawRows)
+        self.rowIndex = [
+            InputRow(rowNumber, normalizedName.original_product_name, normalizedName.product_name_variations,
+                     productQuantity, normalizedName.canonical_key)
+            for (rowNumber, _, productQuantity), normalizedName in zip(rawRows, normalizedNames)
+        ]
+        # Only the trailing empty rows are allowed
+        for rowNumber in emptyRowNumbers:
+            if rowNumber < lastRowNumber:
+                self.rowErrors.append(self._validateRow(rowNumber, None, None))
+        self.rowErrors.sort(key=lambda rowError: rowError[0])
+        logger.info(f"ExcelWorker: Indexed {len(self.rowIndex)} rows, the last one is row {self.nrows}")
+        return self.rowIndex
+
+    @staticmethod
+    def _parseQuantity(value) -> int | None:
+        # Invalid quantities are reported by validate_input, here they only make the row unbuyable
         try:
-            if self.outputFile is not None:
-                self.outputFile.save(self.outputFilename)
-        except Exception as e:
-            logger.exception(f"ExcelWorker: Can't write to output file: {str(e)}")
-            raise Exception(f"Моля затворене Report файла и опитайте отново!\n\n{self.outputFilename}")
+            return int(value)
+        except (TypeError, ValueError):
+            return None
 
     def getNumberOfRows(self):
-        if self.inputSheet is None:
-            raise Exception("ExcelWorker: Input file is not opened")
-
-        max_row = 0
-        for row in self.inputSheet.iter_rows():
-            if any(cell.value is not None for cell in row):
-                max_row = row[0].row
-        return max_row
+        self._getRowIndex()
+        return self.nrows
 
     def get_next_row(self) -> RowInfo:
-        if self.inputSheet is None:
-            raise Exception("ExcelWorker: Input file is not opened")
-
-        self.nrows = self.getNumberOfRows() + 1
-        # self.nrows = 5
-
-        # while self.currentInputRow < self.nrows:
-        for row in self.inputSheet.iter_rows(min_row=self.currentInputRow, max_row=self.inputSheet.max_row, max_col=4):
+        rowIndex = self._getRowIndex()
 
-            logger.info("ExcelWorker: Reading row %d from %d", self.currentInputRow, self.nrows)
-            # self.markRowInProgress()
-            # currentInputRow = self.currentInputRow
-            self.currentInputRow += 1
+        while self.rowIndexPosition < len(rowIndex):
+            inputRow = rowIndex[self.rowIndexPosition]
+            self.rowIndexPosition += 1
+            self.currentInputRow = inputRow.row_number + 1
 
-            # self.originalProductName, currentProductNameVariations = self._generateProductNameVariations(
-            #     self.inputSheet.cell(row=currentInputRow, column=2).value
-            #     )
-            logger.info(f"Product name: {row[1].value}, Product quantity: {row[3].value}")
-            self.originalProductName, currentProductNameVariations = self._generateProductNameVariations(row[1].value)
+            logger.info("ExcelWorker: Reading row %d from %d", inputRow.row_number, self.nrows)
+            logger.info(f"Product name: {inputRow.original_product_name}, Product quantity: {inputRow.product_quantity}")
+            self.originalProductName = inputRow.original_product_name
             # If the products has been met, ignore it and continue to the next row
-            if (self.originalProductName not in self.metProducts):
-                try:
-                    # value = self.inputSheet.cell(row=currentInputRow, column=4).value
-                    value = row[3].value
-                    self.currentProductQuantity = int(value)  # type: ignore
-                except TypeError:
-                    # The quantity of the product is most probably empty. Skip this row
+            if (inputRow.canonical_key not in self.metProducts):
+                if inputRow.product_quantity is None:
+                    # The quantity of the product is empty. Skip this row
                     self.addNotBoughtProduct(self.originalProductName, -1)
                     continue
-                self.metProducts.add(self.originalProductName)
-                return RowInfo(self.originalProductName, currentProductNameVariations, self.currentProductQuantity)
+                self.currentProductQuantity = inputRow.product_quantity
+                self.metProducts.add(inputRow.canonical_key)
+                return RowInfo(self.originalProductName, inputRow.product_name_variations, self.currentProductQuantity,
+                               inputRow.row_number)
             else:
                 logger.info("ExcelWorker: Skipping duplicate product: " + self.originalProductName)
 
         return RowInfo(None, None, None)
 
-    # TODO: Mark progress NOT in the excel file, but in the database
-    def markRowInProgress(self):
-        if self.inputSheet is None:
-            raise Exception("ExcelWorker: Input file is not opened")
-
-        logger.info(f"Marking row: {self.currentInputRow} and column: {COLUMN_TO_FILL + 1}")
-        # green_fill = PatternFill(start_color='00FF00', end_color='00FF00', fill_type='solid')
-        # self.inputSheet.cell(row=self.currentInputRow, column=COLUMN_TO_FILL + 1).fill = green_fill
-
-    # TODO: Mark progress NOT in the excel file, but in the database
-    def unmarkAllRows(self):
-        pass
-        # for currentRow in range(1, self.nrows + 1):
-        #     self._unmarkRow(currentRow)
-
-    # TODO: Mark progress NOT in the excel file, but in the database
-    def _unmarkRow(self, row):
-        pass
-        # if self.inputSheet is None:
-        #     raise Exception("ExcelWorker: Input file is not opened")
-
-        # no_fill = PatternFill(start_color='000000', end_color='000000')
-        # self.inputSheet.cell(row=row, column=COLUMN_TO_FILL + 1).fill = no_fill
-
-    # TODO: Mark progress NOT in the excel file, but in the database
-    def getLastMarkedRow(self):
-        pass
-        # if self.inputSheet is None:
-        #     raise Exception("ExcelWorker: Input file is not opened")
-
-        # last_marked_row = None
-        # for row in self.inputSheet.iter_rows():
-        #     cell = row[COLUMN_TO_FILL]
-        #     if cell.fill and cell.fill.start_color.rgb != '00000000':  # Check if the cell has green fill
-        #         last_marked_row = cell.row
-        # return last_marked_row
-
-    def _checkValuesForCorrectness(self, currentRow):
-        if self.inputSheet is None:
-            raise Exception("ExcelWorker: Input file is not opened")
-
-        productName = self.inputSheet.cell(row=currentRow, column=2).value
+    @staticmethod
+    def _validateRow(rowNumber: int, productName, productQuantity) -> Tuple[int, str] | None:
+        """
+        Returns the first problem of the row, if any
+        """
         if isinstance(productName, str) is not True:
-            raise Exception("Проблем с входния Excel файл.\n\nРед: " + str(currentRow)
-                            + ", Името на продукта е: " + str(productName) + ". Трябва да бъде валиден текст, а не число."
-                            + "\nОбщ брой редове във файла: " + str(self.nrows))
+            return rowNumber, "Ред: " + str(rowNumber) \
+                + ", Името на продукта е: " + str(productName) + ". Трябва да бъде валиден текст, а не число."
 
-        productQuantity = self.inputSheet.cell(row=currentRow, column=4).value
         if isinstance(productQuantity, float) and productQuantity.is_integer():
             productQuantity = int(productQuantity)
         if isinstance(productQuantity, int) is not True:
-            raise Exception("Проблем с входния Excel файл.\n\nРед: " + str(currentRow)
-                            + ", Желан брой покупка на продукт е: " + str(productQuantity)
-                            + "(" + str(type(productQuantity)) + ")" + ". Трябва да бъде валидно число, а не текст."
-                            + "\nОбщ брой редове във файла: " + str(self.nrows))
-
-        if len(str(productName).strip()) == 0:
-            raise Exception("Проблем с входния Excel файл.\n\nРед: " + str(currentRow)
-                            + ", Името на продукта е: " + str(productName) + ". Полето е празно."
-                            + "\nОбщ брой редове във файла: " + str(self.nrows))
-        if len(str(productQuantity).strip()) == 0:
-            raise Exception("Проблем с входния Excel файл.\n\nРед: " + str(currentRow)
-                            + ", Желан брой покупка на продукт е: " + str(productName) + ". Полето е празно."
-                            + "\nОбщ брой редове във файла: " + str(self.nrows))
+            return rowNumber, "Ред: " + str(rowNumber) \
+                + ", Желан брой покупка на продукт е: " + str(productQuantity) \
+                + "(" + str(type(productQuantity)) + ")" + ". Трябва да бъде валидно число, а не текст."
+
+        if len(productName.strip()) == 0:
+            return rowNumber, "Ред: " + str(rowNumber) \
+                + ", Името на продукта е: " + str(productName) + ". Полето е празно."
+
+        return None
 
     def validate_input(self):
-        self.nrows = self.getNumberOfRows()
+        """
+        Checks every row in the same pass that builds the row index and reports all problems at once
+        """
+        self._getRowIndex()
         logger.info("Общ брой редове във файла: " + str(self.nrows) + "\n")
 
-        for currentRow in range(1, self.nrows + 1):
-            self._checkValuesForCorrectness(currentRow)
+        if len(self.rowErrors) == 0:
+            return
+
+        message = "Проблем с входния Excel файл.\n\n" \
+            + "\n".join(rowError for _, rowError in self.rowErrors[:MAX_REPORTED_ROW_ERRORS])
+        if len(self.rowErrors) > MAX_REPORTED_ROW_ERRORS:
+            message += "\n... и още " + str(len(self.rowErrors) - MAX_REPORTED_ROW_ERRORS) + " реда с проблеми"
+        message += "\nОбщ брой редове във файла: " + str(self.nrows)
+        raise Exception(message)
 
     def setProgress(self, newCurrentInputRow):
         self.currentInputRow = newCurrentInputRow
+        rowIndex = self._getRowIndex()
+        self.rowIndexPosition = 0
+        while self.rowIndexPosition < len(rowIndex) and rowIndex[self.rowIndexPosition].row_number < newCurrentInputRow:
+            self.rowIndexPosition += 1
 
     def get_progress(self) -> WorkerProgress:
         return WorkerProgress(
             self.originalProductName,
             self.currentInputRow - NUMBER_OF_ROWS_TO_SKIP_FROM_INPUT_SHEET - 1,
-            self.nrows - NUMBER_OF_ROWS_TO_SKIP_FROM_INPUT_SHEET - 1
+            self.nrows - NUMBER_OF_ROWS_TO_SKIP_FROM_INPUT_SHEET
         )
 
-    def _writeBoughtProducts(self):
-        if self.outputSheet is None:
-            raise Exception("ExcelWorker: Output file is not opened")
-
-        fontBold = Font(bold=True)
-
-        # Write header
-        self.outputSheet.cell(self.currentOutputRow, 1).value = "Продукт"
-        self.outputSheet.cell(self.currentOutputRow, 1).font = fontBold
-        self.outputSheet.column_dimensions[get_column_letter(1)].width = 40
-        self.outputSheet.cell(self.currentOutputRow, 2).value = "Sting - име на продукт"
-        self.outputSheet.cell(self.currentOutputRow, 2).font = fontBold
-        self.outputSheet.column_dimensions[get_column_letter(2)].width = 40
-        self.outputSheet.cell(self.currentOutputRow, 3).value = "Sting - цена"
-        self.outputSheet.cell(self.currentOutputRow, 3).font = fontBold
-        self.outputSheet.column_dimensions[get_column_letter(3)].width = 20
-        self.outputSheet.cell(self.currentOutputRow, 4).value = "Phoenix - име на продукт"
-        self.outputSheet.cell(self.currentOutputRow, 4).font = fontBold
-        self.outputSheet.column_dimensions[get_column_letter(4)].width = 40
-        self.outputSheet.cell(self.currentOutputRow, 5).value = "Phoenix - цена"
-        self.outputSheet.cell(self.currentOutputRow, 5).font = fontBold
-        self.outputSheet.column_dimensions[get_column_letter(5)].width = 20
-        self.outputSheet.cell(self.currentOutputRow, 6).value = "Добавен в количката на"
-        self.outputSheet.cell(self.currentOutputRow, 6).font = fontBold
-        self.outputSheet.column_dimensions[get_column_letter(6)].width = 40
-
-        self.currentOutputRow += 1
-
-        # Write content
-        for boughProduct in self.boughtProducts:
-            self.outputSheet.cell(self.currentOutputRow, 1).value = boughProduct[0]
-
-            self.outputSheet.cell(self.currentOutputRow, 2).value = boughProduct[1]
-            self.outputSheet.cell(self.currentOutputRow, 3).value = boughProduct[2]
-            self.outputSheet.cell(self.currentOutputRow, 4).value = boughProduct[3]
-            self.outputSheet.cell(self.currentOutputRow, 5).value = boughProduct[4]
-
-            if boughProduct[5] == "Sting":
-                self.outputSheet.cell(self.currentOutputRow, 2).font = fontBold
-                self.outputSheet.cell(self.currentOutputRow, 3).font = fontBold
-            if boughProduct[5] == "Phoenix":
-                self.outputSheet.cell(self.currentOutputRow, 4).font = fontBold
-                self.outputSheet.cell(self.currentOutputRow, 5).font = fontBold
-
-            self.outputSheet.cell(self.currentOutputRow, 6).value = boughProduct[5]
-            self.currentOutputRow += 1
-
     def addNotBoughtProduct(self, product_name: str, product_amount: int):
         self.notBoughtProducts.append((product_name, product_amount))
 
-    def addBoughtProduct(self, original_product_name: str,
-                         sting_pharmacy_product_name: str, sting_pharmacy_product_price: float,
-                         phoenix_pharmacy_product_name: str, phoenix_pharmacy_product_price: float,
-                         bought_from_distributor: str):
-        self.boughtProducts.append((original_product_name,
-                                    sting_pharmacy_product_name, -1 if sting_pharmacy_product_price == math.inf
-                                    else sting_pharmacy_product_price,
-                                    phoenix_pharmacy_product_name, -1 if phoenix_pharmacy_product_price == math.inf
-                                    else phoenix_pharmacy_product_price,
-                                    bought_from_distributor))
-
-    def _writeNotBoughtProducts(self):
-        if self.outputFile is None or self.outputSheet is None:
-            raise Exception("ExcelWorker: Input file is not opened")
-
-        fontBigBold = Font(bold=True, size=18)
-        # Write header
-        self.currentOutputRow += 1  # add an empty row
-        self.outputSheet.cell(self.currentOutputRow, 1).value = "Списък с некупени продукти"
-        self.outputSheet.cell(self.currentOutputRow, 1).font = fontBigBold
-        self.currentOutputRow += 1
-        # Write content
-        for (notBoughProductName, notBoughProductAmount) in self.notBoughtProducts:
-            self.outputSheet.cell(self.currentOutputRow, 1).value = notBoughProductName
-            self.outputSheet.cell(self.currentOutputRow, 2).value = notBoughProductAmount
-            self.currentOutputRow += 1
-
-    def saveOutputFile(self):
-        if self.outputFile is None:
-            raise Exception("ExcelWorker: Input file is not opened")
-
-        logger.info("ExcelWorker: saveOutputFile")
-        self._writeBoughtProducts()
-        self._writeNotBoughtProducts()
-        self.outputFile.save(self.outputFilename)
-
     def closeInputFile(self):
-        if self.inputFile is None:
-            raise Exception("ExcelWorker: Input file is not opened")
+        if self.inputReader is None:
+            return
 
         logger.info("ExcelWorker: closeInputFile")
-        self.inputFile.save(self.inputFilename)
-
-    def getOutputFilename(self):
-        return self.outputFilename
+        self.inputReader.close()
+        self.inputReader = None
@@ -1,14 +1,35 @@
 
 
-import re
 from typing import List
 
 
 class RowInfo:
-    def __init__(self, original_product_name: str | None, product_name_variations: List[str] | None, product_quantity: int | None):
+    def __init__(self, original_product_name: str | None, product_name_variations: List[str] | None, product_quantity: int | None,
+                 row_number: int | None = None):
         self.original_product_name = original_product_name
         self.product_name_variations = product_name_variations
         self.product_quantity = product_quantity
+        # Identifies the row in the task checkpoints, stable between runs over the same input
+        self.row_number = row_number
+
+    def __str__(self) -> str:
+        return str(self.__dict__)
+
+
+class InputRow:
+    """
+    A non-empty row of the input file, as read in the single pass over the file
+    """
+
+    def __init__(self, row_number: int, original_product_name: str, product_name_variations: List[str], product_quantity: int | None,
+                 canonical_key: str):
+        self.row_number = row_number
+        self.original_product_name = original_product_name
+        self.product_name_variations = product_name_variations
+        # Rows with the same key are duplicates of the same product
+        self.canonical_key = canonical_key
+        # None if the quantity cell is empty
+        self.product_quantity = product_quantity
 
     def __str__(self) -> str:
         return str(self.__dict__)
@@ -61,43 +82,3 @@ class FileWorker:
 
     def get_progress(self) -> WorkerProgress:
         raise NotImplementedError("Subclasses must implement this method")
-
-    def _generateProductNameVariations(self, productName):
-        result = []
-        productName_xWithSpaces = productName\
-            .strip()\
-            .replace(".", " ")\
-            .replace("/", " ")\
-            .replace("!", "")\
-            .replace("тбл", "")
-
-        # define desired replacements
-        rep = {"x ": "x",  # English x
-               "х ": "х"}  # Българско х
-        # use these three lines to do the replacement
-        rep = dict((re.escape(k), v) for k, v in rep.items())
-        pattern = re.compile("|".join(rep.keys()))
-        productName_xWithoutSpaces = pattern.sub(lambda m: rep[re.escape(m.group(0))], productName_xWithSpaces)
-
-        productName_withoutX = productName_xWithoutSpaces.replace("x", "").replace("х", "")
-
-        result.append(productName_xWithoutSpaces)  # 1
-        result.append(productName_xWithSpaces)  # 2
-        result.append(productName_withoutX)  # 3
-
-        # make result to contain only unique strings
-        result = self._uniqueList(result)
-        return productName, result
-
-    # We need this custom method in order to retain the order of the elements
-    def _uniqueList(self, myList: list):
-        # initialize a null list
-        unique_list = []
-
-        # traverse for all elements
-        for x in myList:
-            # check if exists in unique_list or not
-            if x not in unique_list:
-                unique_list.append(x)
-
-        return unique_list
@@ -0,0 +1,140 @@
+import codecs
+import csv
+import io
+import logging
+from typing import IO, Iterator, Tuple
+
+import openpyxl
+import xlrd
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Only the first columns of the input files are used: B is the product name and D is the quantity
+NUMBER_OF_COLUMNS = 4
+
+XLSX_MAGIC = b"PK\x03\x04"
+XLS_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+CSV_SNIFF_SIZE = 64 * 1024
+CSV_DELIMITERS = ";,\t|"
+# Bulgarian CSV exports which are not UTF-8 are practically always Windows-1251
+CSV_FALLBACK_ENCODING = "cp1251"
+
+
+class InputReader:
+    """
+    Reads the rows of an input file in order, as tuples of NUMBER_OF_COLUMNS cell values. Empty cells are None
+    """
+
+    def iter_rows(self) -> Iterator[Tuple]:
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _pad(row) -> Tuple:
+        row = tuple(row[:NUMBER_OF_COLUMNS])
+        return row + (None,) * (NUMBER_OF_COLUMNS - len(row))
+
+
+class XlsxReader(InputReader):
+    def __init__(self, stream: IO[bytes]):
+        # The zip directory is at the end of the file, so openpyxl needs the whole file to seek in
+        self.workbook = openpyxl.load_workbook(io.BytesIO(stream.read()), read_only=True)
+        self.sheet = self.workbook.active
+        if self.sheet is None:
+            raise Exception("XlsxReader: The workbook has no active sheet")
+        logger.info("XlsxReader: Input sheet name: " + self.sheet.title)
+
+    def iter_rows(self) -> Iterator[Tuple]:
+        for row in self.sheet.iter_rows(max_col=NUMBER_OF_COLUMNS, values_only=True):
+            yield self._pad(row)
+
+    def close(self):
+        self.workbook.close()
+
+
+class XlsReader(InputReader):
+    def __init__(self, stream: IO[bytes]):
+        # The OLE2 container of the old format needs random access as well
+        self.workbook = xlrd.open_workbook(file_contents=stream.read(), on_demand=True)
+        self.sheet = self.workbook.sheet_by_index(0)
+        logger.info("XlsReader: Input sheet name: " + self.sheet.name)
+
+    def iter_rows(self) -> Iterator[Tuple]:
+        for row_number in range(self.sheet.nrows):
+            row = self.sheet.row_values(row_number, 0, min(NUMBER_OF_COLUMNS, self.sheet.ncols))
+            yield self._pad([None if value == "" else value for value in row])
+
+    def close(self):
+        self.workbook.release_resources()
+
+
+class CsvReader(InputReader):
+    """
+    Decodes and parses the file while it is being downloaded, so it is never held in memory as a whole
+    """
+
+    def __init__(self, stream: io.BufferedReader):
+        sample = stream.peek(CSV_SNIFF_SIZE)[:CSV_SNIFF_SIZE]
+        encoding = self._sniff_encoding(sample)
+        self.text_stream = io.TextIOWrapper(stream, encoding=encoding, newline="")
+        delimiter = self._sniff_delimiter(sample.decode(encoding, errors="ignore"))
+        logger.info(f"CsvReader: Reading CSV with encoding {encoding} and delimiter {delimiter!r}")
+        self.reader = csv.reader(self.text_stream, delimiter=delimiter)
+
+    def iter_rows(self) -> Iterator[Tuple]:
+        for row in self.reader:
+            yield self._pad([self._to_value(text) for text in row])
+
+    def close(self):
+        self.text_stream.close()
+
+    @staticmethod
+    def _sniff_encoding(sample: bytes) -> str:
+        if sample.startswith(codecs.BOM_UTF8):
+            return "utf-8-sig"
+        try:
+            # The sample may end in the middle of a character, which the incremental decoder allows
+            codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+            return "utf-8"
+        except UnicodeDecodeError:
+            return CSV_FALLBACK_ENCODING
+
+    @staticmethod
+    def _sniff_delimiter(sample_text: str) -> str:
+        try:
+            return csv.Sniffer().sniff(sample_text, delimiters=CSV_DELIMITERS).delimiter
+        except csv.Error:
+            return ","
+
+    @staticmethod
+    def _to_value(text: str):
+        """
+        Gives the cells the types a spreadsheet would have
+        """
+        text = text.strip()
+        if text == "":
+            return None
+        try:
+            return int(text)
+        except ValueError:
+            pass
+        try:
+            return float(text.replace(",", "."))
+        except ValueError:
+            return text
+
+
+def open_input_reader(stream: io.BufferedReader) -> InputReader:
+    """
+    Picks the reader by the first bytes of the content, the file extension is not trusted
+    """
+    header = stream.peek(len(XLS_MAGIC))[:len(XLS_MAGIC)]
+    if header.startswith(XLSX_MAGIC):
+        return XlsxReader(stream)
+    if header.startswith(XLS_MAGIC):
+        return XlsReader(stream)
+    return CsvReader(stream)
@@ -2,6 +2,7 @@ import json
 import logging
 
 from files.file_worker import FileWorker, RowInfo, WorkerProgress
+from files.product_name_normalizer import normalize
 
 
 class ProductInfo:
@@ -49,11 +50,11 @@ class JsonContentWorker(FileWorker):
             current_row = self.current_row
             self.current_row += 1
 
-            self.original_product_name, currentProductNameVariations = self._generateProductNameVariations(
-                self.json_data["rows"][current_row].get("product_name")
-            )
+            normalized_name = normalize(self.json_data["rows"][current_row].get("product_name"))
+            self.original_product_name = normalized_name.original_product_name
+            currentProductNameVariations = normalized_name.product_name_variations
             # If the products has been met, ignore it and continue to the next row
-            if (self.original_product_name not in self.met_products):
+            if (normalized_name.canonical_key not in self.met_products):
                 try:
                     value = self.json_data["rows"][current_row].get("quantity")
                     self.currentProductQuantity = int(value)  # type: ignore
@@ -62,8 +63,9 @@ class JsonContentWorker(FileWorker):
                     # TODO: Do this through the worker somehow
                     # self.add_not_bought_product(self.original_product_name, -1)
                     continue
-                self.met_products.add(self.original_product_name)
-                return RowInfo(self.original_product_name, currentProductNameVariations, self.currentProductQuantity)
+                self.met_products.add(normalized_name.canonical_key)
+                return RowInfo(self.original_product_name, currentProductNameVariations, self.currentProductQuantity,
+                               current_row + 1)
             else:
                 logging.info("ExcelWorker: Skipping duplicate product: " + self.original_product_name)
 
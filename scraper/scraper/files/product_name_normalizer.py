@@ -0,0 +1,114 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+# Distinct product names kept by the memo. Orders repeat the same products, so the memo is shared by all tasks
+NORMALIZER_CACHE_SIZE = 8192
+
+# Latin letters and their Cyrillic look-alikes. Input files are typed on both keyboard layouts and
+# mix them inside one word, which the distributor searches don't match
+LATIN_TO_CYRILLIC = {
+    "A": "А", "B": "В", "C": "С", "E": "Е", "H": "Н", "K": "К", "M": "М", "O": "О", "P": "Р", "T": "Т",
+    "X": "Х", "Y": "У", "a": "а", "c": "с", "e": "е", "o": "о", "p": "р", "x": "х", "y": "у",
+}
+CYRILLIC_TO_LATIN = {cyrillic: latin for latin, cyrillic in LATIN_TO_CYRILLIC.items()}
+
+_TO_CYRILLIC_TABLE = str.maketrans(LATIN_TO_CYRILLIC)
+_TO_LATIN_TABLE = str.maketrans(CYRILLIC_TO_LATIN)
+# Separators become spaces, the rest is dropped
+_SEARCH_CLEANUP_TABLE = str.maketrans({".": " ", "/": " ", "!": ""})
+_KEY_CLEANUP_TABLE = str.maketrans({".": " ", "/": " ", ",": " ", "!": "", "\"": "", "'": ""})
+
+_LETTER_PATTERN = re.compile(r"[^\W\d_]")
+_CYRILLIC_LETTER_PATTERN = re.compile(r"[Ѐ-ӿ]")
+_TOKEN_PATTERN = re.compile(r"\S+")
+_TABLET_PATTERN = re.compile("тбл")
+# "x " and "х " (Latin and Cyrillic) before the pack size, as in "х 20"
+_X_SPACE_PATTERN = re.compile("([xх]) ")
+_X_PATTERN = re.compile("[xх]")
+# The pack size multiplier of the canonical key, "х 20", "X20" and "x20" are the same
+_KEY_X_PATTERN = re.compile(r"(?:^|(?<=\s)|(?<=\d))[xх]\s*(?=\d)")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class NormalizedName:
+    def __init__(self, original_product_name: str, product_name_variations: List[str], canonical_key: str):
+        self.original_product_name = original_product_name
+        # Search variations in the order they are tried
+        self.product_name_variations = product_name_variations
+        # Equal for names that only differ in case, spacing, punctuation or keyboard layout
+        self.canonical_key = canonical_key
+
+    def __str__(self) -> str:
+        return str(self.__dict__)
+
+
+def _unify_token_script(token: str) -> str:
+    """
+    Writes the look-alike letters of the token in the script of its other letters.
+    Tokens without unambiguous letters (e.g. "x10") are left as they are
+    """
+    cyrillic_count = 0
+    latin_count = 0
+    for letter in _LETTER_PATTERN.findall(token):
+        if letter in LATIN_TO_CYRILLIC or letter in CYRILLIC_TO_LATIN:
+            continue
+        if _CYRILLIC_LETTER_PATTERN.match(letter):
+            cyrillic_count += 1
+        else:
+            latin_count += 1
+    if cyrillic_count > latin_count:
+        return token.translate(_TO_CYRILLIC_TABLE)
+    if latin_count > cyrillic_count:
+        return token.translate(_TO_LATIN_TABLE)
+    return token
+
+
+def unify_scripts(product_name: str) -> str:
+    return _TOKEN_PATTERN.sub(lambda match: _unify_token_script(match.group(0)), product_name)
+
+
+@lru_cache(maxsize=NORMALIZER_CACHE_SIZE)
+def _normalize(product_name: str) -> Tuple[Tuple[str, ...], str]:
+    unified = unify_scripts(product_name.strip())
+
+    x_with_spaces = _TABLET_PATTERN.sub("", unified.translate(_SEARCH_CLEANUP_TABLE))
+    x_without_spaces = _X_SPACE_PATTERN.sub(r"\1", x_with_spaces)
+    without_x = _X_PATTERN.sub("", x_without_spaces)
+    # dict keeps the first occurrence of every variation in its order
+    variations = tuple(dict.fromkeys((x_without_spaces, x_with_spaces, without_x)))
+
+    key = _TABLET_PATTERN.sub("", unified.lower().translate(_KEY_CLEANUP_TABLE))
+    key = _KEY_X_PATTERN.sub("x", key)
+    key = _WHITESPACE_PATTERN.sub(" ", key).strip()
+    return variations, key
+
+
+def normalize(product_name: str) -> NormalizedName:
+    variations, key = _normalize(product_name)
+    return NormalizedName(product_name, list(variations), key)
+
+
+def normalize_batch(product_names: Iterable[str]) -> List[NormalizedName]:
+    """
+    Normalizes the product names of a whole file. Every distinct name is normalized once
+    """
+    product_names = list(product_names)
+    normalized: Dict[str, Tuple[Tuple[str, ...], str]] = {
+        product_name: _normalize(product_name) for product_name in dict.fromkeys(product_names)
+    }
+    return [
+        NormalizedName(product_name, list(normalized[product_name][0]), normalized[product_name][1])
+        for product_name in product_names
+    ]
+
+
+def canonical_key(product_name: str) -> str:
+    """
+    The key under which a product is deduplicated in the input and cached between tasks
+    """
+    return _normalize(product_name)[1]
+
+
+def get_cache_info():
+    return _normalize.cache_info()
@@ -0,0 +1,107 @@
+import logging
+import math
+import tempfile
+from typing import Dict, List, Tuple
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+from files.azure_blob_client import AzureBlobClient
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+REPORT_SHEET_TITLE = "Report"
+UNBOUGHT_SHEET_TITLE = "Некупени продукти"
+PRODUCT_COLUMN_WIDTH = 40
+PRICE_COLUMN_WIDTH = 20
+
+
+class ReportExporter:
+    """
+    Writes the Excel report of a task row by row, while the products are decided.
+    The workbook is in write-only mode, so the written rows are kept in temporary files and not in memory
+    """
+
+    def __init__(self, distributors: List[str]):
+        self.distributors = distributors
+        self.bold_font = Font(bold=True)
+        self.bought_count = 0
+        self.unbought_count = 0
+        # Saving a write-only workbook is possible only once
+        self.saved = False
+
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.report_sheet = self.workbook.create_sheet(REPORT_SHEET_TITLE)
+        self.unbought_sheet = self.workbook.create_sheet(UNBOUGHT_SHEET_TITLE)
+
+        # A write-only sheet takes its column widths before the first row only
+        widths = [PRODUCT_COLUMN_WIDTH]
+        for _ in self.distributors:
+            widths += [PRODUCT_COLUMN_WIDTH, PRICE_COLUMN_WIDTH]
+        widths.append(PRODUCT_COLUMN_WIDTH)
+        for column, width in enumerate(widths, start=1):
+            self.report_sheet.column_dimensions[get_column_letter(column)].width = width
+        self.unbought_sheet.column_dimensions[get_column_letter(1)].width = PRODUCT_COLUMN_WIDTH
+        self.unbought_sheet.column_dimensions[get_column_letter(2)].width = PRICE_COLUMN_WIDTH
+
+        header = ["Продукт"]
+        for distributor in self.distributors:
+            header += [f"{distributor} - име на продукт", f"{distributor} - цена"]
+        header.append("Добавен в количката на")
+        self.report_sheet.append(self._bold_cells(self.report_sheet, header))
+        self.unbought_sheet.append(self._bold_cells(self.unbought_sheet, ["Продукт", "Брой"]))
+
+    def _bold_cells(self, sheet, values: list) -> List[WriteOnlyCell]:
+        cells = []
+        for value in values:
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.font = self.bold_font
+            cells.append(cell)
+        return cells
+
+    def add_bought_product(self, original_product_name: str, offers: Dict[str, Tuple[str, float]],
+                           bought_from_distributor: str):
+        """
+        :param offers: The found product name and price per distributor name. Distributors without an offer are left empty
+        """
+        row = [original_product_name]
+        for distributor in self.distributors:
+            name, price = offers.get(distributor, (None, None))
+            values = [name, -1 if price == math.inf else price]
+            if distributor == bought_from_distributor:
+                row += self._bold_cells(self.report_sheet, values)
+            else:
+                row += values
+        row.append(bought_from_distributor)
+        self.report_sheet.append(row)
+        self.bought_count += 1
+
+    def add_unbought_product(self, product_name: str, quantity: int):
+        self.unbought_sheet.append([product_name, quantity])
+        self.unbought_count += 1
+
+    def upload(self, blob_name: str) -> str:
+        """
+        Saves the workbook to a temporary file and uploads it to the output container in blocks.
+        Returns the URL of the uploaded report
+        """
+        logger.info(f"ReportExporter: Uploading report {blob_name} with {self.bought_count} bought "
+                    f"and {self.unbought_count} unbought products")
+        with tempfile.TemporaryFile() as report_file:
+            self.saved = True
+            self.workbook.save(report_file)
+            report_file.seek(0)
+            return AzureBlobClient().upload_stream_to_output_container(blob_name, report_file)
+
+    def close(self):
+        """
+        Releases the temporary files of the sheets, when the report wasn't uploaded
+        """
+        if self.saved:
+            return
+        self.saved = True
+        with tempfile.TemporaryFile() as discarded_file:
+            self.workbook.save(discarded_file)
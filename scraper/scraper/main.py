@@ -3,16 +3,34 @@ setup_logging()  # noqa
 
 import logging
 from task_handler.task_handler import TaskHandler
-from messaging.messaging import ScraperTaskItem
-from configuration.common import AzureConfig
-from azure.servicebus import ServiceBusClient, ServiceBusReceivedMessage, AutoLockRenewer
-from typing import List
+from dal.price_cache import PriceCache
+from dal.task_checkpoints import TaskCheckpointStore
+from dal.task_shards import TaskShardStore
+from task_handler.task_update_publisher import TaskUpdatePublisher
+from task_handler.account_locks import AccountLocks
+from task_handler.task_scheduler import ScheduledTask, TaskScheduler
+from task_handler.task_shards import cancel_own_shard, is_own_shard
+from messaging.messaging import DistributorTypes, ScraperTaskActionType, ScraperTaskItem
+from configuration.common import AzureConfig, ScraperConfig
+from pharmacy_distributors.common.driver_pool import WebDriverPool
+from azure.servicebus import ServiceBusClient, ServiceBusReceivedMessage, ServiceBusReceiver, AutoLockRenewer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Set, Tuple
+import queue
 import threading
 import signal
 import json
 
 shutdown_event = threading.Event()
 
+# How long the receiver waits for a task to finish when it can't take more messages
+SETTLE_WAIT_SECONDS = 1.0
+
+# Lock tokens of the received messages whose lock couldn't be renewed
+lost_lock_tokens: Set[str] = set()
+lost_lock_tokens_lock = threading.Lock()
+
 
 # Create a logger for this module
 logger = logging.getLogger(__name__)
@@ -23,34 +41,209 @@ def handle_sigterm(signum, frame):
     shutdown_event.set()
 
 
-def work_loop():
+def on_lock_renew_failure(renewable, error):
+    lock_token = getattr(renewable, "lock_token", None)
+    logger.error(f"Couldn't renew the lock of message {lock_token}: {error}")
+    if lock_token is not None:
+        with lost_lock_tokens_lock:
+            lost_lock_tokens.add(str(lock_token))
+
+
+def is_lock_lost(message: ServiceBusReceivedMessage) -> bool:
+    """
+    The message is delivered again to another receiver once its lock is lost, so its task mustn't start here
+    """
+    with lost_lock_tokens_lock:
+        if str(message.lock_token) in lost_lock_tokens:
+            return True
+    locked_until = message.locked_until_utc
+    return locked_until is not None and locked_until <= datetime.now(timezone.utc)
+
+
+def forget_lock(message: ServiceBusReceivedMessage):
+    with lost_lock_tokens_lock:
+        lost_lock_tokens.discard(str(message.lock_token))
+
+
+def work_loop(task_update_publisher: TaskUpdatePublisher, task_slots: int):
     while not shutdown_event.is_set():
         try:
-            process_service_bus_messages()
+            process_service_bus_messages(task_update_publisher, task_slots)
         except Exception as e:
             logger.exception(f"Error in main loop: {e}")
 
     logger.info("No longer receiving messages, exiting thread...")
 
 
-def process_service_bus_messages():
-    with ServiceBusClient.from_connection_string(AzureConfig.ServiceBusTasks.CONNECTION_STRING) as client:
-        with client.get_queue_receiver(queue_name=AzureConfig.ServiceBusTasks.QUEUE_NAME, auto_lock_renewer=AutoLockRenewer(max_lock_renewal_duration=3000)) as receiver:
-            while not shutdown_event.is_set():
-                messages: List[ServiceBusReceivedMessage] = receiver.receive_messages(max_message_count=1, max_wait_time=5)
-                for message in messages:
-                    # Decode message body from bytes to string
-                    message_body_bytes = b''.join(message.body)
-                    message_body_str = message_body_bytes.decode('utf-8')
-                    logger.info("Received message as string: " + message_body_str)
-                    message_body_json = json.loads(message_body_str)
-                    logger.info(f"Received message as JSON: {message_body_json}")
+def get_task_slots() -> int:
+    """
+    A task leases its browsers one at a time, so the slots are limited to the tasks that can all get a browser
+    for every distributor. Otherwise tasks holding a part of their browsers could wait for each other forever
+    """
+    task_slots = max(1, ScraperConfig.Worker.TASK_SLOTS)
+    max_task_slots = max(1, ScraperConfig.DriverPool.SIZE // len(DistributorTypes))
+    if task_slots > max_task_slots:
+        logger.warning(f"SCRAPER_WORKER_TASK_SLOTS={task_slots} needs {task_slots * len(DistributorTypes)} browsers, "
+                       f"but SCRAPER_DRIVER_POOL_SIZE={ScraperConfig.DriverPool.SIZE}. Running {max_task_slots} tasks at a time")
+        return max_task_slots
+    return task_slots
+
+
+def process_service_bus_messages(task_update_publisher: TaskUpdatePublisher, task_slots: int):
+    """
+    Runs up to `task_slots` tasks at a time. Up to SCRAPER_SCHEDULER_QUEUE_SIZE more messages are
+    received ahead, so the scheduler can pick the next task. The receiver isn't thread safe, so the tasks hand their
+    messages back through a queue and only this thread settles them
+    """
+    max_received = task_slots + max(0, ScraperConfig.Scheduler.QUEUE_SIZE)
+    scheduler = TaskScheduler(task_slots)
+    finished_tasks: queue.Queue[Tuple[ScheduledTask, bool]] = queue.Queue()
+    # Every message renews its lock on a thread of its own until it is settled, so there must be one per message
+    with AutoLockRenewer(max_lock_renewal_duration=ScraperConfig.Worker.MAX_LOCK_RENEWAL_SECONDS,
+                         on_lock_renew_failure=on_lock_renew_failure, max_workers=max_received) as lock_renewer:
+        with ServiceBusClient.from_connection_string(AzureConfig.ServiceBusTasks.CONNECTION_STRING) as client:
+            # No prefetch, a buffered message isn't registered with the lock renewer until it is received
+            with client.get_queue_receiver(queue_name=AzureConfig.ServiceBusTasks.QUEUE_NAME, auto_lock_renewer=lock_renewer) as receiver:
+                executor = ThreadPoolExecutor(max_workers=task_slots, thread_name_prefix="task-slot")
+                running_count = 0
+                try:
+                    # After the shutdown starts no new tasks are started, but the running ones are still settled
+                    while not shutdown_event.is_set() or running_count > 0:
+                        if shutdown_event.is_set():
+                            for scheduled_task in scheduler.take_all():
+                                settle_message(receiver, scheduled_task.message, False)
+                            running_count -= settle_finished_tasks(receiver, scheduler, finished_tasks, SETTLE_WAIT_SECONDS)
+                            continue
+
+                        running_count -= settle_finished_tasks(receiver, scheduler, finished_tasks, 0)
+                        running_count += start_scheduled_tasks(
+                            scheduler, executor, task_slots - running_count, finished_tasks, task_update_publisher)
+                        if running_count + len(scheduler) >= max_received:
+                            running_count -= settle_finished_tasks(receiver, scheduler, finished_tasks, SETTLE_WAIT_SECONDS)
+                            continue
+
+                        # Don't keep queued tasks waiting for new messages when a slot is free for them
+                        max_wait_time = 1 if len(scheduler) > 0 else 5
+                        messages: List[ServiceBusReceivedMessage] = receiver.receive_messages(
+                            max_message_count=max_received - running_count - len(scheduler), max_wait_time=max_wait_time)
+                        for message in messages:
+                            scheduled_task = parse_message(message)
+                            if scheduled_task is None:
+                                settle_message(receiver, message, False)
+                            elif is_own_shard(scheduled_task.task_item):
+                                cancel_own_shard(scheduled_task.task_item)
+                                settle_message(receiver, message, True)
+                            else:
+                                scheduler.add(scheduled_task)
+                finally:
+                    # The messages of the running tasks are settled before the receiver is closed
+                    executor.shutdown(wait=True)
+                    settle_finished_tasks(receiver, scheduler, finished_tasks, 0)
+                    for scheduled_task in scheduler.take_all():
+                        settle_message(receiver, scheduled_task.message, False)
+
+
+def parse_message(message: ServiceBusReceivedMessage) -> ScheduledTask | None:
+    try:
+        # Decode message body from bytes to string
+        message_body_bytes = b''.join(message.body)
+        message_body_str = message_body_bytes.decode('utf-8')
+        logger.info("Received message as string: " + message_body_str)
+        message_body_json = json.loads(message_body_str)
+        logger.info(f"Received message as JSON: {message_body_json}")
+        return ScheduledTask(message, ScraperTaskItem.from_dict(message_body_json))
+    except Exception as e:
+        logger.exception(f"Couldn't parse the message: {e}")
+        return None
 
-                    logger.info("processing message...")
-                    TaskHandler(ScraperTaskItem.from_dict(message_body_json)).handle_task()
-                    logger.info("message processed.")
 
-                    receiver.complete_message(message)
+def start_scheduled_tasks(scheduler: TaskScheduler, executor: ThreadPoolExecutor, free_slots: int,
+                          finished_tasks: queue.Queue, task_update_publisher: TaskUpdatePublisher) -> int:
+    started_count = 0
+    while started_count < free_slots:
+        scheduled_task = scheduler.take()
+        if scheduled_task is None:
+            break
+        if is_lock_lost(scheduled_task.message):
+            # Settling it would fail anyway, another receiver already has it or gets it soon
+            logger.warning(f"The lock of {scheduled_task} was lost while it waited, dropping it")
+            scheduler.done(scheduled_task)
+            forget_lock(scheduled_task.message)
+            continue
+        executor.submit(run_task, scheduled_task, finished_tasks, task_update_publisher)
+        started_count += 1
+    return started_count
+
+
+def settle_message(receiver: ServiceBusReceiver, message: ServiceBusReceivedMessage, finished: bool):
+    """
+    Completes the message of a finished task and abandons the others
+    """
+    forget_lock(message)
+    try:
+        if finished:
+            receiver.complete_message(message)
+            logger.info("message processed.")
+        else:
+            # Delivered again right away, the next delivery resumes from the checkpoints
+            receiver.abandon_message(message)
+            logger.info("message interrupted, abandoning it.")
+    except Exception as e:
+        logger.exception(f"Couldn't settle the message: {e}")
+
+
+def settle_finished_tasks(receiver: ServiceBusReceiver, scheduler: TaskScheduler, finished_tasks: queue.Queue,
+                          wait_seconds: float) -> int:
+    """
+    Settles the messages of the tasks that are done. Returns their number
+    """
+    settled_count = 0
+    try:
+        scheduled_task, finished = finished_tasks.get(timeout=wait_seconds) if wait_seconds > 0 else finished_tasks.get_nowait()
+        while True:
+            scheduler.done(scheduled_task)
+            settle_message(receiver, scheduled_task.message, finished)
+            settled_count += 1
+            scheduled_task, finished = finished_tasks.get_nowait()
+    except queue.Empty:
+        pass
+    return settled_count
+
+
+def run_task(scheduled_task: ScheduledTask, finished_tasks: queue.Queue, task_update_publisher: TaskUpdatePublisher):
+    finished = False
+    try:
+        task_item = scheduled_task.task_item
+        # Price shards don't touch the carts, the task that sent them may hold the locks while it waits for them
+        distributors = [distributor.value for distributor in task_item.distributors] \
+            if task_item.task_type != ScraperTaskActionType.PRICE_SHARD else []
+        # Another task of the same pharmacy may be filling the same carts
+        if not AccountLocks().acquire(task_item.pharmacy_id, distributors, shutdown_event):
+            return
+        try:
+            logger.info("processing message...")
+            finished = TaskHandler(task_item, shutdown_event, scheduled_task.message.delivery_count or 1,
+                                   task_update_publisher).handle_task()
+        finally:
+            AccountLocks().release(task_item.pharmacy_id, distributors)
+    except Exception as e:
+        logger.exception(f"Couldn't process the message: {e}")
+    finally:
+        finished_tasks.put((scheduled_task, finished))
+
+
+def ensure_database_indexes():
+    """
+    The indexes are created once at startup, not on the write path of the tasks.
+    A worker whose indexes couldn't be created still runs, the collections then only miss the expiry
+    """
+    for collection_name, ensure_indexes in [("task_checkpoints", TaskCheckpointStore.ensure_indexes),
+                                            ("price_cache", PriceCache.ensure_indexes),
+                                            ("task_shards", TaskShardStore.ensure_indexes)]:
+        try:
+            ensure_indexes()
+        except Exception as e:
+            logger.error(f"Couldn't create the indexes of {collection_name}: {e}")
 
 
 def main():
@@ -59,12 +252,25 @@ def main():
     # Setup the signal handler for graceful shutdown
     signal.signal(signal.SIGTERM, handle_sigterm)
 
+    ensure_database_indexes()
+
+    # Launch the browsers before the first task arrives
+    try:
+        WebDriverPool().prewarm()
+    except Exception as e:
+        logger.exception(f"Couldn't prewarm the browsers: {e}")
+
+    # One connection for the task updates of all tasks
+    task_update_publisher = TaskUpdatePublisher()
+
     # Start the message processing thread
-    thread = threading.Thread(target=work_loop)
+    thread = threading.Thread(target=work_loop, args=(task_update_publisher, get_task_slots()))
     thread.start()
 
     # Wait for the thread to complete
     thread.join()
+    task_update_publisher.close()
+    WebDriverPool().shutdown()
     logger.info("Application is shutting down.")
 
 
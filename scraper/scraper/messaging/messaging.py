@@ -12,6 +12,7 @@ class FileType(str, Enum):
 class ScraperTaskActionType(str, Enum):
     RESUME = "resume"
     START_OVER = "start_over"
+    PRICE_SHARD = "price_shard"
 
 
 class DistributorTypes(str, Enum):
@@ -83,7 +84,9 @@ class ScraperTaskItem:
                  date_created: str,
                  date_updated: str,
                  report: dict | None,
-                 image_urls: list[str] | None = None):
+                 image_urls: list[str] | None = None,
+                 row_count: int | None = None,
+                 shard: dict | None = None):
         """
         :param account_id: The account ID of the user who requested the task
         :param file_name: The name of the file - this is used for logging purposes
@@ -93,7 +96,10 @@ class ScraperTaskItem:
         :param file_type: The type of the file - json_content or blob_storage_url
         :param pharmacy_id: The ID of the pharmacy to order items for
         :param distributors: The list of distributors to scrape
-        :param task_type: The type of the task - "resume" or "start_over"
+        :param task_type: The type of the task - "resume", "start_over" or "price_shard"
+        :param row_count: The number of rows of the input file, if it was counted when the task was created
+        :param shard: For "price_shard" tasks, the rows to price: {"index": 1, "first_row": 250, "row_count": 250, "sender_id": "..."}.
+            The task ID is the one of the task the shard belongs to, the sender ID tells the worker that sent the shard
 
         Example message:
         {
@@ -120,6 +126,8 @@ class ScraperTaskItem:
         self.date_updated = date_updated
         self.report = report
         self.image_urls = image_urls
+        self.row_count = row_count
+        self.shard = shard
 
         self._validate()
 
@@ -153,6 +161,12 @@ class ScraperTaskItem:
         if not isinstance(self.task_type, ScraperTaskActionType):
             raise ValueError("Task type must be a ScraperTaskActionType")
 
+        if self.row_count is not None and (not isinstance(self.row_count, int) or self.row_count < 0):
+            raise ValueError("Row count must be a non-negative integer")
+
+        if self.task_type == ScraperTaskActionType.PRICE_SHARD and not isinstance(self.shard, dict):
+            raise ValueError("A price shard task must have a shard")
+
     # JSON representation of the object
     def to_json(self):
         result = {
@@ -167,7 +181,9 @@ class ScraperTaskItem:
             "date_updated": self.date_updated,
             "status": self.status.to_json(),
             "report": self.report,
-            "image_urls": self.image_urls
+            "image_urls": self.image_urls,
+            "row_count": self.row_count,
+            "shard": self.shard
         }
         if self.id:
             result["_id"] = str(self.id)
@@ -186,7 +202,9 @@ class ScraperTaskItem:
             "date_updated": self.date_updated,
             "status": self.status,
             "report": self.report,
-            "image_urls": self.image_urls
+            "image_urls": self.image_urls,
+            "row_count": self.row_count,
+            "shard": self.shard
         }
         return result
 
@@ -203,7 +221,9 @@ class ScraperTaskItem:
             date_created=data["date_created"],
             date_updated=data["date_updated"],
             report=data["report"],
-            image_urls=data.get("image_urls")
+            image_urls=data.get("image_urls"),
+            row_count=data.get("row_count"),
+            shard=data.get("shard")
         )
         cls_instance.id = data.get("_id") or data.get("id") or ""
         cls_instance.status = ScraperTaskItemStatus(
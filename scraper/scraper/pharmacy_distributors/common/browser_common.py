@@ -1,33 +1,81 @@
 import os
+import sys
+import time
 from datetime import datetime
-from typing import List, Tuple, Deque
+from typing import List, Sequence, Tuple
 import logging
-from collections import deque
+import threading
 
-from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.webdriver import WebDriver
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 
-from pharmacy_distributors.common.utils import check_webdriver_is_present, get_browser_options
+from configuration.common import ScraperConfig
+
+from pharmacy_distributors.common.driver_pool import WebDriverPool
+from pharmacy_distributors.common.lean_profile import PageLoadStats, apply_lean_profile
+from pharmacy_distributors.common.screenshots import ScreenshotRecorder
+from pharmacy_distributors.common.session_store import SessionStore
+from pharmacy_distributors.common.waits import LatencyTracker, PageActivity, read_activity
 
 # Create a logger for this module
 logger = logging.getLogger(__name__)
 
+FINISH_LOCK_TIMEOUT_SECONDS = 30
+
+
+class PriceLookupError(Exception):
+    """
+    The search couldn't tell whether the distributor sells the product, e.g. it timed out or the session expired.
+    Unlike a search without a matching product, the result isn't cached
+    """
+    pass
+
 
 class BrowserCommon():
+    # True when get_product_name_and_price doesn't touch the browser state that add_product_to_cart relies on,
+    # so lookups can run ahead of and concurrently with cart updates
+    stateless_price_lookup = False
+    # Resource types of the lean profile (see lean_profile.RESOURCE_TYPE_URL_PATTERNS) the portal works without
+    LEAN_PROFILE_BLOCKED_RESOURCE_TYPES: Sequence[str] = ()
+    # Sample URLs of resources the portal needs, no blocked pattern may match them
+    LEAN_PROFILE_ALLOWED_URLS: Sequence[str] = ()
+
     def __init__(self, name: str, priority: int, shouldInitBrowser=True):
         self.browser: WebDriver = None
-        if shouldInitBrowser:
-            self.initBrowser()
         self.name = name
         self.priority = priority
-        self.temporary_screenshotts: Deque[bytes] = deque(maxlen=3)
+        self.screenshot_recorder = ScreenshotRecorder()
+        self.page_load_stats = PageLoadStats()
+        # Serializes everything that drives this scraper's browser (searches, cart updates),
+        # since price lookups for several scrapers may run on worker threads
+        self.lock = threading.RLock()
+        # Set for resumed tasks, whose cart already holds the products of the rows processed before
+        self.keep_cart = False
+        # Leased last, so finish() can give it back if a subclass fails to initialize
+        if shouldInitBrowser:
+            self.initBrowser()
 
     def initBrowser(self):
         # Raises WebDriverException if the driver is not available
-        check_webdriver_is_present()
+        self.browser = WebDriverPool().lease()
+        if ScraperConfig.LeanProfile.ENABLED:
+            try:
+                apply_lean_profile(self.browser, self.LEAN_PROFILE_BLOCKED_RESOURCE_TYPES, self.LEAN_PROFILE_ALLOWED_URLS)
+            except Exception as e:
+                logger.warning(f"BrowserCommon: Couldn't apply the lean profile: {e}")
 
-        self.browser = webdriver.Chrome(get_browser_options())
+    def record_page_load(self, page: str):
+        """
+        Call once the page finished loading
+        """
+        self.page_load_stats.record(self.browser, page)
+
+    def get_page_load_stats(self) -> dict:
+        return self.page_load_stats.to_json()
 
     def hasInternetConnection(self):
         try:
@@ -51,26 +99,176 @@ class BrowserCommon():
         logger.info("BrowserCommon: Returning Screenshot: %s", screenShotName)
         return self.browser.get_screenshot_as_png(), screenShotName
 
-    def store_temporary_screenshot(self):
+    def store_temporary_screenshot(self, step: str | None = None):
         """
-        Stores the 3 most recent screenshots in the temporary_screenshotts deque
+        Keeps a screenshot of the current step for the failure report, if the screenshot policy asks for one.
+        The step defaults to the name of the calling method
         """
-        screenshot = self.browser.get_screenshot_as_png()
-        self.temporary_screenshotts.appendleft(screenshot)
+        if step is None:
+            step = sys._getframe(1).f_code.co_name
+        self.screenshot_recorder.capture_step(self.browser, step)
 
     def get_temporary_screenshots(self) -> List[Tuple[bytes, str]]:
         screenshots_with_names = []
-        for screenshot in self.temporary_screenshotts:
-            dt_string = datetime.now().strftime("%Y.%m.%d_%H.%M.%S")
-            screenShotName = dt_string + "_" + self.__class__.__name__ + "_TemporaryScreenshot.png"
-            screenshots_with_names.append((screenshot, screenShotName))
+        dt_string = datetime.now().strftime("%Y.%m.%d_%H.%M.%S")
+        for index, screenshot in enumerate(self.screenshot_recorder.get_screenshots()):
+            screenShotName = dt_string + "_" + self.__class__.__name__ + "_TemporaryScreenshot_" + str(index) \
+                + "_" + screenshot.step + "." + screenshot.extension
+            screenshots_with_names.append((screenshot.data, screenShotName))
         return screenshots_with_names
 
+    def get_screenshot_stats(self) -> dict:
+        return self.screenshot_recorder.to_json()
+
+    def wait_until(self, operation: str, condition, default_timeout: float, adaptive: bool = False):
+        """
+        WebDriverWait that records the latency of the operation on this distributor. Raises TimeoutException like WebDriverWait
+        :param adaptive: Shorten the timeout to the recent latency. Only for waits where a timeout costs nothing but time,
+        a wait whose timeout is taken as an answer (no result, no spellcheck, empty cart) keeps the full default
+        """
+        timeout = LatencyTracker().timeout(self.name, operation, default_timeout) if adaptive else default_timeout
+        started_at = time.monotonic()
+        try:
+            result = WebDriverWait(self.browser, timeout, poll_frequency=ScraperConfig.Waits.POLL_SECONDS).until(condition)
+        except TimeoutException:
+            # Counting the timeout as a sample lets a timeout that got too short grow back
+            LatencyTracker().record(self.name, operation, timeout)
+            raise
+        LatencyTracker().record(self.name, operation, time.monotonic() - started_at)
+        return result
+
+    def mark_activity(self) -> PageActivity | None:
+        """
+        Call right before the action whose requests wait_for_activity_to_settle should wait for
+        """
+        try:
+            return read_activity(self.browser)
+        except Exception:
+            return None
+
+    def wait_for_activity_to_settle(self, operation: str, mark: PageActivity | None, default_timeout: float) -> bool:
+        """
+        Waits until the requests started after the mark finished and the DOM went quiet.
+        Returns False if the page has no activity monitor or it didn't settle in time
+        """
+        if mark is None:
+            return False
+
+        def is_settled(driver):
+            activity = read_activity(driver)
+            # A page loaded without the monitor can't be observed, let the caller's element wait decide
+            return activity is None or activity.is_settled_since(mark, ScraperConfig.Waits.QUIET_PERIOD_MS)
+
+        try:
+            # The caller still waits for the element it needs, so a settle wait that got too short only costs a poll
+            self.wait_until(operation, is_settled, default_timeout, adaptive=True)
+            return True
+        except Exception:
+            logger.info(f"BrowserCommon: {self.name} page didn't settle after '{operation}'")
+            return False
+
+    def find_optional_element(self, by: str, value: str) -> WebElement | None:
+        elements = self.browser.find_elements(by, value)
+        return elements[0] if len(elements) > 0 else None
+
+    def wait_for_replacement(self, operation: str, element: WebElement | None, default_timeout: float, alternative_locator=None) -> bool:
+        """
+        Waits until an element of the previous result is detached from the page, i.e. the result was rendered again,
+        or until an element matching `alternative_locator` is shown. True right away if there was no previous result
+        """
+        if element is None:
+            return True
+
+        is_replaced = EC.staleness_of(element)
+        is_alternative_shown = EC.visibility_of_any_elements_located(alternative_locator) if alternative_locator else None
+
+        def condition(driver):
+            if is_replaced(driver):
+                return True
+            return is_alternative_shown is not None and len(is_alternative_shown(driver)) > 0
+
+        try:
+            self.wait_until(operation, condition, default_timeout)
+            return True
+        except TimeoutException:
+            logger.info(f"BrowserCommon: {self.name} result wasn't replaced after '{operation}'")
+            return False
+
+    def get_wait_stats(self) -> dict:
+        return LatencyTracker().to_json(self.name)
+
     def setBrowserToDefaultPosition(self):
         self.browser.set_window_position(0, 0)
 
     def finish(self):
-        self.browser.quit()
+        """
+        Gives the browser back to the pool. If a search still holds it (e.g. one that timed out), the browser is quit instead
+        """
+        if self.browser is None:
+            return
+        if self.lock.acquire(timeout=FINISH_LOCK_TIMEOUT_SECONDS):
+            try:
+                WebDriverPool().release(self.browser)
+            finally:
+                self.lock.release()
+        else:
+            WebDriverPool().discard(self.browser)
+        self.browser = None
+
+    def open_session(self, pharmacy_id: str, keep_cart: bool = False):
+        """
+        Restores the session saved by a previous task for the same pharmacy, or logs in and prepares the order
+        :param keep_cart: Continue the order of the previous run of the task instead of starting an empty one
+        """
+        self.keep_cart = keep_cart
+        if self._restore_session(pharmacy_id):
+            return
+
+        self.login()
+        self.prepare_for_order()
+        SessionStore().save(self.name, pharmacy_id, self.browser.get_cookies(), self.browser.current_url)
+
+    def _restore_session(self, pharmacy_id: str) -> bool:
+        stored_session = SessionStore().load(self.name, pharmacy_id)
+        if stored_session is None:
+            return False
+
+        logger.info(f"BrowserCommon: Restoring the {self.name} session of pharmacy {pharmacy_id}")
+        try:
+            # Cookies can only be added for the domain of the current page
+            self.browser.get(self.get_session_restore_page())
+            for cookie in stored_session.cookies:
+                self.browser.add_cookie(cookie)
+            self.browser.get(stored_session.prepared_url)
+            if self.is_session_valid():
+                self.on_session_restored()
+                logger.info(f"BrowserCommon: Restored the {self.name} session of pharmacy {pharmacy_id}")
+                return True
+            logger.info(f"BrowserCommon: The stored {self.name} session is no longer valid, logging in")
+        except Exception as e:
+            logger.warning(f"BrowserCommon: Couldn't restore the {self.name} session, logging in: {e}")
+
+        SessionStore().invalidate(self.name, pharmacy_id)
+        self.browser.delete_all_cookies()
+        return False
+
+    def get_session_restore_page(self) -> str:
+        """
+        A cheap page on the distributor's domain
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def is_session_valid(self) -> bool:
+        """
+        Checks that the restored page is usable without logging in again
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def on_session_restored(self):
+        """
+        Puts the restored session in the same state prepare_for_order leaves a new one in
+        """
+        pass
 
     def login(self):
         raise NotImplementedError("Subclasses must implement this method")
@@ -84,9 +282,29 @@ class BrowserCommon():
     def get_product_name_and_price(self, product_id) -> Tuple[str, float]:
         raise NotImplementedError("Subclasses must implement this method")
 
+    def get_prices_for_many(self, productSearchNamesList: List[list]) -> List[Tuple[str, float] | None]:
+        """
+        Looks up the name and price for every list of search names. The results are in the input order,
+        None for a product whose lookup failed
+        """
+        result: List[Tuple[str, float] | None] = []
+        for productSearchNames in productSearchNamesList:
+            try:
+                result.append(self.get_product_name_and_price(productSearchNames))
+            except PriceLookupError as e:
+                logger.error(f"BrowserCommon: Couldn't get the price from {self.name} for {productSearchNames}: {e}")
+                result.append(None)
+        return result
+
     def add_product_to_cart(self, product_id: str, quantity: int):
         raise NotImplementedError("Subclasses must implement this method")
 
+    def get_http_stats(self) -> dict | None:
+        """
+        Traffic of the scraper's own HTTP session, if it has one
+        """
+        return None
+
     def get_name(self) -> str:
         return self.name
 
@@ -0,0 +1,131 @@
+import logging
+import re
+from typing import Any, List, Sequence, Set, Tuple
+
+from configuration.common import ScraperConfig
+from files.product_name_normalizer import canonical_key
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Weights of the score parts, they add up to 1
+QUERY_COVERAGE_WEIGHT = 0.5
+CANDIDATE_COVERAGE_WEIGHT = 0.1
+DOSAGE_WEIGHT = 0.25
+PACK_SIZE_WEIGHT = 0.15
+# Score of a dosage or pack size which is missing from one side only
+UNKNOWN_PART_SCORE = 0.5
+# Distributors abbreviate the words of the names ("ТАБЛ", "ФИЛМ"), so a prefix of this length is a match
+MIN_PREFIX_LENGTH = 3
+
+_DOSAGE_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*(mcg|мкг|µg|mg|мг|gr|гр|g|г|ml|мл|iu|ме|%)(?![^\W\d_])")
+# The canonical key writes the pack size multiplier as "x20"
+_PACK_SIZE_PATTERN = re.compile(r"(?:^|(?<=\s)|(?<=\d))x(\d+)(?!\d)")
+_PACK_COUNT_PATTERN = re.compile(r"(\d+)\s*(?:бр|броя|pcs)(?![^\W\d_])")
+_TOKEN_PATTERN = re.compile(r"[^\W\d_]+")
+
+# Dosages are compared in the smallest unit of their kind
+_DOSAGE_UNITS = {
+    "mcg": ("mcg", 1), "мкг": ("mcg", 1), "µg": ("mcg", 1),
+    "mg": ("mcg", 1000), "мг": ("mcg", 1000),
+    "gr": ("mcg", 1000000), "гр": ("mcg", 1000000), "g": ("mcg", 1000000), "г": ("mcg", 1000000),
+    "ml": ("ml", 1), "мл": ("ml", 1),
+    "iu": ("iu", 1), "ме": ("iu", 1),
+    "%": ("%", 1),
+}
+
+
+class Candidate:
+    """
+    A product returned by a distributor search. `source` is whatever the distributor needs to act on it,
+    e.g. the result row
+    """
+
+    def __init__(self, name: str, price: float, source: Any):
+        self.name = name
+        self.price = price
+        self.source = source
+
+
+class ParsedName:
+    def __init__(self, name: str):
+        key = canonical_key(name)
+        self.dosages: Set[Tuple[str, float]] = set()
+        for amount, unit in _DOSAGE_PATTERN.findall(key):
+            kind, factor = _DOSAGE_UNITS[unit]
+            self.dosages.add((kind, round(float(amount.replace(",", ".")) * factor, 3)))
+        pack_sizes = _PACK_SIZE_PATTERN.findall(key) + _PACK_COUNT_PATTERN.findall(key)
+        self.pack_sizes: Set[int] = {int(pack_size) for pack_size in pack_sizes}
+        # Only the words, the numbers are compared as dosages and pack sizes
+        tokens = _TOKEN_PATTERN.findall(_DOSAGE_PATTERN.sub(" ", key))
+        self.tokens: List[str] = [token for token in tokens if token != "x"]
+
+
+def _tokens_match(first: str, second: str) -> bool:
+    if first == second:
+        return True
+    shorter, longer = (first, second) if len(first) <= len(second) else (second, first)
+    return len(shorter) >= MIN_PREFIX_LENGTH and longer.startswith(shorter)
+
+
+def _coverage(tokens: List[str], other_tokens: List[str]) -> float:
+    if len(tokens) == 0:
+        return 1.0
+    matched = sum(1 for token in tokens if any(_tokens_match(token, other) for other in other_tokens))
+    return matched / len(tokens)
+
+
+def _part_score(query_values: set, candidate_values: set) -> float:
+    if len(query_values) == 0 and len(candidate_values) == 0:
+        return 1.0
+    if len(query_values) == 0 or len(candidate_values) == 0:
+        return UNKNOWN_PART_SCORE
+    return 1.0 if query_values <= candidate_values or candidate_values <= query_values else 0.0
+
+
+def score_candidate(query: str, candidate_name: str) -> float:
+    """
+    Between 0 and 1. The words of the query must be in the name, and the dosage and pack size mustn't contradict it
+    """
+    parsed_query = ParsedName(query)
+    parsed_candidate = ParsedName(candidate_name)
+    return QUERY_COVERAGE_WEIGHT * _coverage(parsed_query.tokens, parsed_candidate.tokens) \
+        + CANDIDATE_COVERAGE_WEIGHT * _coverage(parsed_candidate.tokens, parsed_query.tokens) \
+        + DOSAGE_WEIGHT * _part_score(parsed_query.dosages, parsed_candidate.dosages) \
+        + PACK_SIZE_WEIGHT * _part_score(parsed_query.pack_sizes, parsed_candidate.pack_sizes)
+
+
+def select_candidate(query: str, candidates: Sequence[Candidate], number_of_results: int | None = None,
+                     require_score: bool = False) -> Candidate | None:
+    """
+    Picks the candidate which matches the query best. A candidate with exactly the searched name wins outright.
+    None if no candidate reaches the minimum score, or if the best two are too close to tell apart
+    :param number_of_results: The results of the search if some of them couldn't be candidates. The only
+        result of a search is taken as it is, but the only candidate out of several results must score enough
+    :param require_score: Even a single candidate must score enough, for matches looser than the distributor's search
+    """
+    if len(candidates) == 0:
+        return None
+    if len(candidates) == 1 and not require_score and (number_of_results is None or number_of_results <= 1):
+        return candidates[0]
+
+    exact_matches = [candidate for candidate in candidates if candidate.name.strip() == query.strip()]
+    if len(exact_matches) > 0:
+        return exact_matches[0]
+    if not ScraperConfig.CandidateRanking.ENABLED:
+        logger.error("CandidateRanking: The search results can't be told apart, the ranking is disabled")
+        return None
+
+    scored = sorted(((score_candidate(query, candidate.name), candidate) for candidate in candidates),
+                    key=lambda scored_candidate: scored_candidate[0], reverse=True)
+    best_score, best_candidate = scored[0]
+    runner_up_score = scored[1][0] if len(scored) > 1 else 0.0
+    logger.info(f"CandidateRanking: Scores for '{query}': "
+                f"{[(candidate.name, round(score, 3)) for score, candidate in scored]}")
+    if best_score < ScraperConfig.CandidateRanking.MIN_SCORE:
+        logger.info(f"CandidateRanking: No candidate for '{query}' reached the minimum score")
+        return None
+    if best_score - runner_up_score < ScraperConfig.CandidateRanking.MIN_MARGIN:
+        logger.info(f"CandidateRanking: The best candidates for '{query}' are too close to tell apart")
+        return None
+    return best_candidate
@@ -0,0 +1,228 @@
+import logging
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, Set
+from urllib.parse import urlparse
+
+from selenium import webdriver
+from selenium.webdriver.chrome.webdriver import WebDriver
+
+from configuration.common import ScraperConfig
+from pharmacy_distributors.common.utils import get_browser_options
+from pharmacy_distributors.common.waits import install_activity_monitor
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+
+class PooledDriver:
+    def __init__(self, driver: WebDriver, index: int, cache_slot: int | None):
+        self.driver = driver
+        self.index = index
+        # Subdirectory of the disk cache, owned by this browser while it is alive
+        self.cache_slot = cache_slot
+        self.uses = 0
+
+
+class WebDriverPool:
+    """
+    Process-wide pool of warm Chrome instances, which are leased to the scrapers and reused across tasks.
+    At most `ScraperConfig.DriverPool.SIZE` browsers exist at a time.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(WebDriverPool, cls).__new__(cls)
+                    cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self.idle_drivers: Deque[PooledDriver] = deque()
+        self.leased_drivers: Dict[int, PooledDriver] = {}
+        self.number_of_drivers = 0
+        self.next_index = 0
+        self.cache_slots_in_use: Set[int] = set()
+        self.condition = threading.Condition()
+
+    def prewarm(self, count: int | None = None):
+        """
+        Launches browsers up front, so the tasks don't pay for the Chrome startup.
+        Raises WebDriverException if the driver is not available
+        """
+        if count is None:
+            count = ScraperConfig.DriverPool.PREWARM
+        count = min(count, ScraperConfig.DriverPool.SIZE)
+        logger.info(f"WebDriverPool: Prewarming {count} browsers")
+        while True:
+            with self.condition:
+                if self.number_of_drivers >= count:
+                    return
+                index = self._reserve_slot()
+            pooled_driver = self._create_driver(index)
+            with self.condition:
+                self.idle_drivers.append(pooled_driver)
+                self.condition.notify()
+
+    def lease(self) -> WebDriver:
+        pooled_driver: PooledDriver | None = None
+        index = 0
+        with self.condition:
+            while pooled_driver is None:
+                if len(self.idle_drivers) > 0:
+                    pooled_driver = self.idle_drivers.popleft()
+                elif self.number_of_drivers < ScraperConfig.DriverPool.SIZE:
+                    index = self._reserve_slot()
+                    break
+                elif not self.condition.wait(timeout=ScraperConfig.DriverPool.LEASE_TIMEOUT_SECONDS):
+                    raise Exception(f"WebDriverPool: No browser was released in {ScraperConfig.DriverPool.LEASE_TIMEOUT_SECONDS} seconds")
+
+        if pooled_driver is None:
+            pooled_driver = self._create_driver(index)
+        elif not self._is_healthy(pooled_driver):
+            logger.warning(f"WebDriverPool: Browser {pooled_driver.index} is not responding, replacing it")
+            self._quit(pooled_driver)
+            pooled_driver = self._create_driver(pooled_driver.index)
+
+        pooled_driver.uses += 1
+        with self.condition:
+            self.leased_drivers[id(pooled_driver.driver)] = pooled_driver
+        logger.info(f"WebDriverPool: Leased browser {pooled_driver.index} (use {pooled_driver.uses})")
+        return pooled_driver.driver
+
+    def release(self, driver: WebDriver):
+        """
+        Returns the browser to the pool. It is reset for the next task, or quit once it reached the max number of uses
+        """
+        with self.condition:
+            pooled_driver = self.leased_drivers.pop(id(driver), None)
+        if pooled_driver is None:
+            logger.warning("WebDriverPool: Releasing a browser which is not leased from the pool, quitting it")
+            self._quit_driver(driver)
+            return
+
+        if pooled_driver.uses >= ScraperConfig.DriverPool.MAX_USES:
+            logger.info(f"WebDriverPool: Recycling browser {pooled_driver.index} after {pooled_driver.uses} uses")
+            self._discard(pooled_driver)
+        elif not self._reset(pooled_driver):
+            self._discard(pooled_driver)
+        else:
+            with self.condition:
+                self.idle_drivers.append(pooled_driver)
+                self.condition.notify()
+
+    def discard(self, driver: WebDriver):
+        """
+        Quits a leased browser which may be in an unknown state, instead of returning it to the pool
+        """
+        with self.condition:
+            pooled_driver = self.leased_drivers.pop(id(driver), None)
+        if pooled_driver is None:
+            self._quit_driver(driver)
+        else:
+            self._discard(pooled_driver)
+
+    def shutdown(self):
+        with self.condition:
+            idle_drivers = list(self.idle_drivers)
+            self.idle_drivers.clear()
+        for pooled_driver in idle_drivers:
+            self._discard(pooled_driver)
+
+    def _reserve_slot(self) -> int:
+        # Must be called while holding the condition
+        self.number_of_drivers += 1
+        self.next_index += 1
+        return self.next_index
+
+    def _create_driver(self, index: int) -> PooledDriver:
+        cache_slot = self._reserve_cache_slot()
+        try:
+            logger.info(f"WebDriverPool: Launching browser {index}")
+            driver = webdriver.Chrome(get_browser_options(self._get_disk_cache_dir(cache_slot)))
+        except Exception:
+            with self.condition:
+                self.number_of_drivers -= 1
+                self.cache_slots_in_use.discard(cache_slot)
+                self.condition.notify()
+            raise
+
+        try:
+            install_activity_monitor(driver)
+        except Exception as e:
+            # The scrapers fall back to the element waits
+            logger.warning(f"WebDriverPool: Couldn't install the activity monitor in browser {index}: {e}")
+        return PooledDriver(driver, index, cache_slot)
+
+    def _reserve_cache_slot(self) -> int | None:
+        # Two Chrome processes must never share a disk cache, so every live browser gets the lowest free slot
+        if not ScraperConfig.LeanProfile.DISK_CACHE_DIR:
+            return None
+        with self.condition:
+            cache_slot = 0
+            while cache_slot in self.cache_slots_in_use:
+                cache_slot += 1
+            self.cache_slots_in_use.add(cache_slot)
+            return cache_slot
+
+    @staticmethod
+    def _get_disk_cache_dir(cache_slot: int | None) -> str | None:
+        if cache_slot is None:
+            return None
+        return os.path.join(ScraperConfig.LeanProfile.DISK_CACHE_DIR, str(cache_slot))
+
+    def _discard(self, pooled_driver: PooledDriver):
+        self._quit(pooled_driver)
+        with self.condition:
+            self.number_of_drivers -= 1
+            self.condition.notify()
+
+    def _quit(self, pooled_driver: PooledDriver):
+        self._quit_driver(pooled_driver.driver)
+        with self.condition:
+            self.cache_slots_in_use.discard(pooled_driver.cache_slot)
+
+    @staticmethod
+    def _quit_driver(driver: WebDriver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"WebDriverPool: Couldn't quit the browser: {e}")
+
+    @staticmethod
+    def _is_healthy(pooled_driver: PooledDriver) -> bool:
+        # Runs only in the browser, no network involved
+        try:
+            return pooled_driver.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(pooled_driver: PooledDriver) -> bool:
+        """
+        Removes everything a task left behind - extra windows, cookies and the storage of the last opened site
+        """
+        driver = pooled_driver.driver
+        try:
+            window_handles = driver.window_handles
+            for window_handle in window_handles[1:]:
+                driver.switch_to.window(window_handle)
+                driver.close()
+            driver.switch_to.window(window_handles[0])
+
+            parsed_url = urlparse(driver.current_url)
+            if parsed_url.scheme in ("http", "https"):
+                driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+                    "origin": f"{parsed_url.scheme}://{parsed_url.netloc}",
+                    "storageTypes": "local_storage,session_storage,indexeddb,websql,service_workers,cache_storage"
+                })
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            driver.get("about:blank")
+            return True
+        except Exception as e:
+            logger.warning(f"WebDriverPool: Couldn't reset browser {pooled_driver.index}: {e}")
+            return False
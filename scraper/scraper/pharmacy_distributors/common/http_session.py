@@ -0,0 +1,54 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from configuration.common import ScraperConfig
+
+
+def create_pooled_session(pool_size: int = ScraperConfig.HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Creates a keep-alive session, which reuses up to `pool_size` open connections per host
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class HttpSessionStats:
+    """
+    Counts the traffic of a scraper's HTTP session, so the savings of the pooled connections can be checked per task
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.cookie_syncs = 0
+        self.elapsed_seconds = 0.0
+
+    def record_response(self, response: requests.Response, started_at: float):
+        request_body = response.request.body or b""
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += len(response.request.url or "") + len(request_body)
+            self.bytes_received += len(response.content)
+            self.elapsed_seconds += time.monotonic() - started_at
+
+    def record_cookie_sync(self):
+        with self._lock:
+            self.cookie_syncs += 1
+
+    def to_json(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "cookie_syncs": self.cookie_syncs,
+                "average_request_seconds": round(self.elapsed_seconds / self.requests, 3) if self.requests else 0,
+            }
@@ -0,0 +1,112 @@
+import fnmatch
+import logging
+import threading
+from typing import Dict, List, Sequence
+
+from selenium.webdriver.chrome.webdriver import WebDriver
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Analytics, ads and social widgets, none of them is needed to place an order
+THIRD_PARTY_URL_PATTERNS = [
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*googlesyndication.com*",
+    "*facebook.net*",
+    "*facebook.com/tr*",
+    "*hotjar.com*",
+    "*clarity.ms*",
+    "*yandex.ru/metrika*",
+    "*mc.yandex.ru*",
+]
+
+# Chrome can't block by resource type without intercepting every request, so the types are blocked by extension
+RESOURCE_TYPE_URL_PATTERNS: Dict[str, List[str]] = {
+    "image": ["*.png", "*.png?*", "*.jpg", "*.jpg?*", "*.jpeg", "*.jpeg?*", "*.gif", "*.gif?*",
+              "*.svg", "*.svg?*", "*.ico", "*.ico?*", "*.webp", "*.webp?*"],
+    "font": ["*.woff", "*.woff?*", "*.woff2", "*.woff2?*", "*.ttf", "*.ttf?*", "*.eot", "*.eot?*", "*.otf", "*.otf?*"],
+    "media": ["*.mp4", "*.mp4?*", "*.webm", "*.webm?*", "*.mp3", "*.mp3?*"],
+    "stylesheet": ["*.css", "*.css?*"],
+}
+
+# Sums up the navigation and every resource of the current document
+READ_PAGE_LOAD_SCRIPT = """
+var navigation = performance.getEntriesByType('navigation')[0];
+if (!navigation) {
+    return null;
+}
+var resources = performance.getEntriesByType('resource');
+var transferred = navigation.transferSize;
+for (var i = 0; i < resources.length; i++) {
+    transferred += resources[i].transferSize;
+}
+var loadTime = navigation.loadEventEnd > 0 ? navigation.loadEventEnd - navigation.startTime : navigation.duration;
+return [loadTime, transferred, resources.length];
+"""
+
+
+def url_matches_pattern(url: str, url_pattern: str) -> bool:
+    """
+    Matches the way Chrome does, where only `*` is a wildcard
+    """
+    return fnmatch.fnmatchcase(url, url_pattern.replace("[", "[[]").replace("?", "[?]"))
+
+
+def get_blocked_url_patterns(blocked_resource_types: Sequence[str], allowed_urls: Sequence[str]) -> List[str]:
+    """
+    The third-party hosts and the resource types to block. A pattern which matches one of the distributor's
+    allowed URLs is not blocked at all, so the allow-list always wins
+    """
+    blocked_url_patterns = list(THIRD_PARTY_URL_PATTERNS)
+    for resource_type in blocked_resource_types:
+        blocked_url_patterns.extend(RESOURCE_TYPE_URL_PATTERNS.get(resource_type, []))
+    return [
+        blocked_url_pattern for blocked_url_pattern in blocked_url_patterns
+        if not any(url_matches_pattern(allowed_url, blocked_url_pattern) for allowed_url in allowed_urls)
+    ]
+
+
+def apply_lean_profile(driver: WebDriver, blocked_resource_types: Sequence[str], allowed_urls: Sequence[str]):
+    """
+    Replaces the blocked URLs of the browser, which is needed on every lease since the browsers are shared by the distributors
+    """
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {
+        "urls": get_blocked_url_patterns(blocked_resource_types, allowed_urls)
+    })
+
+
+class PageLoadStats:
+    """
+    Load time and transferred bytes of the pages a scraper loaded during the task
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages: Dict[str, List[float]] = {}
+        self.transferred_bytes: Dict[str, int] = {}
+
+    def record(self, driver: WebDriver, page: str):
+        try:
+            page_load = driver.execute_script(READ_PAGE_LOAD_SCRIPT)
+        except Exception as e:
+            logger.debug(f"PageLoadStats: Couldn't read the load stats of page '{page}': {e}")
+            return
+        if page_load is None:
+            return
+        with self._lock:
+            self.pages.setdefault(page, []).append(float(page_load[0]))
+            self.transferred_bytes[page] = self.transferred_bytes.get(page, 0) + int(page_load[1])
+
+    def to_json(self):
+        with self._lock:
+            return {
+                page: {
+                    "loads": len(load_times),
+                    "average_load_ms": round(sum(load_times) / len(load_times)),
+                    "transferred_bytes": self.transferred_bytes[page],
+                }
+                for page, load_times in self.pages.items()
+            }
@@ -0,0 +1,155 @@
+import base64
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from selenium.webdriver.chrome.webdriver import WebDriver
+
+from configuration.common import ScraperConfig
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# PNG of the whole viewport on every step, the way the scrapers always did it
+MODE_ALWAYS = "always"
+# Downscaled JPEG/WebP through CDP on every step
+MODE_LEAN = "lean"
+# Like lean, but only every n-th step
+MODE_SAMPLED = "sampled"
+# No step screenshots, only the one taken when the task fails
+MODE_ON_EXCEPTION = "on_exception"
+
+MODES = (MODE_ALWAYS, MODE_LEAN, MODE_SAMPLED, MODE_ON_EXCEPTION)
+
+
+class Screenshot:
+    def __init__(self, data: bytes, extension: str, step: str):
+        self.data = data
+        self.extension = extension
+        self.step = step
+
+
+class ScreenshotBuffer:
+    """
+    Ring buffer of the most recent screenshots, bounded both by count and by total size
+    """
+
+    def __init__(self, max_count: int, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.screenshots: Deque[Screenshot] = deque(maxlen=max_count)
+        self.size_in_bytes = 0
+
+    def add(self, screenshot: Screenshot):
+        if len(screenshot.data) > self.max_bytes:
+            return
+        if len(self.screenshots) == self.screenshots.maxlen:
+            self.size_in_bytes -= len(self.screenshots.pop().data)
+        self.screenshots.appendleft(screenshot)
+        self.size_in_bytes += len(screenshot.data)
+        while self.size_in_bytes > self.max_bytes:
+            self.size_in_bytes -= len(self.screenshots.pop().data)
+
+    def newest_first(self) -> List[Screenshot]:
+        return list(self.screenshots)
+
+
+class StepStats:
+    def __init__(self):
+        self.captures = 0
+        self.skipped = 0
+        self.seconds = 0.0
+        self.bytes = 0
+
+    def to_json(self):
+        return {
+            "captures": self.captures,
+            "skipped": self.skipped,
+            "seconds": round(self.seconds, 3),
+            "bytes": self.bytes,
+        }
+
+
+class ScreenshotRecorder:
+    """
+    Decides per step whether and how a scraper's screenshot is taken, and keeps what each step costs
+    """
+
+    def __init__(self, mode: str | None = None):
+        if mode is None:
+            mode = ScraperConfig.Screenshots.MODE
+        if mode not in MODES:
+            logger.warning(f"ScreenshotRecorder: Unknown mode '{mode}', using '{MODE_ON_EXCEPTION}'")
+            mode = MODE_ON_EXCEPTION
+        self.mode = mode
+        self.buffer = ScreenshotBuffer(ScraperConfig.Screenshots.MAX_COUNT, ScraperConfig.Screenshots.MAX_BYTES)
+        self.steps = 0
+        self.step_stats: Dict[str, StepStats] = {}
+        self.viewport_sizes: Dict[int, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def capture_step(self, browser: WebDriver, step: str):
+        with self._lock:
+            self.steps += 1
+            stats = self.step_stats.setdefault(step, StepStats())
+            if not self._should_capture():
+                stats.skipped += 1
+                return
+
+        started_at = time.monotonic()
+        try:
+            if self.mode == MODE_ALWAYS:
+                screenshot = Screenshot(browser.get_screenshot_as_png(), "png", step)
+            else:
+                screenshot = self._capture_lean(browser, step)
+        except Exception as e:
+            # A missing screenshot must never fail the step itself
+            logger.warning(f"ScreenshotRecorder: Couldn't capture the screenshot of step '{step}': {e}")
+            return
+
+        with self._lock:
+            stats.captures += 1
+            stats.seconds += time.monotonic() - started_at
+            stats.bytes += len(screenshot.data)
+            self.buffer.add(screenshot)
+
+    def get_screenshots(self) -> List[Screenshot]:
+        with self._lock:
+            return self.buffer.newest_first()
+
+    def to_json(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "steps": self.steps,
+                "buffered_bytes": self.buffer.size_in_bytes,
+                "per_step": {step: stats.to_json() for step, stats in self.step_stats.items() if stats.captures or stats.skipped},
+            }
+
+    def _should_capture(self) -> bool:
+        # Must be called while holding the lock
+        if self.mode == MODE_ON_EXCEPTION:
+            return False
+        if self.mode == MODE_SAMPLED:
+            return self.steps % max(1, ScraperConfig.Screenshots.SAMPLE_EVERY) == 0
+        return True
+
+    def _capture_lean(self, browser: WebDriver, step: str) -> Screenshot:
+        width, height = self._get_viewport_size(browser)
+        image_format = ScraperConfig.Screenshots.FORMAT
+        result = browser.execute_cdp_cmd("Page.captureScreenshot", {
+            "format": image_format,
+            "quality": ScraperConfig.Screenshots.QUALITY,
+            "clip": {"x": 0, "y": 0, "width": width, "height": height, "scale": ScraperConfig.Screenshots.SCALE},
+        })
+        return Screenshot(base64.b64decode(result["data"]), "jpg" if image_format == "jpeg" else image_format, step)
+
+    def _get_viewport_size(self, browser: WebDriver) -> Tuple[int, int]:
+        # The headless window never changes its size, so it is asked once per browser
+        viewport_size = self.viewport_sizes.get(id(browser))
+        if viewport_size is None:
+            width, height = browser.execute_script("return [window.innerWidth, window.innerHeight];")
+            viewport_size = (int(width), int(height))
+            self.viewport_sizes[id(browser)] = viewport_size
+        return viewport_size
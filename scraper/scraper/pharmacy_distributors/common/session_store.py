@@ -0,0 +1,61 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from configuration.common import ScraperConfig
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+
+class StoredSession:
+    def __init__(self, cookies: List[dict], prepared_url: str):
+        self.cookies = cookies
+        # The page the browser was on once the order was prepared
+        self.prepared_url = prepared_url
+        self.saved_at = time.monotonic()
+
+
+class SessionStore:
+    """
+    Keeps the cookies of the logged in distributor sessions per distributor and pharmacy, so the next task
+    for the same pharmacy can skip the login. It lives only in the worker's memory, the cookies are never persisted.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(SessionStore, cls).__new__(cls)
+                    cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self.sessions: Dict[Tuple[str, str], StoredSession] = {}
+        self.sessions_lock = threading.Lock()
+
+    def save(self, distributor: str, pharmacy_id: str, cookies: List[dict], prepared_url: str):
+        if not ScraperConfig.SessionStore.ENABLED:
+            return
+        with self.sessions_lock:
+            self.sessions[(distributor, pharmacy_id)] = StoredSession(cookies, prepared_url)
+        logger.info(f"SessionStore: Saved the session of {distributor} for pharmacy {pharmacy_id}")
+
+    def load(self, distributor: str, pharmacy_id: str) -> StoredSession | None:
+        if not ScraperConfig.SessionStore.ENABLED:
+            return None
+        with self.sessions_lock:
+            stored_session = self.sessions.get((distributor, pharmacy_id))
+            if stored_session is None:
+                return None
+            if time.monotonic() - stored_session.saved_at > ScraperConfig.SessionStore.TTL_SECONDS:
+                del self.sessions[(distributor, pharmacy_id)]
+                return None
+            return stored_session
+
+    def invalidate(self, distributor: str, pharmacy_id: str):
+        with self.sessions_lock:
+            self.sessions.pop((distributor, pharmacy_id), None)
@@ -0,0 +1,156 @@
+import logging
+import threading
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from selenium.webdriver.chrome.webdriver import WebDriver
+
+from configuration.common import ScraperConfig
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Counts the XHR/fetch requests in flight and the time of the last DOM change, so the scrapers can wait
+# for a postback to finish instead of guessing with spinners and sleeps
+ACTIVITY_MONITOR_SCRIPT = """
+(function () {
+    if (window.__psaActivity) {
+        return;
+    }
+    var activity = {document: performance.timeOrigin, pending: 0, started: 0, lastChange: Date.now()};
+    window.__psaActivity = activity;
+    function touch() {
+        activity.lastChange = Date.now();
+    }
+
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        activity.pending++;
+        activity.started++;
+        touch();
+        this.addEventListener('loadend', function () {
+            activity.pending--;
+            touch();
+        });
+        return send.apply(this, arguments);
+    };
+
+    if (window.fetch) {
+        var fetch = window.fetch;
+        window.fetch = function () {
+            activity.pending++;
+            activity.started++;
+            touch();
+            return fetch.apply(this, arguments).finally(function () {
+                activity.pending--;
+                touch();
+            });
+        };
+    }
+
+    new MutationObserver(touch).observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+})();
+"""
+
+READ_ACTIVITY_SCRIPT = """
+var activity = window.__psaActivity;
+if (!activity) {
+    return null;
+}
+return [activity.document, activity.pending, activity.started, Date.now() - activity.lastChange];
+"""
+
+
+def install_activity_monitor(driver: WebDriver):
+    """
+    Registers the monitor for every document the browser opens from now on
+    """
+    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": ACTIVITY_MONITOR_SCRIPT})
+
+
+class PageActivity:
+    def __init__(self, document: float, pending: int, started: int, quiet_ms: int):
+        # Identifies the document, a full page load starts the counters over
+        self.document = document
+        self.pending = pending
+        self.started = started
+        self.quiet_ms = quiet_ms
+
+    def is_settled_since(self, mark: "PageActivity", quiet_period_ms: int) -> bool:
+        """
+        True once a request started after the mark (or the page was reloaded), all requests finished
+        and the DOM stayed unchanged for the quiet period
+        """
+        if self.document == mark.document and self.started <= mark.started:
+            return False
+        return self.pending == 0 and self.quiet_ms >= quiet_period_ms
+
+
+def read_activity(driver: WebDriver) -> PageActivity | None:
+    """
+    Returns None if the current page was loaded without the monitor
+    """
+    activity = driver.execute_script(READ_ACTIVITY_SCRIPT)
+    if activity is None:
+        return None
+    return PageActivity(activity[0], int(activity[1]), int(activity[2]), int(activity[3]))
+
+
+class LatencyTracker:
+    """
+    Keeps the recently observed durations of the browser waits per distributor and operation,
+    and turns them into timeouts. Until there are enough samples the hard-coded default is used
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(LatencyTracker, cls).__new__(cls)
+                    cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self.samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self.samples_lock = threading.Lock()
+
+    def record(self, distributor: str, operation: str, seconds: float):
+        with self.samples_lock:
+            samples = self.samples.get((distributor, operation))
+            if samples is None:
+                samples = deque(maxlen=ScraperConfig.Waits.LATENCY_SAMPLES)
+                self.samples[(distributor, operation)] = samples
+            samples.append(seconds)
+
+    def percentile(self, distributor: str, operation: str, percentile: float) -> float | None:
+        with self.samples_lock:
+            samples = sorted(self.samples.get((distributor, operation), ()))
+        if len(samples) < ScraperConfig.Waits.MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def timeout(self, distributor: str, operation: str, default_seconds: float) -> float:
+        """
+        The p95 of the recent waits with a safety margin, never above the default
+        """
+        if not ScraperConfig.Waits.ADAPTIVE:
+            return default_seconds
+        p95 = self.percentile(distributor, operation, 95)
+        if p95 is None:
+            return default_seconds
+        timeout = max(p95 * ScraperConfig.Waits.TIMEOUT_MULTIPLIER, ScraperConfig.Waits.MIN_TIMEOUT_SECONDS)
+        return min(timeout, default_seconds)
+
+    def to_json(self, distributor: str):
+        with self.samples_lock:
+            operations = [operation for (name, operation) in self.samples.keys() if name == distributor]
+        stats = {}
+        for operation in operations:
+            p50 = self.percentile(distributor, operation, 50)
+            p95 = self.percentile(distributor, operation, 95)
+            if p95 is not None:
+                stats[operation] = {"p50": round(p50, 3), "p95": round(p95, 3)}
+        return stats
@@ -8,7 +8,8 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import ElementClickInterceptedException
 
-from pharmacy_distributors.common.browser_common import BrowserCommon
+from pharmacy_distributors.common.browser_common import BrowserCommon, PriceLookupError
+from pharmacy_distributors.common.candidate_ranking import Candidate, select_candidate
 from configuration.common import DistributorConfig
 
 
@@ -20,17 +21,17 @@ logger.setLevel(logging.DEBUG)
 
 
 class PhoenixPharma(BrowserCommon):
+    # Ext JS needs its stylesheets to lay out the grids and the Font Awesome glyphs are the only content of some buttons
+    LEAN_PROFILE_BLOCKED_RESOURCE_TYPES = ("image", "media")
+    LEAN_PROFILE_ALLOWED_URLS = (
+        "https://b2b.phoenixpharma.bg/bg/build/production/BgShop/resources/BgShop-all.css",
+        "https://b2b.phoenixpharma.bg/bg/build/production/BgShop/app.js",
+    )
 
     def __init__(self, pharmacyID: str, shouldInitBrowser=True):
         logger.info("PhoenixPharma.__init__()")
 
-        super().__init__("Phoenix", 20, shouldInitBrowser)
-
-        self.pharmacyID = pharmacyID
-
-        self.LOGIN_PAGE = 'https://b2b.phoenixpharma.bg/bg/build/production/BgShop/index.php'
-        # dummy page is used before login in order to navigate to the domain and set the `cookiesAsked` cookie
-        self.DUMMY_PAGE = 'https://b2b.phoenixpharma.bg/dummy_page'
+        # Checked before a browser is leased from the pool, so an unknown pharmacy doesn't keep one
         all_users = DistributorConfig.Phoenix.CONFIG.get_all_users()
         for credential in all_users:
             if pharmacyID == credential.id:
@@ -40,6 +41,14 @@ class PhoenixPharma(BrowserCommon):
         else:
             raise ValueError("Pharmacy ID not found in Phoenix config")
 
+        super().__init__("Phoenix", 20, shouldInitBrowser)
+
+        self.pharmacyID = pharmacyID
+
+        self.LOGIN_PAGE = 'https://b2b.phoenixpharma.bg/bg/build/production/BgShop/index.php'
+        # dummy page is used before login in order to navigate to the domain and set the `cookiesAsked` cookie
+        self.DUMMY_PAGE = 'https://b2b.phoenixpharma.bg/dummy_page'
+
         # self.username = 'pc541dibo'
         # self.password = 'pc541dibo'
 
@@ -48,8 +57,10 @@ class PhoenixPharma(BrowserCommon):
                                 + "starts-with(@name, 'textfield')]"
         self.SEARCH_BUTTON_CSS_SELECTOR = "span.fa-search"
         self.PRODUCT_PLUS_BUTTON_XPATH = "//span[text()='Добави']/ancestor::*/div[contains(@role,'grid')]//span[text()='+']"
-
-        self.lastSearchWasEmpty = True
+        # Every row of the Ext JS grid is a table of its own
+        self.RESULT_ROW_OF_PLUS_BUTTON_XPATH = "./ancestor::table[contains(@class, 'x-grid-item')][1]"
+        # The '+' button of the search result row which the cart update works on
+        self.selectedPlusButton = None
 
     def login(self):
         self.browser.get(self.DUMMY_PAGE)
@@ -57,6 +68,7 @@ class PhoenixPharma(BrowserCommon):
         self.browser.add_cookie({'name': 'cookiesAllowedMarketing', 'value': 'false'})
         self.browser.add_cookie({'name': 'cookiesAllowedAnalytical', 'value': 'false'})
         self.browser.get(self.LOGIN_PAGE)
+        self.record_page_load("login")
 
         self.store_temporary_screenshot()
         self.browser.find_element(By.CSS_SELECTOR, "input[name='loginUsername']").send_keys(self.username)
@@ -66,24 +78,43 @@ class PhoenixPharma(BrowserCommon):
         self.browser.find_element(By.CSS_SELECTOR, "input[name='loginPasswordText']").send_keys(Keys.RETURN)
 
     def prepare_for_order(self):
-        WebDriverWait(self.browser, 2).until(EC.element_to_be_clickable((By.XPATH, "//span[contains(text(), 'Поръчка')]"))).click()
+        if self.keep_cart:
+            # The previous run of the task filled the latest order
+            self._open_latest_order()
+            return
+        self.wait_until("page_load", EC.element_to_be_clickable((By.XPATH, "//span[contains(text(), 'Поръчка')]")), 2).click()
         self.store_temporary_screenshot()
         self.browser.find_element(By.XPATH, "//span[contains(text(), 'Нова поръчка свободна')]").click()
 
         self.browser.find_element(By.CSS_SELECTOR, "input[name='order_partner_id']").send_keys(self.pharmacyID)
         try:
-            element = WebDriverWait(self.browser, 5)\
-                .until(EC.element_to_be_clickable((By.XPATH, "//div[contains(@class, 'x-grid-cell-inner') and text() = '" + self.pharmacyID + "']")))
+            element = self.wait_until(
+                "choose_pharmacy",
+                EC.element_to_be_clickable((By.XPATH, "//div[contains(@class, 'x-grid-cell-inner') and text() = '" + self.pharmacyID + "']")),
+                5)
             element.click()
         except Exception:
             logger.debug("PhoenixPharma:prepare_for_order(): Couldn't find the pharmacy with ID " + self.pharmacyID)
             pass
 
+    def get_session_restore_page(self) -> str:
+        return self.DUMMY_PAGE
+
+    def is_session_valid(self) -> bool:
+        try:
+            WebDriverWait(self.browser, 5).until(EC.element_to_be_clickable((By.XPATH, "//span[contains(text(), 'Поръчка')]")))
+            return True
+        except Exception:
+            return False
+
+    def on_session_restored(self):
+        # Only the login is reused, every task fills a new order unless it is resumed
+        self.prepare_for_order()
+
     def _hide_spellcheck(self):
         self.store_temporary_screenshot()
         try:
-            element = WebDriverWait(self.browser, 1)\
-                .until(EC.element_to_be_clickable((By.XPATH, SELECTOR_SPELLCHECK)))
+            element = self.wait_until("spellcheck", EC.element_to_be_clickable((By.XPATH, SELECTOR_SPELLCHECK)), 1)
             element.click()
         except Exception:
             # if there's no spellcheck, ignore
@@ -91,39 +122,63 @@ class PhoenixPharma(BrowserCommon):
         self.store_temporary_screenshot()
 
     def _search_for_product(self, product_name: str):
-        self._clearSearchResult()
+        """
+        Returns the '+' button of the result row which matches the product name best, or None
+        """
         logger.info("PhoenixPharma:_search_for_product(): product_name:" + product_name)
+        self.selectedPlusButton = None
+        # The grid renders its rows again for every search, so a row of the previous result tells it apart from the new one.
+        # A search without results doesn't touch the grid, it only opens the spellcheck
+        previous_result = self.find_optional_element(By.XPATH, self.PRODUCT_PLUS_BUTTON_XPATH)
         self.browser.find_element(By.XPATH, self.SEARCH_BOX_XPATH).clear()
         self.browser.find_element(By.XPATH, self.SEARCH_BOX_XPATH).send_keys(product_name)
         self.store_temporary_screenshot()
+        mark = self.mark_activity()
         self.browser.find_element(By.CSS_SELECTOR, self.SEARCH_BUTTON_CSS_SELECTOR).click()
+        self.wait_for_activity_to_settle("search", mark, 5)
+        if not self.wait_for_replacement("result_refresh", previous_result, 5, (By.XPATH, SELECTOR_SPELLCHECK)):
+            logger.error("PhoenixPharma: The search result wasn't refreshed, so the grid still shows the previous search")
+            raise PriceLookupError(f"The search result for {product_name} wasn't refreshed")
+        spellcheck = self.find_optional_element(By.XPATH, SELECTOR_SPELLCHECK)
+        if spellcheck is not None and spellcheck.is_displayed():
+            # The rows of the previous result may still be in the grid, so the spellcheck must win over them
+            logger.info("PhoenixPharma: Closing spellcheck")
+            spellcheck.click()
+            return None
 
         # if spellcheck popup appears, hide it
         try:
-            element = WebDriverWait(self.browser, 5)\
-                .until(EC.element_to_be_clickable((By.XPATH, SELECTOR_SPELLCHECK + "|" + self.PRODUCT_PLUS_BUTTON_XPATH)))
+            element = self.wait_until(
+                "search_result", EC.element_to_be_clickable((By.XPATH, SELECTOR_SPELLCHECK + "|" + self.PRODUCT_PLUS_BUTTON_XPATH)), 5)
             if element.tag_name == 'div':
                 logger.info("PhoenixPharma: Closing spellcheck")
                 # spellcheck is triggered only if there are no results, so return None
                 element.click()
                 return None
         except Exception:
-            # Neither spellcheck nor result was found, so return None
-            return None
+            # Neither spellcheck nor result was found, so the search didn't finish in time
+            raise PriceLookupError(f"The search result for {product_name} didn't come in time")
 
-        number_of_results = len(self.browser.find_elements(By.XPATH, self.PRODUCT_PLUS_BUTTON_XPATH))
-        logger.info("PhoenixPharma: number_of_results=" + str(number_of_results))
-        if number_of_results == 0:
+        plus_buttons = self.browser.find_elements(By.XPATH, self.PRODUCT_PLUS_BUTTON_XPATH)
+        logger.info("PhoenixPharma: number_of_results=" + str(len(plus_buttons)))
+        if len(plus_buttons) == 0:
             logger.error("PhoenixPharma: Search result is empty...")
             return None
-        if number_of_results > 1:
-            self.lastSearchWasEmpty = False
-            logger.error("PhoenixPharma: Too many results were found with the search. For now, we parse this as an invalid search result")
+
+        candidate = select_candidate(product_name, [
+            Candidate(self._get_product_name(self._get_result_row(plus_button)), math.inf, plus_button)
+            for plus_button in plus_buttons
+        ])
+        if candidate is None:
+            logger.error(f"PhoenixPharma: None of the {len(plus_buttons)} results matches the search well enough")
             return None
 
-        logger.info("PhoenixPharma:_search_for_product(): Found product " + product_name)
-        self.lastSearchWasEmpty = False
-        return element
+        logger.info("PhoenixPharma:_search_for_product(): Found product " + candidate.name)
+        self.selectedPlusButton = candidate.source
+        return self.selectedPlusButton
+
+    def _get_result_row(self, plus_button):
+        return plus_button.find_element(By.XPATH, self.RESULT_ROW_OF_PLUS_BUTTON_XPATH)
 
     def _get_price_header_position(self):
         SELECTOR_PRICE_HEADER_POSITION = "//span[text()='Добави']/ancestor::*[9]//div[starts-with(@id, 'gridcolumn')"\
@@ -139,32 +194,39 @@ class PhoenixPharma(BrowserCommon):
 
         return -1
 
-    def _get_product_price(self, price_header_position):
-        SELECTOR_PROD_PRICE = "(//span[text()='Добави']/ancestor::*[9]//td[contains(@class, 'x-grid-cell')])[" + str(price_header_position) + "]//div"
-        price_element = WebDriverWait(self.browser, 5)\
-            .until(EC.element_to_be_clickable((By.XPATH, SELECTOR_PROD_PRICE)))
+    def _get_product_price(self, price_header_position, row):
+        SELECTOR_PROD_PRICE = "(.//td[contains(@class, 'x-grid-cell')])[" + str(price_header_position) + "]//div"
+        price_element = row.find_element(By.XPATH, SELECTOR_PROD_PRICE)
         innerHTML = price_element.get_attribute('innerHTML')
         if innerHTML is None:
             return math.inf
         return float(innerHTML.strip().replace("&nbsp;", ""))
 
-    def _get_product_name(self):
-        SELECTOR_PROD_NAME = "(//span[text()='Добави']/ancestor::*[9]//td[contains(@class, 'x-grid-cell')])[2]//div"
-        name_element = WebDriverWait(self.browser, 5).until(EC.element_to_be_clickable((By.XPATH, SELECTOR_PROD_NAME)))
+    def _get_product_name(self, row):
+        SELECTOR_PROD_NAME = "(.//td[contains(@class, 'x-grid-cell')])[2]//div"
+        name_element = row.find_element(By.XPATH, SELECTOR_PROD_NAME)
         product_name = name_element.text.strip().replace("&nbsp;", "")
-        product_name = product_name[:product_name.find("\n")+1]
-        return product_name
+        # The cell shows more details under the name
+        return product_name.split("\n")[0].strip()
 
     def get_product_name_and_price(self, productSearchNames: list) -> Tuple[str, float]:
+        """
+        Raises PriceLookupError if no name was found and a search of one of them failed
+        """
         logger.info("PhoenixPharma:get_product_name_and_price(): productSearchNames=" + str(productSearchNames))
         element = None
+        lookup_error: PriceLookupError | None = None
         for productName in productSearchNames:
             try:
-                element = self._search_for_product(productName)
-            except ElementClickInterceptedException:
-                # If the spellcheck caused the miss-click, hide it and retry
-                self._hide_spellcheck()
-                element = self._search_for_product(productName)
+                try:
+                    element = self._search_for_product(productName)
+                except ElementClickInterceptedException:
+                    # If the spellcheck caused the miss-click, hide it and retry
+                    self._hide_spellcheck()
+                    element = self._search_for_product(productName)
+            except PriceLookupError as e:
+                lookup_error = e
+                continue
 
             if element is None:
                 continue
@@ -173,15 +235,20 @@ class PhoenixPharma(BrowserCommon):
             price_header_position = self._get_price_header_position()
             if price_header_position == -1:
                 logger.error("PhoenixPharma: Price header position was not found...")
-                return "", math.inf
+                raise PriceLookupError("The price column of the search result was not found")
 
-            return self._get_product_name(), self._get_product_price(price_header_position)
+            row = self._get_result_row(element)
+            return self._get_product_name(row), self._get_product_price(price_header_position, row)
 
+        if lookup_error is not None:
+            raise lookup_error
         return "", math.inf
 
     def add_product_to_cart(self, quantity):
         logger.info("PhoenixPharma:add_product_to_cart(): quantity=" + str(quantity))
-        plus_button = self.browser.find_element(By.XPATH, self.PRODUCT_PLUS_BUTTON_XPATH)
+        plus_button = self.selectedPlusButton
+        if plus_button is None:
+            raise Exception("PhoenixPharma: No search result is selected to add to the cart")
         for i in range(0, quantity):
             plus_button.click()
 
@@ -192,35 +259,21 @@ class PhoenixPharma(BrowserCommon):
 
         return True
 
-    def _clearSearchResult(self):
-        # no need to clear the search if it's already cleared
-        if self.lastSearchWasEmpty is True:
-            return
-
-        self.lastSearchWasEmpty = True
-
-        logger.info("PhoenixPharma:_clearSearchResult() - clearing last result")
+    def _open_latest_order(self):
         self.store_temporary_screenshot()
-
-        self.browser.find_element(By.XPATH, self.SEARCH_BOX_XPATH).clear()
-        self.browser.find_element(By.XPATH, self.SEARCH_BOX_XPATH).send_keys("IMPOSSIBLE_PRODUCT")
-        try:
-            self.browser.find_element(By.CSS_SELECTOR, self.SEARCH_BUTTON_CSS_SELECTOR).click()
-        except Exception:
-            self._hide_spellcheck()
-            self.browser.find_element(By.CSS_SELECTOR, self.SEARCH_BUTTON_CSS_SELECTOR).click()
+        self.wait_until("page_load", EC.element_to_be_clickable((By.XPATH, "//span[contains(text(), 'Поръчка')]")), 2).click()
+        self.store_temporary_screenshot()
+        self.wait_until("orders_list", EC.element_to_be_clickable((By.XPATH, "//span[contains(text(), 'Списък поръчки')]")), 2).click()
+        # select latest order
+        SELECTOR_LATEST_ORDER = "//div[@class='x-grid-item-container']//table[1]//td[contains(@class, 'x-grid-cell')][1]"
+        self.store_temporary_screenshot()
+        self.wait_until("orders_list", EC.element_to_be_clickable((By.XPATH, SELECTOR_LATEST_ORDER)), 2).click()
 
     def refresh_page(self):
         self.browser.refresh()
+        self.record_page_load("order")
         try:
-            self.store_temporary_screenshot()
-            WebDriverWait(self.browser, 2).until(EC.element_to_be_clickable((By.XPATH, "//span[contains(text(), 'Поръчка')]"))).click()
-            self.store_temporary_screenshot()
-            WebDriverWait(self.browser, 2).until(EC.element_to_be_clickable((By.XPATH, "//span[contains(text(), 'Списък поръчки')]"))).click()
-            # select latest order
-            SELECTOR_LATEST_ORDER = "//div[@class='x-grid-item-container']//table[1]//td[contains(@class, 'x-grid-cell')][1]"
-            self.store_temporary_screenshot()
-            WebDriverWait(self.browser, 2).until(EC.element_to_be_clickable((By.XPATH, SELECTOR_LATEST_ORDER))).click()
+            self._open_latest_order()
         except Exception:
             # if self.hasInternetConnection() == False:
             self.refresh_page()
@@ -1,11 +1,20 @@
+import asyncio
 import logging
 import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
 from urllib.parse import quote
 import requests
 import xmltodict
+from xml.parsers.expat import ExpatError
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
 
+from configuration.common import ScraperConfig
+from pharmacy_distributors.common.browser_common import PriceLookupError
+from pharmacy_distributors.common.candidate_ranking import Candidate, select_candidate
+from pharmacy_distributors.common.http_session import HttpSessionStats, create_pooled_session
 from pharmacy_distributors.phoenix.phoenix import PhoenixPharma
 
 # Create a logger for this module
@@ -15,74 +24,191 @@ logger = logging.getLogger(__name__)
 
 
 class PhoenixPharmaOptimized(PhoenixPharma):
+    # Searches go through the article.php endpoint and add_product_to_cart searches again in the browser
+    stateless_price_lookup = True
 
     def __init__(self, pharmacyID: str, shouldInitBrowser=True):
         super().__init__(pharmacyID, shouldInitBrowser)
 
         self.pharmacyID = pharmacyID
 
-    def _get_json_result_of_search(self, product_name: str):
-        php_session_id_cookie = self.browser.get_cookie("PHPSESSID")
+        try:
+            # Long-lived session for the article.php searches, it carries the PHPSESSID of the logged in browser
+            self.http_session = create_pooled_session()
+            self.http_stats = HttpSessionStats()
+            self.has_session_cookie = False
+        except Exception:
+            # The caller never gets the scraper, so it can't give the browser back to the pool
+            self.finish()
+            raise
+
+    def prepare_for_order(self):
+        super().prepare_for_order()
+        self._sync_session_cookie()
+
+    def _sync_session_cookie(self) -> bool:
+        """
+        Copies the PHPSESSID cookie from the browser into the HTTP session
+        """
+        with self.lock:
+            php_session_id_cookie = self.browser.get_cookie("PHPSESSID")
         if php_session_id_cookie is None:
             logger.error("PhoenixPharma: PHPSESSID cookie is missing...")
+            self.has_session_cookie = False
+            return False
+
+        self.http_session.cookies.set("PHPSESSID", str(php_session_id_cookie["value"]), domain="b2b.phoenixpharma.bg")
+        self.has_session_cookie = True
+        self.http_stats.record_cookie_sync()
+        logger.info("PhoenixPharmaOptimized: Synced the PHPSESSID cookie from the browser")
+        return True
+
+    def _get_json_result_of_search(self, product_name: str):
+        if not self.has_session_cookie and not self._sync_session_cookie():
             return None
-        http_response = requests.get("https://b2b.phoenixpharma.bg/bg/build/production/BgShop/resources/php/combo/article.php?selby=article&" +
-                                     "query=" + quote(product_name) +
-                                     "&order_type=F" +
-                                     "&order_partner_id=4695" +
-                                     "&mode=name_inside",
-                                     headers={"Cookie": "PHPSESSID=" + str(php_session_id_cookie["value"])})
-        json_root = xmltodict.parse(http_response.text)
+
+        json_root = self._request_search(product_name)
+        if json_root is None:
+            # The session has most probably expired, take the current cookie from the browser and retry once
+            if not self._sync_session_cookie():
+                return None
+            json_root = self._request_search(product_name)
         return json_root
 
+    def _request_search(self, product_name: str):
+        started_at = time.monotonic()
+        try:
+            http_response = self.http_session.get(
+                "https://b2b.phoenixpharma.bg/bg/build/production/BgShop/resources/php/combo/article.php?selby=article&" +
+                "query=" + quote(product_name) +
+                "&order_type=F" +
+                "&order_partner_id=4695" +
+                "&mode=name_inside",
+                timeout=ScraperConfig.HTTP_TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            # A timeout or a dropped connection, the product may still be sold
+            raise PriceLookupError(f"The search for {product_name} failed: {e}") from e
+        self.http_stats.record_response(http_response, started_at)
+        if http_response.status_code != 200:
+            logger.error(f"PhoenixPharmaOptimized: Search returned status code {http_response.status_code}")
+            return None
+        try:
+            json_root = xmltodict.parse(http_response.text)
+        except ExpatError:
+            logger.error("PhoenixPharmaOptimized: Search didn't return XML, the session is most probably expired")
+            return None
+        if not isinstance(json_root, dict) or "dataset" not in json_root:
+            logger.error("PhoenixPharmaOptimized: Search result has no dataset, the session is most probably expired")
+            return None
+        return json_root
+
+    def get_http_stats(self) -> dict | None:
+        return self.http_stats.to_json()
+
     # returns name and price
     # order_type + order_partner_id => These parameters are allowing us to get the discount price. All of them are hardcoded
-    def _search_for_product_optimized(self, product_name: str):
-        logger.info("PhoenixPharma._search_for_product_optimized(): Searching for product: '" + product_name + "'...")
+    def search_articles(self, product_name: str) -> List[dict] | None:
+        """
+        The rows of the article.php search, with CyrName, pdPrice and ExpiryDate. None if the search failed
+        """
         json_root = self._get_json_result_of_search(product_name)
         if json_root is None:
-            logger.error("PhoenixPharma._search_for_product_optimized(): Search result is empty...")
-            return None, None
+            return None
         number_of_results = int(json_root["dataset"]["results"])
-
         logger.info("PhoenixPharmaOptimized: number_of_results=" + str(number_of_results))
         if number_of_results == 0:
+            return []
+        # xmltodict gives a single row as a dict and more rows as a list
+        rows = json_root["dataset"].get("row")
+        if rows is None:
+            return []
+        return rows if isinstance(rows, list) else [rows]
+
+    def _search_for_product_optimized(self, product_name: str):
+        logger.info("PhoenixPharma._search_for_product_optimized(): Searching for product: '" + product_name + "'...")
+        rows = self.search_articles(product_name)
+        if rows is None:
+            raise PriceLookupError(f"The search for {product_name} failed")
+        if len(rows) == 0:
             logger.error("PhoenixPharma._search_for_product_optimized(): Search result is empty...")
             return None, None
-        if number_of_results > 1:
-            self.lastSearchWasEmpty = False
-            logger.error("PhoenixPharma: Too many results were found with the search. For now, we parse this as an invalid search result")
-            return None, None
-        result_product_expiry_date = json_root["dataset"]["row"]["ExpiryDate"]
-        if result_product_expiry_date is None or result_product_expiry_date.strip() == "":
-            self.lastSearchWasEmpty = False
-            logger.error("PhoenixPharma: Found product with search, but the expiry date was empty, so we're skipping this product...")
-            return None, None
 
-        result_product_name = json_root["dataset"]["row"]["CyrName"]
-        result_product_price = float(json_root["dataset"]["row"]["pdPrice"])
+        candidates = []
+        for row in rows:
+            result_product_expiry_date = row.get("ExpiryDate")
+            if result_product_expiry_date is None or result_product_expiry_date.strip() == "":
+                logger.error("PhoenixPharma: Found product " + str(row.get("CyrName"))
+                             + " with search, but the expiry date was empty, so we're skipping this product...")
+                continue
+            candidates.append(Candidate(row["CyrName"], float(row["pdPrice"]), row))
+
+        candidate = select_candidate(product_name, candidates, len(rows))
+        if candidate is None:
+            if len(rows) > 1:
+                logger.error(f"PhoenixPharma: None of the {len(rows)} results matches the search well enough")
+            return None, None
 
         logger.info("PhoenixPharma:_search_for_product_optimized(): Found product "
-                    + result_product_name
-                    + ", with price: " + str(result_product_price)
-                    + ", and ExpiryDate: " + result_product_expiry_date)
-        self.lastSearchWasEmpty = False
-        return result_product_name, result_product_price
+                    + candidate.name
+                    + ", with price: " + str(candidate.price)
+                    + ", and ExpiryDate: " + candidate.source["ExpiryDate"])
+        return candidate.name, candidate.price
 
     def get_product_name_and_price(self, productSearchNames: list):
+        """
+        Raises PriceLookupError if no name was found and a search of one of them failed
+        """
         logger.info("PhoenixPharmaOptimized:get_product_name_and_price(): productSearchNames=" + str(productSearchNames))
+        lookup_error: PriceLookupError | None = None
         for productName in productSearchNames:
-            result_product_name, result_product_price = self._search_for_product_optimized(productName)
+            try:
+                result_product_name, result_product_price = self._search_for_product_optimized(productName)
+            except PriceLookupError as e:
+                lookup_error = e
+                continue
 
             if result_product_name is None:
                 continue
 
             return result_product_name, result_product_price
 
+        if lookup_error is not None:
+            raise lookup_error
         return "", math.inf
 
+    async def get_prices_for_many_async(self, productSearchNamesList: List[list],
+                                        concurrency: int | None = None) -> List[Tuple[str, float] | None]:
+        """
+        Sends the searches for all products concurrently, at most `concurrency` at a time.
+        The results are in the input order, None for a product whose search failed
+        """
+        if concurrency is None:
+            concurrency = ScraperConfig.BATCH_PRICE_LOOKUP_CONCURRENCY
+        concurrency = max(1, concurrency)
+        logger.info(f"PhoenixPharmaOptimized: Getting prices for {len(productSearchNamesList)} products, {concurrency} at a time")
+
+        semaphore = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="phoenix-batch") as executor:
+            async def get_product_name_and_price(productSearchNames: list) -> Tuple[str, float] | None:
+                async with semaphore:
+                    try:
+                        return await loop.run_in_executor(executor, self.get_product_name_and_price, productSearchNames)
+                    except Exception as e:
+                        logger.error(f"PhoenixPharmaOptimized: Couldn't get the price for {productSearchNames}: {e}")
+                        return None
+
+            return list(await asyncio.gather(*[
+                get_product_name_and_price(productSearchNames) for productSearchNames in productSearchNamesList
+            ]))
+
+    def get_prices_for_many(self, productSearchNamesList: List[list], concurrency: int | None = None) -> List[Tuple[str, float] | None]:
+        return asyncio.run(self.get_prices_for_many_async(productSearchNamesList, concurrency))
+
     def _add_product_to_cart_optimized(self, quantity):
-        plus_button = self.browser.find_element(By.XPATH, self.PRODUCT_PLUS_BUTTON_XPATH)
+        plus_button = self.selectedPlusButton
+        if plus_button is None:
+            raise Exception("PhoenixPharma: No search result is selected to add to the cart")
         actions = ActionChains(self.browser)
         actions.move_to_element(plus_button).perform()
         for i in range(0, quantity):
@@ -92,7 +218,14 @@ class PhoenixPharmaOptimized(PhoenixPharma):
 
     def add_product_to_cart(self, product_name: str, quantity):
         logger.info("PhoenixPharmaOptimized: Adding product to cart: " + product_name + ", quantity: " + str(quantity))
-        self._search_for_product(product_name)
+        try:
+            plus_button = self._search_for_product(product_name)
+        except PriceLookupError as e:
+            logger.error(f"PhoenixPharmaOptimized: The search in the browser failed: {e}")
+            plus_button = None
+        if plus_button is None:
+            logger.error("PhoenixPharmaOptimized: Product was not found in the browser: " + product_name)
+            return False
 
         try:
             self._add_product_to_cart_optimized(quantity)
@@ -8,7 +8,8 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
-from pharmacy_distributors.common.browser_common import BrowserCommon
+from pharmacy_distributors.common.browser_common import BrowserCommon, PriceLookupError
+from pharmacy_distributors.common.candidate_ranking import Candidate, select_candidate
 from configuration.common import DistributorConfig
 
 SELECTOR_CLEAR_CART = "//tfoot//div[contains(text(), 'Изчисти количката')]"
@@ -20,14 +21,18 @@ logger.setLevel(logging.DEBUG)
 
 
 class StingPharma(BrowserCommon):
-
-    def __init__(self, pharmacyID: str):
+    # The image buttons of the search page must stay clickable, the Telerik combos need their stylesheets
+    LEAN_PROFILE_BLOCKED_RESOURCE_TYPES = ("font", "media")
+    LEAN_PROFILE_ALLOWED_URLS = (
+        "http://web.stingpharma.com/Telerik.Web.UI.WebResource.axd",
+        "http://web.stingpharma.com/ScriptResource.axd",
+        "http://web.stingpharma.com/WebResource.axd",
+    )
+
+    def __init__(self, pharmacyID: str, shouldInitBrowser=True):
         logger.info("StingPharma.__init__()")
 
-        super().__init__("Sting", 10)
-
-        self.LOGIN_PAGE = 'http://web.stingpharma.com/'
-
+        # Checked before a browser is leased from the pool, so an unknown pharmacy doesn't keep one
         for credential in DistributorConfig.Sting.CONFIG.get_all_users():
             if pharmacyID == credential.id:
                 self.user = credential.username
@@ -36,13 +41,25 @@ class StingPharma(BrowserCommon):
         else:
             raise ValueError("Pharmacy ID not found in StingPharma config")
 
+        super().__init__("Sting", 10, shouldInitBrowser)
+
+        self.pharmacyID = pharmacyID
+
+        self.LOGIN_PAGE = 'http://web.stingpharma.com/'
+        # Any page on the domain works, it is needed only to add the cookies of a stored session
+        self.DUMMY_PAGE = 'http://web.stingpharma.com/dummy_page'
+
         self.SEARCH_BOX_XPATH = "//input[starts-with(@value, 'Име на Артикул')]"
         self.SEARCH_BUTTON_XPATH = "//input[contains(@title, 'Търси')]"
 
-        self.lastSearchWasEmpty = True
+        self.RESULT_GRID_XPATH = "//table[contains(@id, 'RadGridResult')]"
+        self.RESULT_ROWS_XPATH = self.RESULT_GRID_XPATH + "//tbody/tr[.//input[starts-with(@title, 'Добави количеството')]]"
+        # The row of the last search result which the price was read from and the cart update works on
+        self.selectedResultRow = None
 
     def login(self):
         self.browser.get(self.LOGIN_PAGE)
+        self.record_page_load("login")
         self.browser.find_element(
             By.CSS_SELECTOR, "input[id='Login1_UserName']").send_keys(self.user)
         self.browser.find_element(
@@ -53,10 +70,8 @@ class StingPharma(BrowserCommon):
     def clearCart(self):
         self.store_temporary_screenshot()
         try:
-            WebDriverWait(self.browser, 2).until(
-                EC.element_to_be_clickable((By.XPATH, SELECTOR_CLEAR_CART))).click()
-            alert = self.browser.switch_to.alert
-            time.sleep(1)
+            self.wait_until("clear_cart", EC.element_to_be_clickable((By.XPATH, SELECTOR_CLEAR_CART)), 2).click()
+            alert = self.wait_until("confirm_alert", EC.alert_is_present(), 1)
             alert.accept()
             self.browser.refresh()
         except Exception as e:
@@ -73,20 +88,38 @@ class StingPharma(BrowserCommon):
         self.browser.find_element(
             By.CSS_SELECTOR, "td.rcbArrowCell.rcbArrowCellRight").click()
         self.store_temporary_screenshot()
-        WebDriverWait(self.browser, 1)\
-            .until(EC.element_to_be_clickable((By.XPATH, "//li[contains(text(),'СП-30 дни, БАНКОВ ПРЕВОД')]"))).click()
+        self.wait_until("choose_channel", EC.element_to_be_clickable((By.XPATH, "//li[contains(text(),'СП-30 дни, БАНКОВ ПРЕВОД')]")), 1).click()
         self.store_temporary_screenshot()
         self.browser.find_element(
             By.CSS_SELECTOR, "td input[type='image']").click()
-        self.clearCart()
+        if not self.keep_cart:
+            self.clearCart()
+        self.record_page_load("search")
+        self._select_contains_search_mode()
 
+    def _select_contains_search_mode(self):
         # Change search method to "contains" instead of "starts-with"
         self.store_temporary_screenshot()
         self.browser.find_element(
             By.XPATH, "//input[starts-with(@value, 'започва с')]").click()
         self.store_temporary_screenshot()
-        WebDriverWait(self.browser, 2)\
-            .until(EC.element_to_be_clickable((By.XPATH, "//ul[@class='rcbList']//li[contains(text(), 'съдържа')]"))).click()
+        self.wait_until("search_mode", EC.element_to_be_clickable((By.XPATH, "//ul[@class='rcbList']//li[contains(text(), 'съдържа')]")), 2).click()
+
+    def get_session_restore_page(self) -> str:
+        return self.DUMMY_PAGE
+
+    def is_session_valid(self) -> bool:
+        try:
+            WebDriverWait(self.browser, 3).until(EC.presence_of_element_located((By.XPATH, self.SEARCH_BOX_XPATH)))
+            return True
+        except Exception:
+            return False
+
+    def on_session_restored(self):
+        # The stored page is the search page with the order channel already chosen
+        if not self.keep_cart:
+            self.clearCart()
+        self._select_contains_search_mode()
 
     def _get_price_header_position(self):
         table_headers = self.browser.find_elements(
@@ -112,11 +145,11 @@ class StingPharma(BrowserCommon):
 
         return -1
 
-    def _get_product_price(self, price_header_position):
-        SELECTOR_PRICE_POSITION = "//table[contains(@id, 'RadGridResult')]//tbody//td[not(contains(@style, 'none'))][" \
+    def _get_product_price(self, price_header_position, row):
+        SELECTOR_PRICE_POSITION = "(./td[not(contains(@style, 'none'))])[" \
             + str(price_header_position) \
             + "]"
-        price_element = self.browser.find_element(
+        price_element = row.find_element(
             By.XPATH, SELECTOR_PRICE_POSITION)
         innerHTML = price_element.get_attribute('innerHTML')
         if innerHTML is None:
@@ -125,9 +158,9 @@ class StingPharma(BrowserCommon):
         logger.info(f'StingPharma:_get_product_price(): returning: {float(innerHTML.strip().replace("&nbsp;", ""))}')
         return float(innerHTML.strip().replace("&nbsp;", ""))
 
-    def _get_product_name(self, name_header_position):
-        name_element = self.browser.find_element(
-            By.XPATH, "(//table[contains(@id, 'RadGridResult')]//tbody//td[not(contains(@style, 'none'))])[3]")
+    def _get_product_name(self, row):
+        name_element = row.find_element(
+            By.XPATH, "(./td[not(contains(@style, 'none'))])[3]")
 
         product_name = name_element.text.strip().replace("&nbsp;", "")
         logger.info(
@@ -135,106 +168,108 @@ class StingPharma(BrowserCommon):
         return product_name
 
     def _search_for_product(self, product_name: str):
+        """
+        Returns the row of the result which matches the product name best, or None
+        """
         logger.info(
             "StingPharma:_search_for_product(): product_name:" + product_name)
-        self._clearSearchResult()
+        self.selectedResultRow = None
+        # The postback renders the grid again, so the new result is told apart from the previous one
+        # by waiting for the previous grid to be detached
+        previous_result = self.find_optional_element(By.XPATH, self.RESULT_GRID_XPATH)
         self.browser.find_element(By.XPATH, self.SEARCH_BOX_XPATH).clear()
         self.browser.find_element(
             By.XPATH, self.SEARCH_BOX_XPATH).send_keys(product_name)
         self.store_temporary_screenshot()
-        self.browser.find_element(By.XPATH, self.SEARCH_BUTTON_XPATH).click()
-        # wait for spinner to appear
-        try:
-            logger.info(
-                "StingPharma:_search_for_product(): Waiting for spinner to appear...")
-            WebDriverWait(self.browser, 2).until(EC.element_to_be_clickable(
-                (By.CSS_SELECTOR, "body > .RadAjax.RadAjax_Vista")))
-        except Exception:
-            logger.info(
-                "StingPharma:_search_for_product(): Spinner didn't appear, assume it's OK")
-        # wait for spinner to dissapear
-        logger.info(
-            "StingPharma:_search_for_product(): Waiting for spinner to disappear...")
-        try:
-            WebDriverWait(self.browser, 10).until_not(EC.element_to_be_clickable(
-                (By.CSS_SELECTOR, "body > .RadAjax.RadAjax_Vista")))
-            time.sleep(0.3)
-        except Exception:
-            logger.info(
-                "StingPharma:_search_for_product(): Spinner didn't disappear, assume it's OK")
+        self._click_search_and_wait("search")
+        if not self.wait_for_replacement("result_refresh", previous_result, 10):
+            logger.error(
+                "StingPharma: The search result wasn't refreshed, so the grid still shows the previous search")
+            raise PriceLookupError(f"The search result for {product_name} wasn't refreshed")
 
         SELECTOR_ADD_QUANTITY = "//div[contains(text(), 'Няма открити артикули.')]|//input[starts-with(@title, 'Добави количеството')]"
         try:
-            element = WebDriverWait(self.browser, 5)\
-                .until(EC.element_to_be_clickable((By.XPATH, SELECTOR_ADD_QUANTITY)))
+            element = self.wait_until("search_result", EC.element_to_be_clickable((By.XPATH, SELECTOR_ADD_QUANTITY)), 5)
         except Exception as e:
             logger.error(
-                "StingPharma: Something went wrong with the search result. Didn't get result in less than 5 seconds")
+                "StingPharma: Something went wrong with the search result. Didn't get result in time")
             logger.error(e)
-            return None
+            raise PriceLookupError(f"The search result for {product_name} didn't come in time")
 
-        number_of_results = len(self.browser.find_elements(
-            By.XPATH, SELECTOR_ADD_QUANTITY))
-        if number_of_results > 1:
-            self.lastSearchWasEmpty = False
-            logger.error(
-                "StingPharma: Too many results were found with the search. For now, we parse this as an invalid search result")
+        if element.tag_name != 'input':
             return None
 
-        if element.tag_name != 'input':
+        rows = self.browser.find_elements(By.XPATH, self.RESULT_ROWS_XPATH)
+        candidate = select_candidate(product_name, [
+            Candidate(self._get_product_name(row), math.inf, row) for row in rows
+        ])
+        if candidate is None:
+            logger.error(
+                f"StingPharma: None of the {len(rows)} results matches the search well enough")
             return None
 
         logger.info(
-            "StingPharma:_search_for_product(): Found product " + product_name)
-        self.lastSearchWasEmpty = False
-        return element
+            "StingPharma:_search_for_product(): Found product " + candidate.name)
+        self.selectedResultRow = candidate.source
+        return self.selectedResultRow
 
-    def _clearSearchResult(self):
-        # no need to clear the search if it's already cleared
-        if self.lastSearchWasEmpty is True:
-            return
-
-        self.lastSearchWasEmpty = True
-        logger.info("StingPharma:_clearSearchResult() - clearing last result")
-        self.browser.find_element(By.XPATH, self.SEARCH_BOX_XPATH).clear()
-        self.browser.find_element(
-            By.XPATH, self.SEARCH_BOX_XPATH).send_keys("IMPOSSIBLE_PRODUCT")
-        self.store_temporary_screenshot()
+    def _click_search_and_wait(self, operation: str):
+        mark = self.mark_activity()
         self.browser.find_element(By.XPATH, self.SEARCH_BUTTON_XPATH).click()
-        # wait for spinner to appear
+        if mark is not None:
+            logger.info(f"StingPharma:_click_search_and_wait(): Waiting for the '{operation}' postback...")
+            self.wait_for_activity_to_settle(operation, mark, 10)
+        else:
+            # The page was loaded without the activity monitor, so fall back to the RadAjax spinner
+            self._wait_for_spinner()
+
+    def _wait_for_spinner(self):
         try:
             logger.info(
-                "StingPharma:_clearSearchResult(): Waiting for spinner to appear...")
+                "StingPharma:_wait_for_spinner(): Waiting for spinner to appear...")
             WebDriverWait(self.browser, 2).until(EC.element_to_be_clickable(
                 (By.CSS_SELECTOR, "body > .RadAjax.RadAjax_Vista")))
+        except Exception:
             logger.info(
-                "StingPharma:_clearSearchResult(): Waiting for spinner to disappear...")
-            WebDriverWait(self.browser, 20).until_not(EC.element_to_be_clickable(
+                "StingPharma:_wait_for_spinner(): Spinner didn't appear, assume it's OK")
+        logger.info(
+            "StingPharma:_wait_for_spinner(): Waiting for spinner to disappear...")
+        try:
+            WebDriverWait(self.browser, 10).until_not(EC.element_to_be_clickable(
                 (By.CSS_SELECTOR, "body > .RadAjax.RadAjax_Vista")))
+            time.sleep(0.3)
         except Exception:
             logger.info(
-                "StingPharma:_search_for_product(): Spinner didn't appear, return None!")
+                "StingPharma:_wait_for_spinner(): Spinner didn't disappear, assume it's OK")
 
     def refresh_page(self):
         self.browser.refresh()
+        self.record_page_load("search")
         # Change search method to "contains" instead of "starts-with"
         try:
             self.store_temporary_screenshot()
-            WebDriverWait(self.browser, 2)\
-                .until(EC.element_to_be_clickable((By.XPATH, "//input[starts-with(@value, 'започва с')]"))).click()
+            self.wait_until("page_load", EC.element_to_be_clickable((By.XPATH, "//input[starts-with(@value, 'започва с')]")), 2).click()
             self.store_temporary_screenshot()
-            WebDriverWait(self.browser, 2)\
-                .until(EC.element_to_be_clickable((By.XPATH, "//ul[@class='rcbList']//li[contains(text(), 'съдържа')]"))).click()
+            self.wait_until(
+                "search_mode", EC.element_to_be_clickable((By.XPATH, "//ul[@class='rcbList']//li[contains(text(), 'съдържа')]")), 2).click()
         except Exception:
             # if self.hasInternetConnection() == False:
             self.refresh_page()
 
     def get_product_name_and_price(self, productSearchNames: list) -> Tuple[str, float]:
+        """
+        Raises PriceLookupError if no name was found and a search of one of them failed
+        """
+        lookup_error: PriceLookupError | None = None
         for productName in productSearchNames:
             logger.info(
                 "StingPharma.get_product_name_and_price(): Searching for product: '" + productName + "'...")
-            element = self._search_for_product(productName)
-            if element is None:
+            try:
+                row = self._search_for_product(productName)
+            except PriceLookupError as e:
+                lookup_error = e
+                continue
+            if row is None:
                 continue
 
             # item found
@@ -242,21 +277,27 @@ class StingPharma(BrowserCommon):
             if price_header_position == -1:
                 logger.error(
                     "StingPharma: Price header position was not found...")
-                return "", math.inf
-            name_header_position = self._get_name_header_position()
+                raise PriceLookupError("The price column of the search result was not found")
 
-            return self._get_product_name(name_header_position), self._get_product_price(price_header_position)
+            return self._get_product_name(row), self._get_product_price(price_header_position, row)
 
+        if lookup_error is not None:
+            raise lookup_error
         return "", math.inf
 
     def add_product_to_cart(self, __product_name: str, quantity: int):
-        self.browser.find_element(
-            By.XPATH, "//td//input[contains(@id, 'QtyResults') and contains(@type, 'text')]").clear()
-        self.browser.find_element(
-            By.XPATH, "//td//input[contains(@id, 'QtyResults') and contains(@type, 'text')]").send_keys(str(quantity))
+        # The row chosen by the last search, the result may have more rows
+        row = self.selectedResultRow
+        if row is None:
+            raise Exception("StingPharma: No search result is selected to add to the cart")
+        row.find_element(
+            By.XPATH, ".//td//input[contains(@id, 'QtyResults') and contains(@type, 'text')]").clear()
+        row.find_element(
+            By.XPATH, ".//td//input[contains(@id, 'QtyResults') and contains(@type, 'text')]").send_keys(str(quantity))
         self.store_temporary_screenshot()
-        self.browser.find_element(
-            By.XPATH, "//input[starts-with(@title, 'Добави количеството')]").click()
+        row.find_element(
+            By.XPATH, ".//input[starts-with(@title, 'Добави количеството')]").click()
+        self.selectedResultRow = None
 
         self.refresh_page()
 
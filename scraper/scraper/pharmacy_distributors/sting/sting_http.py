@@ -0,0 +1,407 @@
+import json
+import logging
+import math
+import re
+import threading
+import time
+from html.parser import HTMLParser
+from typing import Dict, List, Tuple
+from urllib.parse import urljoin
+
+from configuration.common import ScraperConfig
+from pharmacy_distributors.common.browser_common import PriceLookupError
+from pharmacy_distributors.common.candidate_ranking import Candidate, select_candidate
+from pharmacy_distributors.common.http_session import HttpSessionStats, create_pooled_session
+from pharmacy_distributors.sting.sting import StingPharma
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# -*- coding: utf-8 -*-
+
+CHOOSE_CHANNEL_PAGE = "Users/CartChooseChannel.aspx"
+ORDER_CHANNEL_TEXT = "СП-30 дни, БАНКОВ ПРЕВОД"
+SEARCH_MODE_STARTS_WITH_TEXT = "започва с"
+SEARCH_MODE_CONTAINS_TEXT = "съдържа"
+SEARCH_BOX_VALUE_PREFIX = "Име на Артикул"
+SEARCH_BUTTON_TITLE = "Търси"
+ADD_QUANTITY_TITLE_PREFIX = "Добави количеството"
+NO_RESULTS_TEXT = "Няма открити артикули."
+PRICE_HEADER = "Цена с ТО"
+# Matched in lower case against the part of the header text, these columns are only read by the catalog sync
+CODE_HEADER_PART = "код"
+EXPIRY_DATE_HEADER_PART = "годност"
+
+
+class FormField:
+    def __init__(self, name: str, field_type: str, value: str, id: str, title: str):
+        self.name = name
+        self.type = field_type
+        self.value = value
+        self.id = id
+        self.title = title
+
+
+class StingSearchRow:
+    def __init__(self):
+        self.cells: List[str] = []
+        self.has_add_button = False
+
+
+class StingSearchResult:
+    """
+    The visible columns of the RadGridResult table
+    """
+
+    def __init__(self, headers: List[str], rows: List[StingSearchRow]):
+        self.headers = headers
+        # Only the rows which can be added to the cart are search results
+        self.rows = [row for row in rows if row.has_add_button]
+
+    def get_column(self, row: StingSearchRow, header: str) -> str | None:
+        if header not in self.headers:
+            return None
+        position = self.headers.index(header)
+        return row.cells[position] if position < len(row.cells) else None
+
+    def get_name(self, row: StingSearchRow) -> str:
+        # Same cell as StingPharma._get_product_name - the third visible one
+        return row.cells[2] if len(row.cells) > 2 else ""
+
+    def find_column(self, row: StingSearchRow, header_part: str) -> str | None:
+        for header in self.headers:
+            if header_part in header.lower():
+                return self.get_column(row, header)
+        return None
+
+    def get_price(self, row: StingSearchRow) -> float:
+        price = self.get_column(row, PRICE_HEADER)
+        if price is None or price == "":
+            return math.inf
+        return float(price)
+
+
+class AspNetPageParser(HTMLParser):
+    """
+    Collects the form fields, the RadComboBox items and the RadGridResult table of an ASP.NET page
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.fields: List[FormField] = []
+        self.combo_items: Dict[str, List[str]] = {}
+        self.grid_headers: List[str] = []
+        self.grid_rows: List[StingSearchRow] = []
+        self.text_parts: List[str] = []
+
+        self._grid_table_depth = 0
+        self._grid_section = ""
+        self._grid_row: StingSearchRow | None = None
+        self._cell_text: List[str] | None = None
+        self._cell_visible = False
+        self._dropdown_id: str | None = None
+        self._combo_item_text: List[str] | None = None
+        self._select: FormField | None = None
+
+    def handle_starttag(self, tag, attrs):
+        attributes = {name: value or "" for name, value in attrs}
+
+        if tag == "input":
+            field = FormField(attributes.get("name", ""), attributes.get("type", "text").lower(), attributes.get("value", ""),
+                              attributes.get("id", ""), attributes.get("title", ""))
+            # Unchecked checkboxes and radio buttons aren't posted back
+            if field.type not in ("checkbox", "radio") or "checked" in attributes:
+                self.fields.append(field)
+            if self._grid_row is not None and field.title.startswith(ADD_QUANTITY_TITLE_PREFIX):
+                self._grid_row.has_add_button = True
+        elif tag == "select":
+            self._select = FormField(attributes.get("name", ""), "select", "", attributes.get("id", ""), attributes.get("title", ""))
+            self.fields.append(self._select)
+        elif tag == "option" and self._select is not None:
+            if "selected" in attributes or self._select.value == "":
+                self._select.value = attributes.get("value", "")
+        elif tag == "div" and attributes.get("id", "").endswith("_DropDown"):
+            self._dropdown_id = attributes["id"][:-len("_DropDown")]
+            self.combo_items.setdefault(self._dropdown_id, [])
+        elif tag == "li" and self._dropdown_id is not None and "rcbItem" in attributes.get("class", ""):
+            self._combo_item_text = []
+        elif tag == "table":
+            if self._grid_table_depth > 0:
+                self._grid_table_depth += 1
+            elif "RadGridResult" in attributes.get("id", ""):
+                self._grid_table_depth = 1
+        elif self._grid_table_depth == 1:
+            if tag in ("thead", "tbody"):
+                self._grid_section = tag
+            elif tag == "tr" and self._grid_section == "tbody":
+                self._grid_row = StingSearchRow()
+            elif tag in ("th", "td"):
+                self._cell_text = []
+                # Mirrors the `not(contains(@style, 'none'))` condition of the Selenium selectors
+                self._cell_visible = "none" not in attributes.get("style", "")
+
+    def handle_endtag(self, tag):
+        if tag == "select":
+            self._select = None
+        elif tag == "li" and self._combo_item_text is not None and self._dropdown_id is not None:
+            self.combo_items[self._dropdown_id].append("".join(self._combo_item_text).strip())
+            self._combo_item_text = None
+        elif tag == "ul" and self._dropdown_id is not None:
+            self._dropdown_id = None
+        elif tag == "table" and self._grid_table_depth > 0:
+            self._grid_table_depth -= 1
+        elif self._grid_table_depth == 1:
+            if tag in ("th", "td") and self._cell_text is not None:
+                text = "".join(self._cell_text).replace("\xa0", " ").strip()
+                if self._cell_visible:
+                    if tag == "th" and self._grid_section == "thead":
+                        self.grid_headers.append(text)
+                    elif tag == "td" and self._grid_row is not None:
+                        self._grid_row.cells.append(text)
+                self._cell_text = None
+            elif tag == "tr" and self._grid_row is not None:
+                self.grid_rows.append(self._grid_row)
+                self._grid_row = None
+            elif tag in ("thead", "tbody"):
+                self._grid_section = ""
+
+    def handle_data(self, data):
+        self.text_parts.append(data)
+        if self._cell_text is not None:
+            self._cell_text.append(data)
+        if self._combo_item_text is not None:
+            self._combo_item_text.append(data)
+
+
+class AspNetPage:
+    def __init__(self, url: str, html: str):
+        self.url = url
+        self.html = html
+        parser = AspNetPageParser()
+        parser.feed(html)
+        parser.close()
+        self.fields = parser.fields
+        self.combo_items = parser.combo_items
+        self.search_result = StingSearchResult(parser.grid_headers, parser.grid_rows)
+        self.has_no_results_message = NO_RESULTS_TEXT in "".join(parser.text_parts)
+
+    def find_field(self, predicate) -> FormField | None:
+        for field in self.fields:
+            if predicate(field):
+                return field
+        return None
+
+    def is_login_page(self) -> bool:
+        return self.find_field(lambda field: field.id == "Login1_Password") is not None
+
+    def get_combo_item_value(self, combo_id: str, item_text: str) -> str:
+        """
+        Telerik keeps the item values in the `itemData` of the combo's client side initialization script
+        """
+        item_texts = self.combo_items.get(combo_id, [])
+        match = re.search(r'"itemData":(\[.*?\])[^$]*?\$get\("' + re.escape(combo_id) + r'"\)', self.html, re.DOTALL)
+        if item_text in item_texts and match is not None:
+            try:
+                item_data = json.loads(match.group(1))
+                position = item_texts.index(item_text)
+                if position < len(item_data) and "value" in item_data[position]:
+                    return str(item_data[position]["value"])
+            except json.JSONDecodeError:
+                pass
+        return item_text
+
+
+class StingHttpClient:
+    """
+    Drives the Sting web shop with plain HTTP postbacks - the same steps StingPharma does in the browser
+    """
+
+    def __init__(self, login_page: str, username: str, password: str):
+        self.login_page = login_page
+        self.username = username
+        self.password = password
+        self.session = create_pooled_session()
+        self.stats = HttpSessionStats()
+        self.search_page: AspNetPage | None = None
+        # The ViewState of the search page changes with every postback, so searches run one at a time
+        self.lock = threading.Lock()
+
+    def _request(self, method: str, url: str, data: Dict[str, str] | None = None) -> AspNetPage:
+        started_at = time.monotonic()
+        http_response = self.session.request(method, url, data=data, timeout=ScraperConfig.HTTP_TIMEOUT_SECONDS)
+        self.stats.record_response(http_response, started_at)
+        http_response.raise_for_status()
+        return AspNetPage(http_response.url, http_response.text)
+
+    def _postback(self, page: AspNetPage, values: Dict[str, str], submit: FormField | None) -> AspNetPage:
+        data: Dict[str, str] = {}
+        for field in page.fields:
+            if field.name == "" or field.type in ("submit", "image", "button", "reset"):
+                continue
+            data[field.name] = field.value
+        data.update(values)
+        if submit is not None:
+            if submit.type == "image":
+                data[submit.name + ".x"] = "1"
+                data[submit.name + ".y"] = "1"
+            else:
+                data[submit.name] = submit.value
+        return self._request("POST", page.url, data)
+
+    @staticmethod
+    def _set_telerik_value(page: AspNetPage, values: Dict[str, str], field: FormField, text: str, value: str | None = None):
+        """
+        Telerik controls read the posted value from their `<id>_ClientState` JSON field
+        """
+        values[field.name] = text
+        client_state_field = page.find_field(lambda candidate: candidate.id == field.id + "_ClientState")
+        if client_state_field is None or client_state_field.value == "":
+            return
+        try:
+            client_state = json.loads(client_state_field.value)
+        except json.JSONDecodeError:
+            return
+        for key in ("validationText", "valueAsString", "lastSetTextBoxValue", "text"):
+            if key in client_state:
+                client_state[key] = text
+        if "value" in client_state:
+            client_state["value"] = value if value is not None else text
+        values[client_state_field.name] = json.dumps(client_state, ensure_ascii=False)
+
+    def login(self):
+        logger.info("StingHttpClient: Logging in...")
+        page = self._request("GET", self.login_page)
+        username_field = page.find_field(lambda field: field.id == "Login1_UserName")
+        password_field = page.find_field(lambda field: field.id == "Login1_Password")
+        if username_field is None or password_field is None:
+            raise Exception("StingHttpClient: Login form was not found")
+        submit = page.find_field(lambda field: field.name.startswith("Login1$") and field.type in ("submit", "image"))
+        page = self._postback(page, {username_field.name: self.username, password_field.name: self.password}, submit)
+        if page.is_login_page():
+            raise Exception("StingHttpClient: Login failed")
+
+    def prepare_for_order(self):
+        logger.info("StingHttpClient: Choosing the order channel...")
+        page = self._request("GET", urljoin(self.login_page, CHOOSE_CHANNEL_PAGE))
+        values: Dict[str, str] = {}
+        for combo_id, item_texts in page.combo_items.items():
+            if ORDER_CHANNEL_TEXT in item_texts:
+                combo_field = page.find_field(lambda field: field.id == combo_id + "_Input" or field.id == combo_id)
+                if combo_field is not None:
+                    self._set_telerik_value(page, values, combo_field, ORDER_CHANNEL_TEXT,
+                                            page.get_combo_item_value(combo_id, ORDER_CHANNEL_TEXT))
+        submit = page.find_field(lambda field: field.type == "image")
+        page = self._postback(page, values, submit)
+        if page.find_field(lambda field: field.value.startswith(SEARCH_BOX_VALUE_PREFIX)) is None:
+            raise Exception("StingHttpClient: Search page was not opened after choosing the order channel")
+        self.search_page = page
+
+    def search(self, product_name: str) -> AspNetPage:
+        with self.lock:
+            page = self._search(product_name)
+            if page.is_login_page():
+                logger.info("StingHttpClient: Session has expired, logging in again")
+                self.login()
+                self.prepare_for_order()
+                page = self._search(product_name)
+            self.search_page = page
+            return page
+
+    def _search(self, product_name: str) -> AspNetPage:
+        page = self.search_page
+        if page is None:
+            raise Exception("StingHttpClient: Search page is not opened")
+
+        values: Dict[str, str] = {}
+        search_box = page.find_field(lambda field: field.value.startswith(SEARCH_BOX_VALUE_PREFIX))
+        if search_box is None:
+            raise Exception("StingHttpClient: Search box was not found")
+        self._set_telerik_value(page, values, search_box, product_name)
+
+        # Search with "contains" instead of "starts-with"
+        search_mode = page.find_field(lambda field: field.value == SEARCH_MODE_STARTS_WITH_TEXT)
+        if search_mode is not None:
+            combo_id = search_mode.id[:-len("_Input")] if search_mode.id.endswith("_Input") else search_mode.id
+            self._set_telerik_value(page, values, search_mode, SEARCH_MODE_CONTAINS_TEXT,
+                                    page.get_combo_item_value(combo_id, SEARCH_MODE_CONTAINS_TEXT))
+
+        search_button = page.find_field(lambda field: SEARCH_BUTTON_TITLE in field.title)
+        return self._postback(page, values, search_button)
+
+
+class StingPharmaHttp(StingPharma):
+    """
+    Runs the product searches over HTTP instead of typing them in the browser.
+    The browser is still used for the cart - add_product_to_cart searches for the chosen product there first.
+    """
+    # Searches don't touch the browser, so they can run ahead of the cart updates
+    stateless_price_lookup = True
+
+    def __init__(self, pharmacyID: str, shouldInitBrowser=True):
+        super().__init__(pharmacyID, shouldInitBrowser)
+        try:
+            self.http_client = StingHttpClient(self.LOGIN_PAGE, self.user, self.password)
+        except Exception:
+            # The caller never gets the scraper, so it can't give the browser back to the pool
+            self.finish()
+            raise
+
+    def login(self):
+        if self.browser is not None:
+            super().login()
+        self.http_client.login()
+
+    def prepare_for_order(self):
+        if self.browser is not None:
+            super().prepare_for_order()
+        self.http_client.prepare_for_order()
+
+    def on_session_restored(self):
+        super().on_session_restored()
+        self.http_client.login()
+        self.http_client.prepare_for_order()
+
+    def get_product_name_and_price(self, productSearchNames: list) -> Tuple[str, float]:
+        for productName in productSearchNames:
+            logger.info(
+                "StingPharmaHttp.get_product_name_and_price(): Searching for product: '" + productName + "'...")
+            try:
+                page = self.http_client.search(productName)
+            except Exception as e:
+                # A timeout, an error response or a login that failed, the product may still be sold
+                raise PriceLookupError(f"The search for {productName} failed: {e}") from e
+            search_result = page.search_result
+            if page.has_no_results_message or len(search_result.rows) == 0:
+                continue
+            if PRICE_HEADER not in search_result.headers:
+                logger.error("StingPharmaHttp: Price header position was not found...")
+                raise PriceLookupError("The price column of the search result was not found")
+
+            candidate = select_candidate(productName, [
+                Candidate(search_result.get_name(row), search_result.get_price(row), row) for row in search_result.rows
+            ])
+            if candidate is None:
+                logger.error(
+                    f"StingPharmaHttp: None of the {len(search_result.rows)} results matches the search well enough")
+                continue
+            logger.info(f"StingPharmaHttp: Found product {candidate.name} with price {candidate.price}")
+            return candidate.name, candidate.price
+
+        return "", math.inf
+
+    def add_product_to_cart(self, product_name: str, quantity: int):
+        logger.info("StingPharmaHttp: Adding product to cart: " + product_name + ", quantity: " + str(quantity))
+        # The search result in the browser is what the cart update works on
+        try:
+            row = self._search_for_product(product_name)
+        except PriceLookupError as e:
+            logger.error(f"StingPharmaHttp: The search in the browser failed: {e}")
+            row = None
+        if row is None:
+            logger.error("StingPharmaHttp: Product was not found in the browser: " + product_name)
+            return False
+        return super().add_product_to_cart(product_name, quantity)
+
+    def get_http_stats(self) -> dict | None:
+        return self.http_client.stats.to_json()
@@ -0,0 +1,63 @@
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# How often a task waiting for a cart checks whether the worker is shutting down
+WAIT_POLL_SECONDS = 1.0
+
+
+class AccountLocks:
+    """
+    One lock per pharmacy and distributor, so tasks running at the same time never fill the same distributor cart.
+    A task takes the locks of all its distributors in sorted order, so two tasks can't wait for each other
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(AccountLocks, cls).__new__(cls)
+                    cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self.locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self.locks_lock = threading.Lock()
+
+    @staticmethod
+    def get_keys(pharmacy_id: str, distributors: List[str]) -> List[Tuple[str, str]]:
+        return sorted({(str(pharmacy_id), str(distributor)) for distributor in distributors})
+
+    def _get_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self.locks_lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    def acquire(self, pharmacy_id: str, distributors: List[str], shutdown_event: threading.Event | None = None) -> bool:
+        """
+        Waits for the carts of all distributors. Returns False without holding any lock if the shutdown started meanwhile
+        """
+        acquired_keys: List[Tuple[str, str]] = []
+        for key in self.get_keys(pharmacy_id, distributors):
+            lock = self._get_lock(key)
+            if not lock.acquire(blocking=False):
+                logger.info(f"AccountLocks: Waiting for the cart of {key[1]} of pharmacy {key[0]}")
+                while not lock.acquire(timeout=WAIT_POLL_SECONDS):
+                    if shutdown_event is not None and shutdown_event.is_set():
+                        self._release_keys(acquired_keys)
+                        return False
+            acquired_keys.append(key)
+        return True
+
+    def release(self, pharmacy_id: str, distributors: List[str]):
+        self._release_keys(self.get_keys(pharmacy_id, distributors))
+
+    def _release_keys(self, keys: List[Tuple[str, str]]):
+        for key in reversed(keys):
+            self._get_lock(key).release()
@@ -2,16 +2,30 @@ import json
 import logging
 import math
 import os
-from typing import List
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import nullcontext
+from typing import Deque, Dict, List, Tuple
 
 from selenium.common.exceptions import StaleElementReferenceException
-from messaging.messaging import ScraperTaskItem
-from pharmacy_distributors.common.browser_common import BrowserCommon
+from configuration.common import ScraperConfig
+from catalog.catalog_store import CatalogStore
+from dal.price_cache import PriceCache
+from dal.task_checkpoints import RowCheckpoint, TaskCheckpointStore
+from dal.task_shards import PricedRow, TaskShard, TaskShardStore
+from messaging.messaging import ScraperTaskActionType, ScraperTaskItem
+from pharmacy_distributors.common.browser_common import BrowserCommon, PriceLookupError
 from pharmacy_distributors.sting.sting import StingPharma
+from pharmacy_distributors.sting.sting_http import StingPharmaHttp
 from pharmacy_distributors.phoenix.phoenix_optimized import PhoenixPharmaOptimized
-from files.file_worker import FileWorker, RowInfo
+from files.file_worker import FileWorker, RowInfo, WorkerProgress
 from files.file_worker_factory import FileWorkerFactory
 from files.azure_blob_client import AzureBlobClient
+from files.report_exporter import ReportExporter
+from files.product_name_normalizer import get_cache_info as get_normalizer_cache_info
+from task_handler.task_shards import ShardCoordinator
 from task_handler.task_update_publisher import TaskUpdatePublisher
 from psa_logger.logger import get_current_logfile_name, get_current_logfile_data
 
@@ -20,10 +34,15 @@ logger = logging.getLogger(__name__)
 
 
 class ProductInfo:
-    def __init__(self, scraper: BrowserCommon, name: str, price: float):
+    def __init__(self, scraper: BrowserCommon, name: str, price: float, preliminary: bool = False):
+        """
+        :param preliminary: True if the price wasn't looked up on the live site (e.g. it came from the price cache)
+            and has to be confirmed before the product is added to the cart
+        """
         self.scraper = scraper
         self.name = name
         self.price = price
+        self.preliminary = preliminary
 
         if self.scraper is None:
             raise ValueError("Scraper must not be None")
@@ -86,54 +105,125 @@ class UnboughtProductInfo:
 
 
 class TaskReport:
-    def __init__(self, bought_products: List[BoughtProductInfo], unbought_products: List[UnboughtProductInfo]):
+    def __init__(self, bought_products: List[BoughtProductInfo], unbought_products: List[UnboughtProductInfo],
+                 report_file_url: str | None = None):
         self.bought_products = bought_products
         self.unbought_products = unbought_products
+        self.report_file_url = report_file_url
 
     def __dict__(self):
         return {
             "bought_products": [bought_product.__dict__() for bought_product in self.bought_products],
-            "unbought_products": [unbought_product.__dict__() for unbought_product in self.unbought_products]
+            "unbought_products": [unbought_product.__dict__() for unbought_product in self.unbought_products],
+            "report_file_url": self.report_file_url
         }
 
 
+class TaskInterruptedError(Exception):
+    """
+    The worker is shutting down, the task continues from its checkpoints when the message is delivered again
+    """
+    pass
+
+
+class PendingRow:
+    """
+    A row read from the input file, whose prices may already be looked up on the stateless scrapers
+    """
+
+    def __init__(self, row_info: RowInfo, progress: WorkerProgress, prefetched_scrapers: List[BrowserCommon],
+                 prefetched_prices: Future | None):
+        self.row_info = row_info
+        self.progress = progress
+        self.prefetched_scrapers = prefetched_scrapers
+        self.prefetched_prices = prefetched_prices
+
+
 class TaskHandler:
-    def __init__(self, taskItem: ScraperTaskItem):
+    def __init__(self, taskItem: ScraperTaskItem, shutdown_event: threading.Event | None = None, delivery_count: int = 1,
+                 task_update_publisher: TaskUpdatePublisher | None = None):
+        """
+        :param shutdown_event: Once set, the task stops before the next row and keeps its checkpoints
+        :param delivery_count: A message delivered more than once belongs to a task that was interrupted, so it is resumed
+        :param task_update_publisher: The publisher shared by the tasks of the worker, the task opens its own if None
+        """
+        # The task closes only a publisher it opened itself
+        self.owns_task_update_publisher = task_update_publisher is None
+        self.task_update_publisher = task_update_publisher if task_update_publisher is not None else TaskUpdatePublisher()
+        # A price shard only looks up prices for the task that sent it, the updates of the task come from that task
+        self.is_price_shard = taskItem.task_type == ScraperTaskActionType.PRICE_SHARD
+        self.scrapers: List[BrowserCommon] = []
         try:
             self.taskItem = taskItem
+            self.shutdown_event = shutdown_event
+            self.is_resumed = taskItem.task_type == ScraperTaskActionType.RESUME or delivery_count > 1
             self.file_worker: FileWorker = FileWorkerFactory(
                 taskItem.file_type).get_file_worker()
-            self.task_update_publisher = TaskUpdatePublisher()
             self.scrapers = self._get_scrapers()
+            # One worker per scraper, so every distributor is searched at the same time
+            self.price_lookup_executor = ThreadPoolExecutor(
+                max_workers=max(1, len(self.scrapers)), thread_name_prefix="price-lookup")
+            # Looks up prices of the upcoming rows while the current one is being added to the cart
+            self.lookahead_executor = ThreadPoolExecutor(
+                max_workers=max(1, ScraperConfig.LOOKAHEAD_WINDOW), thread_name_prefix="price-lookahead")
+            self.price_cache = PriceCache()
             self.bought_products: List[BoughtProductInfo] = []
             self.unbought_products: List[UnboughtProductInfo] = []
+            # The Excel report is written while the rows are decided, so it doesn't grow in memory with the order
+            self.report_exporter = ReportExporter([scraper.get_name() for scraper in self.scrapers])
+            self.checkpoint_store = TaskCheckpointStore(taskItem.id)
+            # The decisions of the previous runs, by row number. Rows are taken out as they are restored
+            self.checkpoints: Dict[int, RowCheckpoint] = {}
+            # Set if the rows of a large task are priced by other workers as well
+            self.shard_coordinator: ShardCoordinator | None = None
+            # The number of rows read from the input file, checkpointed and duplicate rows aren't skipped
+            self.read_row_count = 0
         except Exception as e:
             logger.error(
                 "TaskHandler: Couldn't initialize the task handler: ", e)
-            self.task_update_publisher.publish_error(
-                self.taskItem.account_id,
-                self.taskItem.id,
-                "Couldn't initialize the task handler",
-                str(e),
-                0)
+            if not self.is_price_shard:
+                self.task_update_publisher.publish_error(
+                    self.taskItem.account_id,
+                    self.taskItem.id,
+                    "Couldn't initialize the task handler",
+                    str(e),
+                    0)
+            # The leased browsers go back to the pool, handle_task won't run to finish them
+            self._finish_scrapers()
+            self._close_task_update_publisher()
             raise e
 
-    def handle_task(self):
+    def handle_task(self) -> bool:
+        """
+        Returns False if the task was interrupted by the shutdown and should be delivered again
+        """
         logger.info(f"Handling task: {self.taskItem.to_json()}")
+        if self.is_price_shard:
+            return self._price_shard()
+        succeeded = False
         try:
             self._open_and_validate_input_file()
+            self._load_checkpoints()
+            self._start_shards()
             for scraper in self.scrapers:
-                scraper.login()
-                scraper.prepare_for_order()
+                # Without checkpoints every row is processed again, so the cart starts empty as well
+                scraper.open_session(self.taskItem.pharmacy_id, keep_cart=len(self.checkpoints) > 0)
 
             self._work_loop()
+            self._log_scraper_stats()
 
+            report = self._generate_report()
+            report.report_file_url = self._upload_report_file()
             self.task_update_publisher.publish_success(
                 account_id=self.taskItem.account_id,
                 task_id=self.taskItem.id,
                 message="Задачата приключи успешно!",
                 progress=100,
-                report=self._generate_report().__dict__())
+                report=report.__dict__())
+            succeeded = True
+        except TaskInterruptedError as e:
+            logger.warning(f"TaskHandler: {e}")
+            return False
         except Exception as e:
             logger.exception(f"TaskHandler: Failed to handle the task: {str(e)}")
             blob_client = AzureBlobClient()
@@ -161,22 +251,182 @@ class TaskHandler:
                 str(e) if str(e).strip() != "" else str(e.__traceback__),
                 0,
                 image_urls=image_urls)
+        finally:
+            # A failed task can be resumed as well, so its last decisions are kept too
+            self.checkpoint_store.flush()
+            if self.shard_coordinator is not None:
+                self.shard_coordinator.finish(succeeded)
+            self.price_lookup_executor.shutdown(wait=False, cancel_futures=True)
+            self.lookahead_executor.shutdown(wait=False, cancel_futures=True)
+            self._finish_scrapers()
+            self._close_report_exporter()
+            self._close_task_update_publisher()
+        return True
+
+    def _start_shards(self):
+        shard_coordinator = ShardCoordinator(self.taskItem, self.shutdown_event)
+        if shard_coordinator.start():
+            self.shard_coordinator = shard_coordinator
+
+    def _price_shard(self) -> bool:
+        """
+        Looks up the prices of the rows of a shard of another task, without touching the carts.
+        Returns False if the shard was interrupted by the shutdown and should be delivered again
+        """
+        shard = TaskShard.from_message(self.taskItem.id, self.taskItem.shard or {})
+        shard_store = TaskShardStore(self.taskItem.id)
+        try:
+            if not shard_store.start(shard):
+                logger.info(f"TaskHandler: {shard} was cancelled or is done, skipping it")
+                return True
+            logger.info(f"TaskHandler: Pricing {shard}")
+            self.file_worker.open_file(self.taskItem.file_data)
+            self.file_worker.validate_input()
+            for scraper in self.scrapers:
+                # The task that sent the shard is filling the carts meanwhile
+                scraper.open_session(self.taskItem.pharmacy_id, keep_cart=True)
+
+            priced_rows: List[PricedRow] = []
+            for row_index, row_info in self._read_shard_rows(shard):
+                if self.shutdown_event is not None and self.shutdown_event.is_set():
+                    raise TaskInterruptedError(f"The worker is shutting down, {shard} stops after {len(priced_rows)} rows")
+                product_infos = self._get_all_prices(row_info.product_name_variations)
+                priced_rows.append(PricedRow(
+                    row_index,
+                    row_info.original_product_name,
+                    [(product_info.scraper.get_name(), product_info.name, product_info.price) for product_info in product_infos]))
+                if len(priced_rows) % max(1, ScraperConfig.Sharding.PROGRESS_ROWS) == 0 \
+                        and not shard_store.report_progress(shard, len(priced_rows)):
+                    logger.info(f"TaskHandler: {shard} was cancelled after {len(priced_rows)} rows")
+                    return True
+
+            if shard_store.finish(shard, priced_rows):
+                logger.info(f"TaskHandler: Priced {len(priced_rows)} rows of {shard}")
+            else:
+                logger.warning(f"TaskHandler: {shard} was cancelled before its {len(priced_rows)} rows were stored")
+            self._log_scraper_stats()
+        except TaskInterruptedError as e:
+            logger.warning(f"TaskHandler: {e}")
+            return False
+        except Exception as e:
+            # The task that sent the shard prices the rows itself
+            logger.exception(f"TaskHandler: Failed to price {shard}: {str(e)}")
+            shard_store.fail(shard)
+        finally:
+            self.price_lookup_executor.shutdown(wait=False, cancel_futures=True)
+            self.lookahead_executor.shutdown(wait=False, cancel_futures=True)
+            self._finish_scrapers()
+            self._close_report_exporter()
+            self._close_task_update_publisher()
+        return True
+
+    def _read_shard_rows(self, shard: TaskShard) -> List[Tuple[int, RowInfo]]:
+        """
+        The rows of the shard with their index, counted the same way as _read_next_row counts them
+        """
+        rows: List[Tuple[int, RowInfo]] = []
+        row_index = 0
+        while row_index < shard.first_row + shard.row_count:
+            row_info: RowInfo = self.file_worker.get_next_row()
+            if row_info.product_name_variations is None or row_info.product_quantity is None:
+                break
+            if shard.contains(row_index):
+                rows.append((row_index, row_info))
+            row_index += 1
+        return rows
+
+    def _close_task_update_publisher(self):
+        if self.owns_task_update_publisher:
+            self.task_update_publisher.close()
+
+    def _load_checkpoints(self):
+        if not self.is_resumed:
+            # The task starts over, decisions of an earlier run of the same task must not be replayed
+            self.checkpoint_store.clear()
             return
+        self.checkpoints = self.checkpoint_store.load()
+        logger.info(f"TaskHandler: Resuming the task, {len(self.checkpoints)} rows were already processed")
+
+    def _restore_checkpoint(self, checkpoint: RowCheckpoint):
+        """
+        Puts the decision of a previous run in the report, the product is already in the cart if it was bought
+        """
+        logger.info(f"TaskHandler: Restoring row {checkpoint.row_number}: {checkpoint}")
+        if not checkpoint.is_bought():
+            self._store_unbought_product(checkpoint.original_product_name, checkpoint.quantity)
+            return
+        self._store_bought_product(
+            checkpoint.original_product_name, self._get_product_infos(checkpoint.offers), str(checkpoint.bought_from_distributor))
+
+    def _get_product_infos(self, offers: List[Tuple[str, str, float]], preliminary: bool = False) -> List[ProductInfo]:
+        """
+        The (distributor, product name, price) offers of the task's distributors, in the order of the distributors
+        """
+        scrapers_by_name = {scraper.get_name(): scraper for scraper in self.scrapers}
+        product_infos = [
+            ProductInfo(scrapers_by_name[distributor], name, price, preliminary)
+            for distributor, name, price in offers if distributor in scrapers_by_name
+        ]
+        product_infos.sort(key=lambda product_info: self.scrapers.index(product_info.scraper))
+        return product_infos
+
+    def _upload_report_file(self) -> str | None:
+        """
+        The JSON report is published even if the Excel report couldn't be uploaded
+        """
+        file_name, _ = os.path.splitext(os.path.basename(self.taskItem.file_name or "task"))
+        try:
+            return self.report_exporter.upload(f"{self.taskItem.id}_{file_name}_Report.xlsx")
+        except Exception as e:
+            logger.error(f"TaskHandler: Couldn't upload the Excel report: {e}")
+            return None
+
+    def _close_report_exporter(self):
+        try:
+            self.report_exporter.close()
+        except Exception as e:
+            logger.error(f"TaskHandler: Couldn't close the Excel report: {e}")
+
+    def _log_scraper_stats(self):
+        for scraper in self.scrapers:
+            http_stats = scraper.get_http_stats()
+            if http_stats is not None:
+                logger.info(f"TaskHandler: HTTP stats of {scraper.get_name()}: {http_stats}")
+            logger.info(f"TaskHandler: Browser wait latencies of {scraper.get_name()}: {scraper.get_wait_stats()}")
+            logger.info(f"TaskHandler: Screenshot costs of {scraper.get_name()}: {scraper.get_screenshot_stats()}")
+            logger.info(f"TaskHandler: Page loads of {scraper.get_name()}: {scraper.get_page_load_stats()}")
+        logger.info(f"TaskHandler: Product name normalizer memo: {get_normalizer_cache_info()}")
 
     def _get_scrapers(self) -> List[BrowserCommon]:
         scrapers: List[BrowserCommon] = []
 
-        for distributor in self.taskItem.distributors:
-            if distributor == "sting":
-                logger.info("TaskHandler: Handling task for Sting")
-                scrapers.append(StingPharma(self.taskItem.pharmacy_id))
-            elif distributor == "phoenix":
-                logger.info("TaskHandler: Handling task for Phoenix")
-                scrapers.append(PhoenixPharmaOptimized(
-                    self.taskItem.pharmacy_id))
+        try:
+            for distributor in self.taskItem.distributors:
+                if distributor == "sting":
+                    logger.info("TaskHandler: Handling task for Sting")
+                    if ScraperConfig.STING_HTTP_SEARCH:
+                        scrapers.append(StingPharmaHttp(self.taskItem.pharmacy_id))
+                    else:
+                        scrapers.append(StingPharma(self.taskItem.pharmacy_id))
+                elif distributor == "phoenix":
+                    logger.info("TaskHandler: Handling task for Phoenix")
+                    scrapers.append(PhoenixPharmaOptimized(
+                        self.taskItem.pharmacy_id))
+        except Exception:
+            # Give the already leased browsers back to the pool
+            for scraper in scrapers:
+                scraper.finish()
+            raise
 
         return scrapers
 
+    def _finish_scrapers(self):
+        for scraper in self.scrapers:
+            try:
+                scraper.finish()
+            except Exception as e:
+                logger.error(f"TaskHandler: Couldn't finish {scraper.get_name()}: {e}")
+
     def _open_and_validate_input_file(self):
         try:
             self.file_worker.open_file(self.taskItem.file_data)
@@ -204,6 +454,60 @@ class TaskHandler:
 
     def _work_loop(self):
         progress_percent = 0
+        lookahead_window = max(0, ScraperConfig.LOOKAHEAD_WINDOW)
+        # Only scrapers whose lookups don't disturb their cart can be searched ahead of the current row
+        prefetch_scrapers = [scraper for scraper in self.scrapers if scraper.stateless_price_lookup] if lookahead_window > 0 else []
+        pending_rows: Deque[PendingRow] = deque()
+        no_more_rows = False
+        # The rows of the shards are already being priced, so they aren't priced again in a batch
+        if ScraperConfig.BATCH_PRICE_LOOKUP and len(prefetch_scrapers) > 0 and self.shard_coordinator is None:
+            pending_rows = self._read_all_rows_with_batch_prices(prefetch_scrapers)
+            no_more_rows = True
+        while True:
+            while not no_more_rows and len(pending_rows) <= lookahead_window:
+                pending_row = self._read_next_row(progress_percent, prefetch_scrapers)
+                if pending_row is None:
+                    no_more_rows = True
+                else:
+                    pending_rows.append(pending_row)
+            if len(pending_rows) == 0:
+                break
+            if self.shutdown_event is not None and self.shutdown_event.is_set():
+                # The decided rows are flushed by handle_task, the pending ones are processed again on resume
+                raise TaskInterruptedError(
+                    f"The worker is shutting down, the task stops before row {pending_rows[0].row_info.row_number}")
+
+            # Rows are added to the cart strictly in input order
+            pending_row = pending_rows.popleft()
+            progress = pending_row.progress
+            progress_percent = self._publish_progress(progress)
+
+            self.buy_lowest_price_for_product(
+                progress.original_product_name,
+                pending_row.row_info.product_name_variations,
+                pending_row.row_info.product_quantity,
+                pending_row)
+
+    def _publish_progress(self, progress: WorkerProgress) -> int:
+        """
+        For a task priced by other workers as well, pricing their rows and deciding every row both count as work
+        """
+        progress_json = progress.to_json()
+        progress_percent = math.floor(progress.current_input_row / progress.total_number_of_rows * 100)
+        if self.shard_coordinator is not None:
+            priced_row_count, shard_row_count = self.shard_coordinator.get_priced_row_counts()
+            progress_json["shards_priced_rows"] = priced_row_count
+            progress_json["shards_total_rows"] = shard_row_count
+            progress_percent = math.floor(
+                (progress.current_input_row + priced_row_count) / (progress.total_number_of_rows + shard_row_count) * 100)
+        self.task_update_publisher.publish_progress_update(
+            self.taskItem.account_id,
+            self.taskItem.id,
+            json.dumps(progress_json),
+            progress_percent)
+        return progress_percent
+
+    def _read_next_row(self, progress_percent: int, prefetch_scrapers: List[BrowserCommon]) -> PendingRow | None:
         while True:
             try:
                 row_info: RowInfo = self.file_worker.get_next_row()
@@ -215,59 +519,211 @@ class TaskHandler:
             if row_info.product_name_variations is None or row_info.product_quantity is None:
                 logger.info(
                     f"TaskHandler: No more rows to process: {row_info}")
-                break
+                return None
+            row_index = self.read_row_count
+            self.read_row_count += 1
 
-            progress = self.file_worker.get_progress()
-            progress_percent = math.floor(
-                progress.current_input_row / progress.total_number_of_rows * 100)
-            self.task_update_publisher.publish_progress_update(
-                self.taskItem.account_id,
-                self.taskItem.id,
-                json.dumps(progress.to_json()),
-                progress_percent)
-
-            self.buy_lowest_price_for_product(
-                progress.original_product_name, row_info.product_name_variations, row_info.product_quantity)
+            checkpoint = self.checkpoints.pop(row_info.row_number, None) if row_info.row_number is not None else None
+            if checkpoint is None:
+                break
+            if checkpoint.original_product_name != row_info.original_product_name:
+                logger.warning(f"TaskHandler: The checkpoint of row {row_info.row_number} is for another product, processing the row again")
+                break
+            self._restore_checkpoint(checkpoint)
+
+        if self.shard_coordinator is not None:
+            shard_offers = self.shard_coordinator.get_row_offers(
+                row_index, row_info.original_product_name, lambda: self._publish_progress(self.file_worker.get_progress()))
+            if shard_offers is not None:
+                # The best of these prices is confirmed on the live site before the product is bought
+                shard_prices: Future = Future()
+                shard_prices.set_result(self._get_product_infos(shard_offers, preliminary=True))
+                return PendingRow(row_info, self.file_worker.get_progress(), self.scrapers, shard_prices)
+
+        prefetched_prices = None
+        if len(prefetch_scrapers) > 0:
+            prefetched_prices = self.lookahead_executor.submit(
+                self._get_all_prices, row_info.product_name_variations, prefetch_scrapers, False)
+        return PendingRow(row_info, self.file_worker.get_progress(), prefetch_scrapers, prefetched_prices)
+
+    def _read_all_rows_with_batch_prices(self, prefetch_scrapers: List[BrowserCommon]) -> Deque[PendingRow]:
+        """
+        Reads the whole input file and prices it on the stateless scrapers in one batch per scraper
+        """
+        pending_rows: Deque[PendingRow] = deque()
+        while True:
+            pending_row = self._read_next_row(0, [])
+            if pending_row is None:
+                break
+            pending_rows.append(pending_row)
+
+        rows_product_infos: List[List[ProductInfo]] = [[] for _ in pending_rows]
+        for scraper in prefetch_scrapers:
+            scraper_product_infos = self._get_batch_prices(
+                scraper, [pending_row.row_info.product_name_variations for pending_row in pending_rows])
+            for row_product_infos, product_info in zip(rows_product_infos, scraper_product_infos):
+                if product_info is not None:
+                    row_product_infos.append(product_info)
+
+        for pending_row, row_product_infos in zip(pending_rows, rows_product_infos):
+            prefetched_prices: Future = Future()
+            prefetched_prices.set_result(row_product_infos)
+            pending_row.prefetched_scrapers = prefetch_scrapers
+            pending_row.prefetched_prices = prefetched_prices
+        return pending_rows
+
+    def _get_batch_prices(self, scraper: BrowserCommon, productSearchNamesList: List[list]) -> List[ProductInfo | None]:
+        result: List[ProductInfo | None] = [None] * len(productSearchNamesList)
+        uncached_indexes: List[int] = []
+        for index, productSearchNames in enumerate(productSearchNamesList):
+            cached_price = self.price_cache.get(scraper.get_name(), self.taskItem.pharmacy_id, productSearchNames)
+            if cached_price is None:
+                uncached_indexes.append(index)
+            elif cached_price.is_found():
+                result[index] = ProductInfo(scraper, cached_price.product_name, cached_price.price, preliminary=True)
+
+        logger.info(f"TaskHandler: Batch pricing {len(uncached_indexes)} uncached products on {scraper.get_name()}")
+        names_and_prices = scraper.get_prices_for_many([productSearchNamesList[index] for index in uncached_indexes])
+        for index, name_and_price in zip(uncached_indexes, names_and_prices):
+            if name_and_price is None:
+                # The lookup failed, the row is priced on its own later
+                continue
+            name, price = name_and_price
+            self.price_cache.put(scraper.get_name(), self.taskItem.pharmacy_id, productSearchNamesList[index], name, price)
+            if price != math.inf:
+                result[index] = ProductInfo(scraper, name, price)
+        return result
 
-    def buy_lowest_price_for_product(self, productName: str, productSearchNames: list, quantity: int):
+    def buy_lowest_price_for_product(self, productName: str, productSearchNames: list, quantity: int,
+                                     pending_row: PendingRow | None = None):
         logger.info(f"Getting prices for: {productName}")
-        all_product_prices: List[ProductInfo] = self._get_all_prices(
-            productSearchNames)
-        best_product: ProductInfo | None = None
-        for product in all_product_prices:
-            logger.info(f"Product: {product.name}, Price: {product.price}")
-            if best_product is None or product.price < best_product.price:
-                best_product = product
-            elif product.price == best_product.price:
-                if product.scraper.get_priority() < best_product.scraper.get_priority():
-                    best_product = product
+        row_number = pending_row.row_info.row_number if pending_row is not None else None
+        all_product_prices: List[ProductInfo] = self._get_row_prices(productSearchNames, pending_row)
+        best_product = self._confirm_best_product(productSearchNames, all_product_prices)
 
         if best_product is None:
             logger.error(f"Couldn't find product: {productName}")
-            self._store_unbought_product(productName, quantity)
+            self._store_unbought_product(productName, quantity, row_number)
             return
 
         logger.info(
             f"Best product: {best_product.name}, Price: {best_product.price}, added To {best_product.scraper.get_name()}")
         try:
-            if product.scraper.add_product_to_cart(best_product.name, quantity):
+            with best_product.scraper.lock:
+                added_to_cart = best_product.scraper.add_product_to_cart(best_product.name, quantity)
+            if added_to_cart:
                 self._store_bought_product(
-                    productName, all_product_prices, product.scraper.get_name())
+                    productName, all_product_prices, best_product.scraper.get_name(), row_number, quantity)
             else:
                 logger.error(
                     f"Product found, but couldn't be added to cart: {productName}")
-                self._store_unbought_product(productName, quantity)
+                self._store_unbought_product(productName, quantity, row_number)
         except Exception as e:
-            raise Exception(f"{product.scraper.get_name()}: {str(e)}")
+            raise Exception(f"{best_product.scraper.get_name()}: {str(e)}")
+
+    def _confirm_best_product(self, productSearchNames: list, all_product_prices: List[ProductInfo]) -> ProductInfo | None:
+        """
+        Preliminary prices are searched again on the live site until the best product is a confirmed one.
+        This also leaves the live search result in the browser, which add_product_to_cart relies on
+        """
+        best_product = self._select_best_product(all_product_prices)
+        while best_product is not None and best_product.preliminary:
+            logger.info(f"TaskHandler: Confirming the preliminary price of {best_product.name} on {best_product.scraper.get_name()}")
+            confirmed_product = self._get_price_from_scraper(best_product.scraper, productSearchNames, use_cache=False)
+            best_product_index = all_product_prices.index(best_product)
+            if confirmed_product is None:
+                del all_product_prices[best_product_index]
+            else:
+                all_product_prices[best_product_index] = confirmed_product
+            best_product = self._select_best_product(all_product_prices)
+        return best_product
+
+    def _select_best_product(self, all_product_prices: List[ProductInfo]) -> ProductInfo | None:
+        """
+        Picks the lowest price. On equal prices the scraper with the lower priority value wins
+        """
+        best_product: ProductInfo | None = None
+        for product in all_product_prices:
+            logger.info(f"Product: {product.name}, Price: {product.price}")
+            if best_product is None or product.price < best_product.price:
+                best_product = product
+            elif product.price == best_product.price:
+                if product.scraper.get_priority() < best_product.scraper.get_priority():
+                    best_product = product
+        return best_product
+
+    def _get_row_prices(self, productSearchNames: list, pending_row: PendingRow | None) -> List[ProductInfo]:
+        if pending_row is None or pending_row.prefetched_prices is None:
+            return self._get_all_prices(productSearchNames)
+
+        remaining_scrapers = [scraper for scraper in self.scrapers if scraper not in pending_row.prefetched_scrapers]
+        result = self._get_all_prices(productSearchNames, remaining_scrapers)
+        try:
+            result += pending_row.prefetched_prices.result(timeout=ScraperConfig.PRICE_LOOKUP_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            logger.error(
+                f"TaskHandler: Prefetched prices from {[scraper.get_name() for scraper in pending_row.prefetched_scrapers]} "
+                f"weren't ready within {ScraperConfig.PRICE_LOOKUP_TIMEOUT_SECONDS} seconds, skipping them for this product")
+
+        # Keep the report in the order of the task's distributors
+        result.sort(key=lambda product_info: self.scrapers.index(product_info.scraper))
+        return result
 
-    def _get_all_prices(self, productSearchNames: list) -> List[ProductInfo]:
+    def _get_all_prices(self, productSearchNames: list, scrapers: List[BrowserCommon] | None = None,
+                        parallel: bool = True) -> List[ProductInfo]:
+        if scrapers is None:
+            scrapers = self.scrapers
         logger.info(
             f"TaskHandler: Getting all prices for: {productSearchNames}")
         result: List[ProductInfo] = []
-        for scraper in self.scrapers:
+        if parallel and ScraperConfig.PARALLEL_PRICE_LOOKUP and len(scrapers) > 1:
+            futures = [
+                (scraper, self.price_lookup_executor.submit(self._get_price_from_scraper, scraper, productSearchNames))
+                for scraper in scrapers
+            ]
+            # All lookups start together, so a shared deadline gives each distributor the same timeout
+            deadline = time.monotonic() + ScraperConfig.PRICE_LOOKUP_TIMEOUT_SECONDS
+            for scraper, future in futures:
+                try:
+                    product_info = future.result(timeout=max(0, deadline - time.monotonic()))
+                except FutureTimeoutError:
+                    logger.error(
+                        f"TaskHandler: {scraper.get_name()} didn't return a price within "
+                        f"{ScraperConfig.PRICE_LOOKUP_TIMEOUT_SECONDS} seconds, skipping it for this product")
+                    continue
+                if product_info is not None:
+                    result.append(product_info)
+        else:
+            for scraper in scrapers:
+                product_info = self._get_price_from_scraper(scraper, productSearchNames)
+                if product_info is not None:
+                    result.append(product_info)
+
+        logger.info(
+            f"TaskHandler: All prices: {[(info.scraper.get_name(), info.name, info.price) for info in result]}")
+        return result
+
+    def _get_price_from_scraper(self, scraper: BrowserCommon, productSearchNames: list, use_cache: bool = True) -> ProductInfo | None:
+        if use_cache:
+            cached_price = self.price_cache.get(scraper.get_name(), self.taskItem.pharmacy_id, productSearchNames)
+            if cached_price is not None:
+                if not cached_price.is_found():
+                    return None
+                return ProductInfo(scraper, cached_price.product_name, cached_price.price, preliminary=True)
+            catalog_product = self._get_price_from_catalog(scraper, productSearchNames)
+            if catalog_product is not None:
+                return catalog_product
+
+        # A lookup that timed out may still be running, so wait for it before driving the same browser.
+        # Stateless lookups don't drive the browser and may overlap with each other and with cart updates
+        with nullcontext() if scraper.stateless_price_lookup else scraper.lock:
             try:
                 name, price = scraper.get_product_name_and_price(
                     productSearchNames)
+            except PriceLookupError as e:
+                # Not cached, the distributor may well sell the product
+                logger.error(f"TaskHandler: Couldn't look up the price on {scraper.get_name()}: {e}")
+                return None
             except StaleElementReferenceException:
                 # retry
                 scraper.refresh_page()
@@ -276,23 +732,54 @@ class TaskHandler:
                         productSearchNames)
                 except Exception as e:
                     logger.error(
-                        "TaskHandler: Couldn't get product name and price: ", e)
-                    continue
-            if price != math.inf:
-                result.append(ProductInfo(scraper, name, price))
-
-        logger.info(
-            f"TaskHandler: All prices: {[(info.scraper.get_name(), info.name, info.price) for info in result]}")
-        return result
-
-    def _store_bought_product(self, original_product_name: str, all_pharmacy_product_infos: List[ProductInfo], bought_from_distributor: str):
+                        f"TaskHandler: Couldn't get product name and price from {scraper.get_name()}: {e}")
+                    return None
+        self.price_cache.put(scraper.get_name(), self.taskItem.pharmacy_id, productSearchNames, name, price)
+        if price == math.inf:
+            return None
+        return ProductInfo(scraper, name, price)
+
+    def _get_price_from_catalog(self, scraper: BrowserCommon, productSearchNames: list) -> ProductInfo | None:
+        """
+        A miss in the catalog doesn't mean the product isn't sold, the live site is searched then
+        """
+        if not ScraperConfig.Catalog.ENABLED:
+            return None
+        try:
+            article = CatalogStore().find_article(scraper.get_name(), productSearchNames)
+        except Exception as e:
+            logger.error(f"TaskHandler: Couldn't search the catalog of {scraper.get_name()}: {e}")
+            return None
+        if article is None:
+            return None
+        logger.info(f"TaskHandler: Catalog candidate of {scraper.get_name()}: {article.name} for {article.price}")
+        return ProductInfo(scraper, article.name, float(article.price), preliminary=True)
+
+    def _store_bought_product(self, original_product_name: str, all_pharmacy_product_infos: List[ProductInfo], bought_from_distributor: str,
+                              row_number: int | None = None, quantity: int = 0):
+        """
+        :param row_number: Checkpoints the decision, None for decisions restored from a checkpoint
+        """
         bought_product = BoughtProductInfo(
             original_product_name, all_pharmacy_product_infos, bought_from_distributor)
         self.bought_products.append(bought_product)
-
-    def _store_unbought_product(self, product_name: str, quantity: int):
+        self.report_exporter.add_bought_product(
+            original_product_name,
+            {product_info.scraper.get_name(): (product_info.name, product_info.price)
+             for product_info in all_pharmacy_product_infos},
+            bought_from_distributor)
+        if row_number is not None:
+            self.checkpoint_store.add(RowCheckpoint(
+                row_number, original_product_name, quantity,
+                [(product_info.scraper.get_name(), product_info.name, product_info.price) for product_info in all_pharmacy_product_infos],
+                bought_from_distributor))
+
+    def _store_unbought_product(self, product_name: str, quantity: int, row_number: int | None = None):
         unbought_product = UnboughtProductInfo(product_name, quantity)
         self.unbought_products.append(unbought_product)
+        self.report_exporter.add_unbought_product(product_name, quantity)
+        if row_number is not None:
+            self.checkpoint_store.add(RowCheckpoint(row_number, product_name, quantity, [], None))
 
     def _generate_report(self) -> TaskReport:
         """
@@ -0,0 +1,114 @@
+import logging
+import time
+from typing import Any, List
+
+from configuration.common import ScraperConfig
+from messaging.messaging import FileType, ScraperTaskActionType, ScraperTaskItem
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+SMALL_LANE = "small"
+BULK_LANE = "bulk"
+
+
+def get_row_count(task_item: ScraperTaskItem) -> int | None:
+    """
+    The row count computed when the task was created, or the rows of the JSON content. None if it is not known
+    """
+    if task_item.row_count is not None:
+        return task_item.row_count
+    if task_item.file_type == FileType.JSON_CONTENT and isinstance(task_item.file_data, dict):
+        rows = task_item.file_data.get("rows")
+        if isinstance(rows, list):
+            return len(rows)
+    return None
+
+
+class ScheduledTask:
+    def __init__(self, message: Any, task_item: ScraperTaskItem):
+        # The Service Bus message, settled once the task is done
+        self.message = message
+        self.task_item = task_item
+        row_count = get_row_count(task_item)
+        self.row_count = row_count if row_count is not None else ScraperConfig.Scheduler.UNKNOWN_ROW_COUNT
+        self.lane = SMALL_LANE if self.row_count <= ScraperConfig.Scheduler.SMALL_TASK_MAX_ROWS else BULK_LANE
+        # A running task waits for its price shards, so they go before the other bulk tasks
+        self.is_price_shard = task_item.task_type == ScraperTaskActionType.PRICE_SHARD
+        self.enqueued_at = time.monotonic()
+
+    def get_aged_row_count(self, now: float) -> float:
+        """
+        The row count the bulk lane orders by, it shrinks while the task waits so large tasks don't starve
+        """
+        waited_minutes = (now - self.enqueued_at) / 60
+        return self.row_count - ScraperConfig.Scheduler.AGING_ROWS_PER_MINUTE * waited_minutes
+
+    def __str__(self) -> str:
+        return f"ScheduledTask(task_id={self.task_item.id}, row_count={self.row_count}, lane={self.lane})"
+
+
+class TaskScheduler:
+    """
+    Decides which of the received tasks runs next. Small tasks run first in arrival order and SMALL_LANE_RESERVED_SLOTS
+    slots are kept for them. Bulk tasks run shortest first, after the price shards of other tasks, and a bulk task
+    that waited until its aged row count is small competes with the small tasks by arrival time. Only the receiver
+    thread uses it
+    """
+
+    def __init__(self, task_slots: int):
+        self.small_lane: List[ScheduledTask] = []
+        self.bulk_lane: List[ScheduledTask] = []
+        self.running_bulk_count = 0
+        # With a single slot nothing can be reserved, the small tasks then only jump the queue
+        self.max_running_bulk = max(1, task_slots - max(0, ScraperConfig.Scheduler.SMALL_LANE_RESERVED_SLOTS))
+
+    def __len__(self) -> int:
+        return len(self.small_lane) + len(self.bulk_lane)
+
+    def add(self, scheduled_task: ScheduledTask):
+        logger.info(f"TaskScheduler: Queued {scheduled_task}")
+        if scheduled_task.lane == SMALL_LANE:
+            self.small_lane.append(scheduled_task)
+        else:
+            self.bulk_lane.append(scheduled_task)
+
+    def take(self) -> ScheduledTask | None:
+        """
+        The task to run in a free slot, or None if no queued task may run now
+        """
+        now = time.monotonic()
+        best_bulk: ScheduledTask | None = None
+        if len(self.bulk_lane) > 0 and self.running_bulk_count < self.max_running_bulk:
+            best_bulk = min(self.bulk_lane, key=lambda scheduled_task: (
+                not scheduled_task.is_price_shard, scheduled_task.get_aged_row_count(now), scheduled_task.enqueued_at))
+        first_small = self.small_lane[0] if len(self.small_lane) > 0 else None
+
+        if best_bulk is not None and first_small is not None:
+            is_aged = best_bulk.get_aged_row_count(now) <= ScraperConfig.Scheduler.SMALL_TASK_MAX_ROWS
+            scheduled_task = best_bulk if is_aged and best_bulk.enqueued_at < first_small.enqueued_at else first_small
+        else:
+            scheduled_task = first_small if first_small is not None else best_bulk
+        if scheduled_task is None:
+            return None
+
+        if scheduled_task.lane == SMALL_LANE:
+            self.small_lane.remove(scheduled_task)
+        else:
+            self.bulk_lane.remove(scheduled_task)
+            self.running_bulk_count += 1
+        logger.info(f"TaskScheduler: Starting {scheduled_task} after {now - scheduled_task.enqueued_at:.1f} seconds in the queue")
+        return scheduled_task
+
+    def done(self, scheduled_task: ScheduledTask):
+        if scheduled_task.lane == BULK_LANE:
+            self.running_bulk_count -= 1
+
+    def take_all(self) -> List[ScheduledTask]:
+        """
+        Empties the queue, e.g. when the worker shuts down
+        """
+        scheduled_tasks = self.small_lane + self.bulk_lane
+        self.small_lane = []
+        self.bulk_lane = []
+        return scheduled_tasks
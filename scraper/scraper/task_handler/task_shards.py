@@ -0,0 +1,227 @@
+import json
+import logging
+import math
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Tuple
+
+from azure.servicebus import ServiceBusClient, ServiceBusMessage
+from azure.servicebus.exceptions import MessageSizeExceededError
+
+from configuration.common import AzureConfig, ScraperConfig
+from dal.task_shards import PricedRow, ShardStatus, TaskShard, TaskShardStore
+from messaging.messaging import ScraperTaskActionType, ScraperTaskItem
+from task_handler.task_scheduler import get_row_count
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Tells the shards sent by this worker from the ones sent by other workers
+WORKER_ID = uuid.uuid4().hex
+
+
+def plan_shards(task_id: str, row_count: int) -> List[TaskShard]:
+    """
+    Splits the rows into shards of about the same size. Empty if the task is too small to be split
+    """
+    if row_count < ScraperConfig.Sharding.MIN_ROWS:
+        return []
+    shard_count = min(max(1, ScraperConfig.Sharding.MAX_SHARDS), math.ceil(row_count / max(1, ScraperConfig.Sharding.ROWS_PER_SHARD)))
+    if shard_count < 2:
+        return []
+    shards: List[TaskShard] = []
+    first_row = 0
+    for index in range(shard_count):
+        shard_row_count = row_count // shard_count + (1 if index < row_count % shard_count else 0)
+        shards.append(TaskShard(task_id, index, first_row, shard_row_count))
+        first_row += shard_row_count
+    return shards
+
+
+def is_own_shard(task_item: ScraperTaskItem) -> bool:
+    return task_item.task_type == ScraperTaskActionType.PRICE_SHARD and isinstance(task_item.shard, dict) \
+        and task_item.shard.get("sender_id") == WORKER_ID
+
+
+def cancel_own_shard(task_item: ScraperTaskItem):
+    """
+    A worker that receives a shard it sent doesn't price it next to the task, which would take a slot and browsers
+    of the same worker. The shard is cancelled instead, so the task prices its rows itself
+    """
+    shard = TaskShard.from_message(task_item.id, task_item.shard or {})
+    if TaskShardStore(task_item.id).cancel(shard):
+        logger.info(f"ShardCoordinator: Received {shard} that this worker sent, its task prices the rows itself")
+
+
+class ShardCoordinator:
+    """
+    Runs on the worker of a large task. The first shard is priced by the task itself while the other shards
+    are priced by other workers, which receive them as "price_shard" tasks. The task reaches the rows of the
+    other shards after filling the carts with the first one, and uses their prices as preliminary ones.
+    A shard that stalls for STALL_SECONDS is cancelled and its rows are priced by the task itself
+    """
+
+    def __init__(self, task_item: ScraperTaskItem, shutdown_event: threading.Event | None = None):
+        self.task_item = task_item
+        self.shutdown_event = shutdown_event
+        self.store = TaskShardStore(task_item.id)
+        # The shards priced by other workers
+        self.shards: List[TaskShard] = []
+        self.priced_rows: Dict[int, PricedRow] = {}
+        # When the status or the progress of a shard last changed, by shard index
+        self.changed_at: Dict[int, float] = {}
+        self.refreshed_at = 0.0
+
+    def start(self) -> bool:
+        """
+        Sends the shards of a large task. False if the task isn't split
+        """
+        row_count = get_row_count(self.task_item)
+        if not self.store.enabled or row_count is None:
+            return False
+        planned_shards = plan_shards(self.task_item.id, row_count)
+        if len(planned_shards) == 0:
+            return False
+
+        previous_shards = self.store.load()
+        new_shards: List[TaskShard] = []
+        for shard in planned_shards[1:]:
+            previous_shard = previous_shards.get(shard.index)
+            if previous_shard is not None and previous_shard.status == ShardStatus.DONE \
+                    and (previous_shard.first_row, previous_shard.row_count) == (shard.first_row, shard.row_count):
+                # A resumed task keeps the prices of its earlier run, they are confirmed before buying anyway
+                self._add_priced_rows(previous_shard)
+                self.shards.append(previous_shard)
+            else:
+                new_shards.append(shard)
+                self.shards.append(shard)
+
+        if len(new_shards) > 0 and not (self.store.save(new_shards) and self._send_shards(new_shards)):
+            logger.error(f"ShardCoordinator: Couldn't send the shards of task {self.task_item.id}, pricing their rows here")
+            for shard in new_shards:
+                # A shard that was sent before the failure is skipped by its worker
+                self.store.cancel(shard)
+                shard.status = ShardStatus.CANCELLED
+
+        now = time.monotonic()
+        self.changed_at = {shard.index: now for shard in self.shards}
+        self.refreshed_at = now
+        logger.info(f"ShardCoordinator: Task {self.task_item.id} with {row_count} rows is priced by {len(self.shards)} more workers: "
+                    f"{[str(shard) for shard in self.shards]}")
+        return any(shard.status != ShardStatus.CANCELLED for shard in self.shards)
+
+    def _get_shard_task_json(self, shard: TaskShard) -> dict:
+        task_json = self.task_item.to_json()
+        task_json["task_type"] = ScraperTaskActionType.PRICE_SHARD.value
+        # The scheduler of the receiving worker orders the shard by its own size
+        task_json["row_count"] = shard.row_count
+        task_json["shard"] = {**shard.to_message(), "sender_id": WORKER_ID}
+        return task_json
+
+    def _send_shards(self, shards: List[TaskShard]) -> bool:
+        try:
+            with ServiceBusClient.from_connection_string(AzureConfig.ServiceBusTasks.CONNECTION_STRING) as client:
+                with client.get_queue_sender(queue_name=AzureConfig.ServiceBusTasks.QUEUE_NAME) as sender:
+                    batch = sender.create_message_batch()
+                    for shard in shards:
+                        sb_message = ServiceBusMessage(json.dumps(self._get_shard_task_json(shard)), content_type="application/json")
+                        try:
+                            batch.add_message(sb_message)
+                        except MessageSizeExceededError:
+                            sender.send_messages(batch)
+                            batch = sender.create_message_batch()
+                            batch.add_message(sb_message)
+                    sender.send_messages(batch)
+            return True
+        except Exception as e:
+            logger.error(f"ShardCoordinator: Couldn't send the shard messages: {e}")
+            return False
+
+    def _add_priced_rows(self, shard: TaskShard):
+        for row in shard.rows:
+            self.priced_rows[row.row_index] = row
+
+    def _refresh(self):
+        shards_by_index = self.store.load(with_rows=False)
+        now = time.monotonic()
+        self.refreshed_at = now
+        for position, shard in enumerate(self.shards):
+            stored_shard = shards_by_index.get(shard.index)
+            if shard.is_finished() or stored_shard is None:
+                continue
+            if (stored_shard.status, stored_shard.priced_row_count) != (shard.status, shard.priced_row_count):
+                self.changed_at[shard.index] = now
+            if stored_shard.status == ShardStatus.DONE:
+                stored_shard.rows = self.store.load_rows(stored_shard)
+                logger.info(f"ShardCoordinator: {stored_shard} priced {len(stored_shard.rows)} rows")
+                self._add_priced_rows(stored_shard)
+            self.shards[position] = stored_shard
+
+    def get_row_offers(self, row_index: int, original_product_name: str,
+                       on_wait: Callable[[], None] | None = None) -> List[Tuple[str, str, float]] | None:
+        """
+        The (distributor, product name, price) offers another worker found for the row, waiting for its shard if needed.
+        None if the row has to be priced by the task itself
+        """
+        position = next((position for position, shard in enumerate(self.shards) if shard.contains(row_index)), None)
+        if position is None:
+            return None
+        if not self.shards[position].is_finished():
+            self._wait_for_shard(position, on_wait)
+
+        priced_row = self.priced_rows.pop(row_index, None)
+        if priced_row is None:
+            return None
+        if priced_row.original_product_name != original_product_name:
+            logger.warning(f"ShardCoordinator: Row {row_index} was priced as {priced_row.original_product_name} "
+                           f"instead of {original_product_name}, pricing it again")
+            return None
+        return priced_row.offers
+
+    def _wait_for_shard(self, position: int, on_wait: Callable[[], None] | None):
+        logger.info(f"ShardCoordinator: Waiting for {self.shards[position]}")
+        while True:
+            self._refresh()
+            shard = self.shards[position]
+            if shard.is_finished():
+                return
+            if self.shutdown_event is not None and self.shutdown_event.is_set():
+                return
+            if time.monotonic() - self.changed_at[shard.index] >= ScraperConfig.Sharding.STALL_SECONDS:
+                if not self.store.cancel(shard):
+                    # It finished in the meantime, unless the database can't be reached
+                    self._refresh()
+                    if self.shards[position].is_finished():
+                        return
+                logger.warning(f"ShardCoordinator: {shard} made no progress for {ScraperConfig.Sharding.STALL_SECONDS} seconds, "
+                               f"pricing its rows here")
+                self.shards[position].status = ShardStatus.CANCELLED
+                return
+            if on_wait is not None:
+                on_wait()
+            if self.shutdown_event is not None:
+                self.shutdown_event.wait(ScraperConfig.Sharding.POLL_SECONDS)
+            else:
+                time.sleep(ScraperConfig.Sharding.POLL_SECONDS)
+
+    def get_priced_row_counts(self) -> Tuple[int, int]:
+        """
+        The rows priced by the other workers so far and the rows they are expected to price
+        """
+        if time.monotonic() - self.refreshed_at >= ScraperConfig.Sharding.POLL_SECONDS:
+            self._refresh()
+        shards = [shard for shard in self.shards if shard.status not in (ShardStatus.FAILED, ShardStatus.CANCELLED)]
+        return sum(shard.priced_row_count for shard in shards), sum(shard.row_count for shard in shards)
+
+    def finish(self, succeeded: bool):
+        """
+        The shards of a task that succeeded are removed, the others are kept for a resume.
+        Shards that weren't priced yet are cancelled, so their workers skip them
+        """
+        if succeeded:
+            self.store.clear()
+            return
+        for shard in self.shards:
+            if not shard.is_finished():
+                self.store.cancel(shard)
@@ -1,6 +1,11 @@
 import json
 import logging
+import queue
+import threading
+import time
+from typing import Dict, List
 from azure.servicebus import ServiceBusClient, ServiceBusMessage
+from azure.servicebus.exceptions import MessageSizeExceededError
 from bson import ObjectId
 
 from configuration.common import AzureConfig
@@ -9,16 +14,36 @@ from messaging.messaging import ScraperTaskItemStatus, ScraperTaskUpdates, TaskS
 # Create a logger for this module
 logger = logging.getLogger(__name__)
 
+# A batch that couldn't be sent is tried once more with a new sender
+SEND_ATTEMPTS = 2
+
+
+class QueuedUpdate:
+    def __init__(self, task_id: str, body: str, is_final: bool):
+        self.task_id = task_id
+        self.body = body
+        # Errors and successes are never merged, and the publisher waits until they are sent
+        self.is_final = is_final
+        self.sent = threading.Event()
+
 
 class TaskUpdatePublisher:
     """
-    This class is responsible for publishing the task updates to the Azure Service Bus queue for task updates
+    This class is responsible for publishing the task updates to the Azure Service Bus queue for task updates.
+    The updates are sent by a background thread over one sender that stays open. Progress updates of a task
+    that follow each other within COALESCE_WINDOW_SECONDS are merged into the latest one, errors and successes
+    are sent right away, after the progress updates before them, and the publishing call waits for them
     """
 
     def __init__(self):
         self.CONNECTION_STRING = AzureConfig.ServiceBusTasksUpdates.CONNECTION_STRING
         self.QUEUE_NAME = AzureConfig.ServiceBusTasksUpdates.QUEUE_NAME
         self.servicebus_client = ServiceBusClient.from_connection_string(conn_str=self.CONNECTION_STRING, logging_enable=True)
+        self.sender = None
+        self.updates: queue.Queue[QueuedUpdate | None] = queue.Queue(maxsize=max(1, AzureConfig.ServiceBusTasksUpdates.MAX_QUEUED_UPDATES))
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="task-update-publisher", daemon=True)
+        self.thread.start()
 
     def publish_error(self, account_id: ObjectId, task_id: str, message: str, detailed_error_message: str, progress: int, image_urls: list[str] | None = None):
         self._publish(
@@ -59,14 +84,108 @@ class TaskUpdatePublisher:
         )
 
         try:
-            self._send_message_to_servicebus_queue(json.dumps(update_message.to_json()))
+            update = QueuedUpdate(str(task_id), json.dumps(update_message.to_json()), status.status != TaskStatus.IN_PROGRESS)
         except Exception as e:
             logger.error(f"TaskUpdatePublisher: Couldn't publish the message: {e}")
+            return
+
+        if self.closed or not self.thread.is_alive():
+            # Nothing else uses the sender once the thread has stopped
+            logger.warning("TaskUpdatePublisher: The publisher is closed, sending the update directly")
+            self._send([update])
+            return
+
+        if not update.is_final:
+            try:
+                self.updates.put_nowait(update)
+            except queue.Full:
+                # A later progress update of the task replaces it anyway
+                logger.error(f"TaskUpdatePublisher: The update queue is full, dropping a progress update of task {task_id}")
+            return
+
+        self.updates.put(update)
+        if not update.sent.wait(AzureConfig.ServiceBusTasksUpdates.FINAL_UPDATE_TIMEOUT_SECONDS):
+            logger.error(f"TaskUpdatePublisher: The final update of task {task_id} wasn't sent within "
+                         f"{AzureConfig.ServiceBusTasksUpdates.FINAL_UPDATE_TIMEOUT_SECONDS} seconds")
+
+    def _run(self):
+        # The merged progress updates by task, in the order the tasks first reported
+        pending_progress: Dict[str, QueuedUpdate] = {}
+        flush_at: float | None = None
+        while True:
+            timeout = None if flush_at is None else max(0.0, flush_at - time.monotonic())
+            try:
+                update = self.updates.get(timeout=timeout)
+            except queue.Empty:
+                self._send(list(pending_progress.values()))
+                pending_progress = {}
+                flush_at = None
+                continue
+
+            if update is None:
+                self._send(list(pending_progress.values()))
+                return
+            if update.is_final:
+                self._send(list(pending_progress.values()) + [update])
+                pending_progress = {}
+                flush_at = None
+                continue
 
-    def _send_message_to_servicebus_queue(self, message: str):
-        with self.servicebus_client:
-            sender = self.servicebus_client.get_queue_sender(queue_name=self.QUEUE_NAME)
-            with sender:
-                sb_message = ServiceBusMessage(message, content_type="application/json")
-                sender.send_messages(sb_message)
-                logger.info(f"Sent message to the Service Bus queue: {message}")
+            if update.task_id in pending_progress:
+                logger.debug(f"TaskUpdatePublisher: Merging a progress update of task {update.task_id}")
+            pending_progress[update.task_id] = update
+            if flush_at is None:
+                flush_at = time.monotonic() + AzureConfig.ServiceBusTasksUpdates.COALESCE_WINDOW_SECONDS
+
+    def _send(self, updates: List[QueuedUpdate]):
+        if len(updates) == 0:
+            return
+        for attempt in range(1, SEND_ATTEMPTS + 1):
+            try:
+                self._send_message_batches(updates)
+                break
+            except Exception as e:
+                logger.error(f"TaskUpdatePublisher: Couldn't publish {len(updates)} messages (attempt {attempt}): {e}")
+                self._close_sender()
+        for update in updates:
+            update.sent.set()
+
+    def _send_message_batches(self, updates: List[QueuedUpdate]):
+        if self.sender is None:
+            self.sender = self.servicebus_client.get_queue_sender(queue_name=self.QUEUE_NAME)
+        batch = self.sender.create_message_batch()
+        for update in updates:
+            sb_message = ServiceBusMessage(update.body, content_type="application/json")
+            try:
+                batch.add_message(sb_message)
+            except MessageSizeExceededError:
+                self.sender.send_messages(batch)
+                batch = self.sender.create_message_batch()
+                batch.add_message(sb_message)
+        self.sender.send_messages(batch)
+        for update in updates:
+            logger.info(f"Sent message to the Service Bus queue: {update.body}")
+
+    def _close_sender(self):
+        if self.sender is None:
+            return
+        try:
+            self.sender.close()
+        except Exception as e:
+            logger.warning(f"TaskUpdatePublisher: Couldn't close the sender: {e}")
+        self.sender = None
+
+    def close(self):
+        """
+        Sends the queued updates and closes the connection
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.updates.put(None)
+        self.thread.join()
+        self._close_sender()
+        try:
+            self.servicebus_client.close()
+        except Exception as e:
+            logger.warning(f"TaskUpdatePublisher: Couldn't close the Service Bus client: {e}")